@@ -0,0 +1,182 @@
+"""
+Incremental reader for PowerMTA accounting files (acct.csv).
+
+The remote side is a single shell command that reports the file identity
+(inode, size) and streams bytes from the last ingested offset. When the inode
+changed (PMTA rotated the file) the unread remainder of the rotated file is
+streamed first, so no records are lost across rotations.
+
+Parsing is streaming: bytes are read in fixed-size chunks, split into complete
+lines and fed to the csv module, so memory use does not depend on file size.
+"""
+import csv
+import shlex
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+ACCT_PATH = "/var/log/pmta/acct.csv"
+DEFAULT_CHUNK_BYTES = 256 * 1024
+
+# PMTA's default accounting layout, used when resuming mid-file without a stored header
+DEFAULT_HEADER = [
+    "type", "timeLogged", "timeQueued", "orig", "rcpt", "orcpt", "dsnAction",
+    "dsnStatus", "dsnDiag", "dsnMta", "bounceCat", "srcType", "srcMta",
+    "dlvType", "dlvSourceIp", "dlvDestinationIp", "dlvEsmtpAvailable",
+    "dlvSize", "vmta", "jobId", "envId", "queue", "vmtaPool",
+]
+
+_PULL_SCRIPT = r"""
+f={path}
+[ -f "$f" ] || {{ echo "missing 0 0 0"; exit 0; }}
+set -- $(stat -c '%i %s' "$f")
+ino=$1; size=$2; start={offset}; old=""; old_bytes=0
+if [ "$ino" != "{inode}" ]; then
+    start=0
+    if [ -n "{inode}" ]; then
+        old=$(find "$(dirname "$f")" -maxdepth 1 -type f -inum "{inode}" 2>/dev/null | head -1)
+        if [ -n "$old" ]; then
+            old_bytes=$(( $(stat -c %s "$old") - {offset} ))
+            [ "$old_bytes" -lt 0 ] && old_bytes=0
+        fi
+    fi
+elif [ "$size" -lt "$start" ]; then
+    start=0
+fi
+echo "$ino $size $start $old_bytes"
+[ "$old_bytes" -gt 0 ] && tail -c +$(( {offset} + 1 )) "$old" | head -c "$old_bytes"
+tail -c +$(( start + 1 )) "$f" | head -c {max_bytes}
+"""
+
+
+def build_pull_command(path: str, inode: Optional[str], offset: int, max_bytes: int) -> str:
+    """Shell command that prints '<inode> <size> <start> <old_bytes>' and then the unread bytes."""
+    script = _PULL_SCRIPT.format(
+        path=shlex.quote(path),
+        inode=str(inode) if str(inode or "").isdigit() else "",
+        offset=int(offset or 0),
+        max_bytes=int(max_bytes),
+    )
+    return f"sh -c {shlex.quote(script)}"
+
+
+def parse_identity(line: str) -> Optional[Dict[str, Any]]:
+    parts = (line or "").split()
+    if len(parts) != 4 or parts[0] == "missing":
+        return None
+    try:
+        return {
+            "inode": parts[0],
+            "size": int(parts[1]),
+            "start": int(parts[2]),
+            "old_bytes": int(parts[3]),
+        }
+    except ValueError:
+        return None
+
+
+class LimitedReader:
+    """Exposes at most `limit` bytes of `stream` through read()."""
+
+    def __init__(self, stream: Any, limit: int):
+        self._stream = stream
+        self.remaining = max(0, int(limit))
+
+    def read(self, n: int) -> bytes:
+        if self.remaining <= 0:
+            return b""
+        data = self._stream.read(min(n, self.remaining))
+        self.remaining -= len(data)
+        return data
+
+    def drain(self, chunk_bytes: int = DEFAULT_CHUNK_BYTES) -> None:
+        while self.read(chunk_bytes):
+            pass
+
+
+def _iter_lines(stream: Any, chunk_bytes: int) -> Iterator[bytes]:
+    """Yields complete lines (with their newline). A trailing fragment without newline is held back."""
+    pending = b""
+    while True:
+        chunk = stream.read(chunk_bytes)
+        if not chunk:
+            return
+        pending += chunk
+        start = 0
+        while True:
+            nl = pending.find(b"\n", start)
+            if nl == -1:
+                break
+            yield pending[start:nl + 1]
+            start = nl + 1
+        pending = pending[start:]
+
+
+def iter_acct_records(
+    stream: Any,
+    start_offset: int,
+    header: Optional[List[str]] = None,
+    chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+) -> Iterator[Tuple[Dict[str, str], int, List[str]]]:
+    """
+    Yields (record, end_offset, header) for every complete record in `stream`.
+    end_offset is the file offset just past the record, safe to persist as a resume point.
+    """
+    consumed = [0]
+
+    def text_lines():
+        for raw in _iter_lines(stream, chunk_bytes):
+            consumed[0] += len(raw)
+            yield raw.decode("utf-8", errors="replace")
+
+    columns = list(header) if header else None
+    try:
+        for row in csv.reader(text_lines()):
+            if not row:
+                continue
+            if row[0] == "type":
+                columns = row
+                continue
+            cols = columns or DEFAULT_HEADER
+            yield dict(zip(cols, row)), start_offset + consumed[0], cols
+    except csv.Error:
+        # Unterminated quoted field at the end of the available data: resume from the last good record
+        return
+
+
+def _parse_time(value: str) -> Optional[int]:
+    value = (value or "").strip()
+    if not value:
+        return None
+    for fmt in ("%Y-%m-%d %H:%M:%S%z", "%Y-%m-%d %H:%M:%S"):
+        try:
+            return int(datetime.strptime(value, fmt).timestamp())
+        except ValueError:
+            continue
+    return None
+
+
+def _clip(value: Optional[str], size: int) -> Optional[str]:
+    if value is None:
+        return None
+    value = value.strip()
+    return value[:size] if value else None
+
+
+def to_row(record: Dict[str, str], server_id: int) -> Dict[str, Any]:
+    """Maps a raw accounting record to the compact acct_records columns."""
+    rcpt = record.get("rcpt") or ""
+    return {
+        "server_id": server_id,
+        "record_type": _clip(record.get("type"), 4),
+        "logged_at": _parse_time(record.get("timeLogged")),
+        "orig": _clip(record.get("orig"), 255),
+        "rcpt": _clip(rcpt, 255),
+        "rcpt_domain": _clip(rcpt.rsplit("@", 1)[-1].lower() if "@" in rcpt else None, 255),
+        "vmta": _clip(record.get("vmta"), 100),
+        "dsn_action": _clip(record.get("dsnAction"), 20),
+        "dsn_status": _clip(record.get("dsnStatus"), 20),
+        "dsn_diag": _clip(record.get("dsnDiag"), 255),
+        "bounce_cat": _clip(record.get("bounceCat"), 50),
+        "source_ip": _clip(record.get("dlvSourceIp"), 45),
+        "job_id": _clip(record.get("jobId"), 100),
+    }
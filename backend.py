@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, send_from_directory, make_response
+from flask import Flask, request, jsonify, send_from_directory, make_response, Response
 import pyotp
 import qrcode
 import io
@@ -7,6 +7,7 @@ import paramiko
 import tempfile
 import os
 import threading
+import queue
 import uuid
 import time
 import subprocess
@@ -18,6 +19,7 @@ import socket
 import enum
 import string
 import secrets
+import shlex
 from datetime import datetime, timedelta
 from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, get_jwt
@@ -34,7 +36,31 @@ from dotenv import load_dotenv
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 import glob
-import dns.resolver
+import difflib
+import hashlib
+import zlib
+import dns_engine
+import dns_health
+import fcrdns
+import dns_propagation
+import dnsbl
+import job_events
+import pdns_client
+import zone_transfer
+import log_archive
+from log_follower import LogFollowerHub
+import acct_ingest
+import delivery_metrics
+import pmta_config_ast
+import pmta_config_builder
+import pmta_config_validator
+import pmta_apply
+import pmta_vmta_ops
+import pmta_confd
+import pmta_stats
+import pmta_queue_series
+import pmta_config_diff
+import pmta_tuning
 
 # Load environment variables from .env file
 load_dotenv()
@@ -59,6 +85,12 @@ def get_status_file(user_id):
 INSTALL_LOG_FILE = os.path.join(BASE_DIR, "install_progress.log")
 INSTALL_STATUS_FILE = os.path.join(BASE_DIR, "install_status.json")
 
+# Finished job logs are moved out of BASE_DIR into block-compressed archives
+LOG_ARCHIVE_DIR = os.getenv("LOG_ARCHIVE_DIR", os.path.join(BASE_DIR, "log_archive"))
+LOG_RETENTION_DAYS = float(os.getenv("LOG_RETENTION_DAYS", 30))
+LOG_RETENTION_MAX_MB = float(os.getenv("LOG_RETENTION_MAX_MB", 512))
+LOG_ARCHIVE_IDLE_HOURS = float(os.getenv("LOG_ARCHIVE_IDLE_HOURS", 24))
+
 
 app = Flask(__name__, static_folder='static/assets', template_folder='static', static_url_path='/assets')
 CORS(app) # Enable CORS for frontend
@@ -298,6 +330,10 @@ class InstalledPMTA(db.Model):
     # Stored as JSON
     smtp_details = db.Column(db.JSON, nullable=True) 
     dns_details = db.Column(db.JSON, nullable=True)
+    # {"ips": [...], "dkim_paths": [...], "updated_at": iso} — used for local config validation
+    inventory = db.Column(db.JSON, nullable=True)
+    # {"profile": {...}, "overrides": {...}, "resources": {...}, "vmta_count": n, "updated_at": iso} — see pmta_tuning.py
+    tuning = db.Column(db.JSON, nullable=True)
     
     installed_at = db.Column(db.DateTime, default=datetime.utcnow)
 
@@ -326,6 +362,194 @@ class InstallJob(db.Model):
     started_at    = db.Column(db.DateTime)
     completed_at  = db.Column(db.DateTime)
 
+class AcctCursor(db.Model):
+    """Per-server read position in the PMTA accounting file (inode detects rotation)."""
+    __tablename__ = "acct_cursors"
+
+    id            = db.Column(db.Integer, primary_key=True)
+    server_id     = db.Column(db.Integer, unique=True, nullable=False)
+    path          = db.Column(db.String(255), default=acct_ingest.ACCT_PATH)
+    inode         = db.Column(db.String(32))
+    offset        = db.Column(db.BigInteger, default=0)
+    header        = db.Column(db.Text)
+    records_total = db.Column(db.BigInteger, default=0)
+    last_run_at   = db.Column(db.DateTime)
+    last_error    = db.Column(db.Text)
+
+class AcctRecord(db.Model):
+    """Compact copy of PMTA accounting records (one row per delivery attempt outcome)."""
+    __tablename__ = "acct_records"
+    __table_args__ = (db.Index("ix_acct_records_server_time", "server_id", "logged_at"),)
+
+    id          = db.Column(db.Integer, primary_key=True)
+    server_id   = db.Column(db.Integer, nullable=False)
+    record_type = db.Column(db.String(4))
+    logged_at   = db.Column(db.Integer)   # epoch seconds
+    orig        = db.Column(db.String(255))
+    rcpt        = db.Column(db.String(255))
+    rcpt_domain = db.Column(db.String(255))
+    vmta        = db.Column(db.String(100))
+    dsn_action  = db.Column(db.String(20))
+    dsn_status  = db.Column(db.String(20))
+    dsn_diag    = db.Column(db.String(255))
+    bounce_cat  = db.Column(db.String(50))
+    source_ip   = db.Column(db.String(45))
+    job_id      = db.Column(db.String(100))
+
+class ConfigBlob(db.Model):
+    """zlib-compressed PMTA config content, stored once per distinct SHA-256."""
+    __tablename__ = "pmta_config_blobs"
+
+    id         = db.Column(db.Integer, primary_key=True)
+    sha256     = db.Column(db.String(64), unique=True, nullable=False)
+    size       = db.Column(db.Integer, nullable=False)
+    data       = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ConfigVersion(db.Model):
+    """One applied (or observed) PMTA config on a server."""
+    __tablename__ = "pmta_config_versions"
+    __table_args__ = (db.Index("ix_pmta_config_versions_server", "server_id", "id"),)
+
+    id             = db.Column(db.Integer, primary_key=True)
+    server_id      = db.Column(db.Integer, nullable=False)
+    user_id        = db.Column(db.Integer)
+    install_job_id = db.Column(db.Integer)   # InstallJob.id when written by an install/onboard job
+    blob_sha256    = db.Column(db.String(64), nullable=False)
+    action         = db.Column(db.String(20), default="save")  # snapshot / save / update / install / rollback
+    note           = db.Column(db.String(255))
+    created_at     = db.Column(db.DateTime, default=datetime.utcnow)
+
+class DeliveryRollup(db.Model):
+    """Pre-aggregated delivery counters per time bucket (see delivery_metrics.py)."""
+    __tablename__ = "delivery_rollups"
+    __table_args__ = (
+        db.UniqueConstraint("server_id", "resolution", "bucket", "vmta", "sender_domain", "isp_group",
+                            name="uq_delivery_rollup_key"),
+        db.Index("ix_delivery_rollups_res_bucket", "resolution", "bucket"),
+    )
+
+    id            = db.Column(db.Integer, primary_key=True)
+    server_id     = db.Column(db.Integer, nullable=False)
+    resolution    = db.Column(db.String(10), nullable=False)  # minute / hour / day
+    bucket        = db.Column(db.Integer, nullable=False)     # bucket start, epoch seconds
+    vmta          = db.Column(db.String(100), default="")
+    sender_domain = db.Column(db.String(255), default="")
+    isp_group     = db.Column(db.String(50), default=delivery_metrics.OTHER_GROUP)
+    delivered     = db.Column(db.Integer, default=0)
+    deferred      = db.Column(db.Integer, default=0)
+    bounced       = db.Column(db.Integer, default=0)
+
+
+class QueueSample(db.Model):
+    """Queue depth samples in a fixed ring of time slots (see pmta_queue_series.py)."""
+    __tablename__ = "queue_samples"
+    __table_args__ = (
+        db.Index("ix_queue_samples_server_slot", "server_id", "slot"),
+        db.Index("ix_queue_samples_series", "server_id", "scope", "name", "bucket"),
+    )
+
+    id          = db.Column(db.Integer, primary_key=True)
+    server_id   = db.Column(db.Integer, nullable=False)
+    slot        = db.Column(db.Integer, nullable=False)
+    bucket      = db.Column(db.Integer, nullable=False)   # sample time rounded to the resolution, epoch seconds
+    scope       = db.Column(db.String(10), nullable=False)  # server / domain / vmta
+    name        = db.Column(db.String(255), default="")
+    recipients  = db.Column(db.Integer, default=0)
+    kb          = db.Column(db.Integer, default=0)
+    connections = db.Column(db.Integer, default=0)
+    backoff     = db.Column(db.Boolean, default=False)
+    spool_files = db.Column(db.Integer)                    # server scope only
+
+class DomainHealth(db.Model):
+    """Latest DNS health snapshot per sender domain (see dns_health.py)."""
+    __tablename__ = "domain_health"
+
+    id         = db.Column(db.Integer, primary_key=True)
+    domain_id  = db.Column(db.Integer, unique=True, nullable=False)
+    user_id    = db.Column(db.Integer, nullable=False, index=True)
+    domain     = db.Column(db.String(100), nullable=False)
+    status     = db.Column(db.String(10), nullable=False)  # ok / warn / fail / error
+    checks     = db.Column(db.JSON)
+    checked_at = db.Column(db.DateTime)
+    changed_at = db.Column(db.DateTime)                   # last time any check changed status
+
+class DnsPropagation(db.Model):
+    """Propagation of one domain's provisioned records, watched after an install (see dns_propagation.py)."""
+    __tablename__ = "dns_propagation"
+
+    id           = db.Column(db.Integer, primary_key=True)
+    job_id       = db.Column(db.String(64), nullable=False, index=True)  # InstallJob.job_id
+    user_id      = db.Column(db.Integer, nullable=False, index=True)
+    domain       = db.Column(db.String(100), nullable=False)
+    status       = db.Column(db.String(10), nullable=False, default="watching")  # watching / visible / timeout / error
+    resolvers    = db.Column(db.JSON)  # {label: ip}
+    summary      = db.Column(db.JSON)  # per record: visible_on / resolvers / seconds
+    results      = db.Column(db.JSON)  # per record and resolver
+    started_at   = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
+
+class DnsblListing(db.Model):
+    """One period during which a sending IP was listed on a DNSBL zone (open while delisted_at is NULL)."""
+    __tablename__ = "dnsbl_listings"
+    __table_args__ = (db.Index("ix_dnsbl_listings_open", "delisted_at", "server_id"),)
+
+    id              = db.Column(db.Integer, primary_key=True)
+    server_id       = db.Column(db.Integer, nullable=False)
+    user_id         = db.Column(db.Integer, nullable=False, index=True)
+    ip              = db.Column(db.String(45), nullable=False, index=True)
+    zone            = db.Column(db.String(100), nullable=False)
+    codes           = db.Column(db.JSON)   # A record answers, e.g. ["127.0.0.2"]
+    detail          = db.Column(db.String(255))
+    reason          = db.Column(db.Text)   # TXT record of the listing
+    listed_at       = db.Column(db.DateTime, default=datetime.utcnow)
+    delisted_at     = db.Column(db.DateTime)
+    last_checked_at = db.Column(db.DateTime)
+
+class DnsblScan(db.Model):
+    """One DNSBL scan run."""
+    __tablename__ = "dnsbl_scans"
+
+    id          = db.Column(db.Integer, primary_key=True)
+    trigger     = db.Column(db.String(20))   # schedule / manual
+    servers     = db.Column(db.Integer, default=0)
+    ips         = db.Column(db.Integer, default=0)
+    queries     = db.Column(db.Integer, default=0)
+    cached      = db.Column(db.Integer, default=0)
+    listed      = db.Column(db.Integer, default=0)
+    errors      = db.Column(db.Integer, default=0)
+    started_at  = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+class DkimKey(db.Model):
+    """DKIM public key per server / domain / selector, recorded at install and rotation time."""
+    __tablename__ = "dkim_keys"
+    __table_args__ = (
+        db.UniqueConstraint("server_id", "domain", "selector", name="uq_dkim_keys_server_domain_selector"),
+    )
+
+    id          = db.Column(db.Integer, primary_key=True)
+    server_id   = db.Column(db.Integer, nullable=False, index=True)
+    user_id     = db.Column(db.Integer, nullable=False, index=True)
+    domain      = db.Column(db.String(100), nullable=False, index=True)
+    selector    = db.Column(db.String(63), nullable=False)
+    public_key  = db.Column(db.Text, nullable=False)        # base64 body of the PEM, as published in p=
+    fingerprint = db.Column(db.String(71), nullable=False)  # sha256:<hex> of the DER key
+    key_path    = db.Column(db.String(255))                 # private key on the server
+    source      = db.Column(db.String(20))                  # install / rotate / inventory
+    created_at  = db.Column(db.DateTime, default=datetime.utcnow)  # when this key (fingerprint) was first seen
+    seen_at     = db.Column(db.DateTime, default=datetime.utcnow)  # last time it was read from the server
+
+class DomainHealthEvent(db.Model):
+    """A change in one domain's DNS health between two scans."""
+    __tablename__ = "domain_health_events"
+
+    id          = db.Column(db.Integer, primary_key=True)
+    domain_id   = db.Column(db.Integer, nullable=False, index=True)
+    status_from = db.Column(db.String(10))
+    status_to   = db.Column(db.String(10))
+    changes     = db.Column(db.JSON)  # [{check, from, to}]
+    created_at  = db.Column(db.DateTime, default=datetime.utcnow)
 
 # Initialize DB
 with app.app_context():
@@ -441,6 +665,21 @@ def exec_sudo_command(ssh, command, password):
         
     return stdin, stdout, stderr
 
+def _start_periodic(name, interval_seconds, fn):
+    """Runs fn every interval_seconds on a daemon thread, inside an app context. Errors are logged, never raised."""
+    def _loop():
+        while True:
+            try:
+                with app.app_context():
+                    fn()
+            except Exception as e:
+                _logging.error("[%s] Periodic run failed: %s", name, e)
+            time.sleep(interval_seconds)
+
+    t = threading.Thread(target=_loop, name=name, daemon=True)
+    t.start()
+    return t
+
 # --- Auth Routes ---
 @app.route("/api/auth/register", methods=["POST"])
 @limiter.limit("5 per hour")
@@ -1174,8 +1413,7 @@ def fetch_config():
     ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
     try:
         ssh.connect(server_ip, username=ssh_user, password=ssh_pass, timeout=10)
-        stdin, stdout, stderr = ssh.exec_command("cat /etc/pmta/config")
-        config_content = stdout.read().decode('utf-8')
+        config_content = read_pmta_config(ssh)
         ssh.close()
         return jsonify({"status": "success", "config": config_content})
     except Exception as e:
@@ -1202,30 +1440,31 @@ def save_config():
             server_ip = ip
             ssh_user = user
             ssh_pass = password
+
+    if not isinstance(new_config, str):
+        return jsonify({"status": "error", "message": "config must be the raw PMTA config text"}), 400
+    target = InstalledPMTA.query.filter_by(host_ip=server_ip, user_id=get_jwt_identity()).first()
+    issues = validate_config_text(new_config, target)
+    if pmta_config_validator.has_errors(issues):
+        return jsonify({"status": "error", "message": "Config validation failed", **_validation_response(issues)}), 400
+
     ssh = paramiko.SSHClient()
     ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
     try:
         ssh.connect(server_ip, username=ssh_user, password=ssh_pass, timeout=10)
+        current = snapshot_remote_config(ssh, ssh_pass, target, get_jwt_identity()) if target is not None else None
         
-        # Write to temp file then move
-        # Using echo or cat with heredoc can be tricky with large files/special chars.
-        # Safer to use SFTP
-        sftp = ssh.open_sftp()
-        with sftp.file("/tmp/new_pmta_config", "w") as f:
-            f.write(new_config)
-        sftp.close()
-        
-        # Move and Restart
-        stdin, stdout, stderr = ssh.exec_command("mv /tmp/new_pmta_config /etc/pmta/config && systemctl restart pmta")
-        exit_code = stdout.channel.recv_exit_status()
+        # Upload via SFTP (heredocs are tricky with large files/special chars), then check, swap and restart
+        result = apply_pmta_config(ssh, ssh_pass, new_config, mode="restart", current=current)
         
         ssh.close()
         
-        if exit_code == 0:
-            return jsonify({"status": "success", "message": "Configuration saved and PMTA restarted"})
+        if result["ok"]:
+            if target is not None:
+                store_config_version(target, applied_config_text(new_config, current), user_id=get_jwt_identity(), action="save")
+            return jsonify({"status": "success", "message": "Configuration saved and PMTA restarted", "apply": result})
         else:
-            err = stderr.read().decode('utf-8')
-            return jsonify({"status": "error", "message": f"Failed to apply config: {err}"})
+            return jsonify({"status": "error", "message": f"Failed to apply config: {pmta_apply.describe_failure(result)}", "apply": result})
             
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)})
@@ -1434,8 +1673,10 @@ def _install_pmta_inner():
     db.session.add(job)
     db.session.commit()
 
+    # The stream now exists in this process, so SSE viewers follow it live (see stream_job_events)
+    job_event_bus.publish(job.job_id, "job.status", {"status": "running"})
     threading.Thread(target=run_install, args=(data, user_id, job.id)).start()
-    return jsonify({"status": "started", "message": "Installation started"})
+    return jsonify({"status": "started", "job_id": job.job_id, "message": "Installation started"})
 
 @app.route("/api/jobs/<job_id>", methods=["GET"])
 @jwt_required()
@@ -1551,6 +1792,62 @@ def save_install_status(data, user_id=None):
     except Exception as e:
         print(f"Failed to save install status: {e}")
 
+# ==========================================
+# JOB LOG RETENTION (COMPRESSED ARCHIVES)
+# ==========================================
+
+def _job_log_archive_prefix(user_id):
+    return f"install_{user_id}_"
+
+def enforce_log_retention():
+    return log_archive.enforce_retention(
+        LOG_ARCHIVE_DIR,
+        max_age_seconds=LOG_RETENTION_DAYS * 86400,
+        max_total_bytes=int(LOG_RETENTION_MAX_MB * 1024 * 1024),
+    )
+
+def archive_job_log(user_id, job_db_id=None):
+    """Moves a finished job log out of BASE_DIR into LOG_ARCHIVE_DIR. Silent on any error."""
+    name = f"{_job_log_archive_prefix(user_id)}{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
+    if job_db_id:
+        name += f"_{job_db_id}"
+    try:
+        log_archive.archive_log(
+            get_log_file(user_id), LOG_ARCHIVE_DIR, name,
+            meta={"user_id": str(user_id), "job_id": job_db_id},
+        )
+        enforce_log_retention()
+    except Exception as e:
+        _logging.warning("[archive_job_log] Failed to archive log for user %s: %s", user_id, e)
+
+def read_job_log(user_id, offset=0, max_bytes=None):
+    """
+    Reads a user's job log as bytes: the live file while a job is running,
+    otherwise the newest archive. Returns None if neither exists.
+    """
+    log_path = get_log_file(user_id)
+    if os.path.exists(log_path):
+        with open(log_path, "rb") as f:
+            f.seek(offset, os.SEEK_SET)
+            return f.read() if max_bytes is None else f.read(max_bytes)
+
+    archives = log_archive.list_archives(LOG_ARCHIVE_DIR, prefix=_job_log_archive_prefix(user_id))
+    if not archives:
+        return None
+    return log_archive.read_archive(LOG_ARCHIVE_DIR, archives[0]["name"], offset, max_bytes)
+
+def sweep_job_logs():
+    """Archives live job logs idle for LOG_ARCHIVE_IDLE_HOURS, then enforces retention."""
+    cutoff = time.time() - LOG_ARCHIVE_IDLE_HOURS * 3600
+    for path in glob.glob(os.path.join(BASE_DIR, "install_progress_*.log")):
+        try:
+            if os.path.getmtime(path) < cutoff:
+                user_part = os.path.basename(path)[len("install_progress_"):-len(".log")]
+                archive_job_log(user_part)
+        except OSError:
+            pass
+    enforce_log_retention()
+
 
 def get_install_credentials(user_id=None, server_id=None):
     """
@@ -1571,10 +1868,32 @@ def get_install_credentials(user_id=None, server_id=None):
 
     return None, None, None, 22
 
-def parse_pmta_config(config_str):
-    """Parses PMTA config string into structured JSON"""
-    import re
-    
+# Top-level directive -> (global key, converter) for parse_pmta_config
+_PMTA_GLOBAL_DIRECTIVES = {
+    "run-as-user": ("runAsUser", str),
+    "run-as-group": ("runAsGroup", str),
+    "log-file": ("logFile", str),
+    "http-mgmt-port": ("httpPort", int),
+    "smtp-port": ("smtpPort", int),
+    "max-smtp-out": ("maxConnections", int),
+    "max-msg-per-connection": ("maxMessagesPerConnection", int),
+    "host-name": ("hostname", str),
+    "retry-after": ("retryAfter", str),
+    "bounce-after": ("bounceAfter", str),
+}
+
+def _parse_domain_key(value):
+    """'selector,domain,/path/key.pem' -> dict (None if malformed)"""
+    parts = [p.strip() for p in (value or "").split(",")]
+    if len(parts) != 3 or not all(parts):
+        return None
+    return {"selector": parts[0], "domain": parts[1], "keyPath": parts[2]}
+
+def parse_pmta_config(config_str, tree=None):
+    """Parses PMTA config string into structured JSON (built on pmta_config_ast)"""
+    if tree is None:
+        tree = pmta_config_ast.parse(config_str)
+
     parsed = {
         "global": {
             "runAsUser": "pmta", "runAsGroup": "pmta", "logFile": "/var/log/pmta/log",
@@ -1586,66 +1905,120 @@ def parse_pmta_config(config_str):
         "pools": [],
         "sources": [],
         "users": [],
-        "domains": [], # We are ignoring domains for now mostly
+        "domains": [],
         "bounceRules": [],
-        "patternLists": []
+        "patternLists": [],
+        "errors": tree.errors,
     }
 
-    # Helper to extract key values
-    def get_val(block, key, default=None):
-        m = re.search(f"{key}\\s+(.+)", block)
-        return m.group(1).strip() if m else default
-
-    # 1. Parse VMTAs
-    for m in re.finditer(r'<virtual-mta\s+([^>]+)>(.*?)</virtual-mta>', config_str, re.DOTALL):
-        name = m.group(1).strip()
-        content = m.group(2)
-        parsed["vmtas"].append({
-            "id": f"vmta-{name}",
-            "name": name,
-            "smtpSourceHost": get_val(content, "smtp-source-host") or "",
-            "dkimEnabled": "domain-key" in content,
-            "enabled": True # default
-        })
+    # 0. Global directives
+    for d in tree.directives():
+        if d.key in _PMTA_GLOBAL_DIRECTIVES:
+            field, conv = _PMTA_GLOBAL_DIRECTIVES[d.key]
+            try:
+                parsed["global"][field] = conv(d.value.split()[0] if conv is int else d.value)
+            except (ValueError, IndexError):
+                pass
+        elif d.key == "max-msg-rate" and d.value.endswith("/hour"):
+            try:
+                parsed["global"]["maxMessagesPerHour"] = int(d.value.split("/")[0])
+            except ValueError:
+                pass
+    if tree.get("max-smtp-out") is None:
+        # Connection caps live in <domain *> (tuning profile); show that instead of the placeholder default
+        for block in tree.blocks("domain"):
+            if block.arg.strip() == "*" and (block.get("max-smtp-out") or "").strip().isdigit():
+                parsed["global"]["maxConnections"] = int(block.get("max-smtp-out").strip())
+                break
 
-    # 2. Parse Pools
-    for m in re.finditer(r'<virtual-mta-pool\s+([^>]+)>(.*?)</virtual-mta-pool>', config_str, re.DOTALL):
-        name = m.group(1).strip()
-        content = m.group(2)
-        members = re.findall(r'virtual-mta\s+([^\s]+)', content)
-        parsed["pools"].append({
-            "id": f"pool-{name}",
-            "name": name,
-            "vmtas": [f"vmta-{x}" for x in members],
-            "enabled": True
-        })
-        
-    # 3. Parse Sources
-    for m in re.finditer(r'<source\s+([^>]+)>(.*?)</source>', config_str, re.DOTALL):
-        name = m.group(1).strip()
-        content = m.group(2)
-        parsed["sources"].append({
-            "id": f"source-{name}",
-            "name": name,
-            "alwaysAllowRelaying": "always-allow-relaying yes" in content,
-            "smtpService": "smtp-service yes" in content,
-            "addDateHeader": "add-date-header yes" in content,
-            "requireAuth": "require-auth" in content, # Simple check
-            "defaultVMTA": get_val(content, "default-virtual-mta"),
-            "enabled": True
-        })
+    for block in tree.walk():
+        tag, name = block.tag, block.arg.strip()
+
+        # 1. VMTAs
+        if tag == "virtual-mta":
+            domain_key = _parse_domain_key(block.get("domain-key"))
+            vmta = {
+                "id": f"vmta-{name}",
+                "name": name,
+                "smtpSourceHost": block.get("smtp-source-host") or "",
+                "dkimEnabled": block.get("domain-key") is not None,
+                "enabled": True, # default
+                "line": block.line,
+            }
+            if domain_key:
+                vmta["domainKey"] = domain_key
+            parsed["vmtas"].append(vmta)
+
+        # 2. Pools
+        elif tag == "virtual-mta-pool":
+            parsed["pools"].append({
+                "id": f"pool-{name}",
+                "name": name,
+                "vmtas": [f"vmta-{x.split()[0]}" for x in block.get_all("virtual-mta") if x],
+                "enabled": True,
+                "line": block.line,
+            })
 
-    # 4. Parse Users
-    for m in re.finditer(r'<smtp-user\s+([^>]+)>(.*?)</smtp-user>', config_str, re.DOTALL):
-        name = m.group(1).strip()
-        content = m.group(2)
-        parsed["users"].append({
-            "id": f"user-{name}",
-            "username": name,
-            "password": get_val(content, "password") or "",
-            "source": get_val(content, "source"),
-            "enabled": True
-        })
+        # 3. Sources
+        elif tag == "source":
+            parsed["sources"].append({
+                "id": f"source-{name}",
+                "name": name,
+                "alwaysAllowRelaying": block.get("always-allow-relaying") == "yes",
+                "smtpService": block.get("smtp-service") == "yes",
+                "addDateHeader": block.get("add-date-header") == "yes",
+                "requireAuth": block.get("require-auth") is not None, # Simple check
+                "defaultVMTA": block.get("default-virtual-mta"),
+                "enabled": True,
+                "line": block.line,
+            })
+
+        # 4. Users
+        elif tag == "smtp-user":
+            parsed["users"].append({
+                "id": f"user-{name}",
+                "username": name,
+                "password": block.get("password") or "",
+                "source": block.get("source"),
+                "enabled": True,
+                "line": block.line,
+            })
+
+        # 5. Domains (directives kept verbatim)
+        elif tag == "domain":
+            parsed["domains"].append({
+                "id": f"domain-{name}",
+                "name": name,
+                "settings": {d.key: d.value for d in block.directives()},
+                "line": block.line,
+            })
+
+        # 6. Pattern lists
+        elif tag in ("pattern-list", "smtp-pattern-list"):
+            parsed["patternLists"].append({
+                "id": f"{tag}-{name}",
+                "name": name,
+                "type": tag,
+                "rules": [f"{d.key} {d.value}".strip() for d in block.directives()],
+                "line": block.line,
+            })
+
+        # 7. Bounce categories: "/regex/ category"
+        elif tag == "bounce-category-patterns":
+            for d in block.directives():
+                rule = f"{d.key} {d.value}".strip()
+                pattern, _, category = rule.rpartition(" ")
+                pattern = pattern.strip()
+                if len(pattern) >= 2 and pattern.startswith("/") and pattern.endswith("/"):
+                    pattern = pattern[1:-1]
+                parsed["bounceRules"].append({
+                    "id": f"bounce-{d.line}",
+                    "pattern": pattern,
+                    "category": category,
+                    "type": "hard" if category in ("hard-bounce", "bad-mailbox", "bad-domain") else "soft",
+                    "enabled": True,
+                    "line": d.line,
+                })
 
     return parsed
 
@@ -1681,8 +2054,7 @@ def get_pmta_config():
 
     try:
         ssh = get_ssh_connection(server_ip, ssh_user, ssh_pass, ssh_port)
-        stdin, stdout, stderr = exec_sudo_command(ssh, "cat /etc/pmta/config", ssh_pass)
-        config_content = stdout.read().decode('utf-8')
+        config_content = read_pmta_config(ssh, ssh_pass)
         ssh.close()
         
         parsed_config = parse_pmta_config(config_content)
@@ -1711,8 +2083,7 @@ def get_server_pmta_config(server_id):
              return jsonify({"error": "Credentials not available in current session. Please use 'New Deployment' to reconnect."}), 400
 
         ssh = get_ssh_connection(server.host_ip, server.ssh_username, install_pass, server.ssh_port)
-        stdin, stdout, stderr = exec_sudo_command(ssh, "cat /etc/pmta/config", install_pass)
-        config_content = stdout.read().decode('utf-8')
+        config_content = read_pmta_config(ssh, install_pass)
         ssh.close()
         
         parsed_config = parse_pmta_config(config_content)
@@ -1769,32 +2140,32 @@ def save_server_pmta_config(server_id):
     if not install_ip or install_ip != server.host_ip:
          return jsonify({"error": "Credentials not available. Please reconnect."}), 400
 
+    issues = validate_config_text(build_pmta_config(data), server)
+    if pmta_config_validator.has_errors(issues):
+        return jsonify({"status": "error", "message": "Config validation failed", **_validation_response(issues)}), 400
+
     try:
-        # Convert JSON to PMTA Config String
-        config_str = build_pmta_config(data) # data is the JSON body
-        
         ssh = get_ssh_connection(server.host_ip, server.ssh_username, install_pass, server.ssh_port)
         
-        # Backup first
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        exec_sudo_command(ssh, f"cp /etc/pmta/config /etc/pmta/config.bak.{timestamp}", install_pass)
+        # Backup first (local version history instead of remote .bak copies)
+        current = snapshot_remote_config(ssh, install_pass, server, user_id)
         
-        sftp = ssh.open_sftp()
-        with sftp.file("/tmp/new_pmta_config", "w") as f:
-            f.write(config_str)
-        sftp.close()
+        # Restart only when a startup-only setting changed (?restart=1 forces it); a reload keeps connections open
+        preview = preview_config_change(current or "", build_pmta_config(data))
+        mode = pmta_config_diff.apply_mode(preview, force_restart=request.args.get("restart") == "1")
         
-        # Move and Restart
-        stdin, stdout, stderr = exec_sudo_command(ssh, "mv /tmp/new_pmta_config /etc/pmta/config && systemctl restart pmta", install_pass)
-        exit_code = stdout.channel.recv_exit_status()
+        # Convert JSON to PMTA Config, stream it to the server, check, swap and reload/restart in one transaction
+        result = apply_pmta_config(ssh, install_pass, lambda f: write_pmta_config(data, f), mode=mode, current=current) # data is the JSON body
         
         ssh.close()
         
-        if exit_code == 0:
-            return jsonify({"status": "success", "message": "Configuration saved and PMTA restarted"})
+        if result["ok"]:
+            store_config_version(server, applied_config_text(build_pmta_config(data), current), user_id=user_id, action="save")
+            done = {"restart": "PMTA restarted", "reload": "PMTA reloaded", "none": "no changes to load"}[mode]
+            return jsonify({"status": "success", "message": f"Configuration saved, {done}", "apply": result,
+                            "action": mode, "reasons": preview["reasons"], "summary": preview["summary"]})
         else:
-            err = stderr.read().decode('utf-8')
-            return jsonify({"status": "error", "message": f"Failed to apply config: {err}"})
+            return jsonify({"status": "error", "message": f"Failed to apply config: {pmta_apply.describe_failure(result)}", "apply": result})
             
     except Exception as e:
         print(f"!!! Error in save_server_pmta_config: {e}")
@@ -1825,127 +2196,11 @@ def update_credentials():
 
 def build_pmta_config(config_json):
     """Builds PMTA config string from JSON"""
-    lines = []
-    
-    # 1. Global Settings
-    g = config_json.get("global", {})
-    lines.append("# Global Settings")
-    if g.get("runAsUser"): lines.append(f"run-as-user {g['runAsUser']}")
-    if g.get("runAsGroup"): lines.append(f"run-as-group {g['runAsGroup']}")
-    if g.get("logFile"): lines.append(f"log-file {g['logFile']}")
-    if g.get("httpPort"): lines.append(f"http-mgmt-port {g['httpPort']}")
-    if g.get("httpAdminPort"): lines.append(f"http-access {g.get('hostname', '*') or '*'} admin {g['httpAdminPort']}")
-    if g.get("smtpPort"): lines.append(f"smtp-port {g['smtpPort']}")
-    if g.get("maxConnections"): lines.append(f"max-smtp-out {g['maxConnections']}")
-    if g.get("maxMessagesPerConnection"): lines.append(f"max-msg-per-connection {g['maxMessagesPerConnection']}")
-    if g.get("maxMessagesPerHour"): lines.append(f"max-msg-rate {g['maxMessagesPerHour']}/hour")
-    if g.get("addDateHeader"): lines.append("add-date-header yes")
-    if g.get("addMessageIdHeader"): lines.append("add-message-id-header yes")
-    if g.get("retryAfter"): lines.append(f"retry-after {g['retryAfter']}")
-    if g.get("bounceAfter"): lines.append(f"bounce-after {g['bounceAfter']}")
-    
-    # Enable accounting
-    lines.append("acct-file /var/log/pmta/acct.csv")
-    lines.append("")
-
-    # 2. VMTAs
-    lines.append("# Virtual MTAs")
-    for vmta in config_json.get("vmtas", []):
-        if not vmta.get("enabled", True): continue
-        lines.append(f"<virtual-mta {vmta['name']}>")
-        lines.append(f"    smtp-source-host {vmta['smtpSourceHost']}")
-        if vmta.get("dkimEnabled") and vmta.get("domainKey"):
-            dk = vmta["domainKey"]
-            lines.append(f"    domain-key {dk['selector']},{dk['domain']},{dk['keyPath']}")
-        if vmta.get("maxConnections"):
-            lines.append(f"    max-smtp-out {vmta['maxConnections']}")
-        lines.append("</virtual-mta>")
-        lines.append("")
-
-    # 3. Pools
-    lines.append("# VMTA Pools")
-    for pool in config_json.get("pools", []):
-        if not pool.get("enabled", True): continue
-        lines.append(f"<virtual-mta-pool {pool['name']}>")
-        for member in pool.get("vmtas", []):
-            # member is ID (e.g. vmta-123), need name? 
-            # The frontend passes IDs in vmtas list, but usually name is preferred.
-            # Wait, the structure in parse_pmta_config creates IDs as "vmta-{name}".
-            # In useVMTAManager, addVMTA creates id "vmta-{timestamp}".
-            # This ID mismatch is tricky. 
-            # Ideally the frontend should resolve IDs to names before sending or we handle it here.
-            # But wait, looking at parse_pmta_config:
-            # parsed["vmtas"].append({ "id": f"vmta-{name}", "name": name ... })
-            # If the user added a NEW VMTA, ID is "vmta-timestamp", Name is what they typed.
-            # The pool stores IDs.
-            # We need to lookup the name from the ID.
-            
-            # Helper to find VMTA name by ID
-            vmta_ref = next((v for v in config_json.get("vmtas", []) if v["id"] == member), None)
-            if vmta_ref:
-                lines.append(f"    virtual-mta {vmta_ref['name']}")
-            # Fallback if it's already a name or not found
-            else:
-                 # If the ID looks like "vmta-NAME", extract NAME? 
-                 # Or just use the ID if it matches a name?
-                 # Let's assume for now the frontend might need to ensure consistency or we just output the ID if name not found
-                 # But valid config needs valid VMTA names.
-                 # If existing, ID=vmta-name.
-                 if member.startswith("vmta-"):
-                     lines.append(f"    virtual-mta {member[5:]}")
-                 else:
-                     lines.append(f"    virtual-mta {member}")
-
-        lines.append("</virtual-mta-pool>")
-        lines.append("")
-
-    # 4. Sources
-    lines.append("# Sources")
-    for source in config_json.get("sources", []):
-        if not source.get("enabled", True): continue
-        lines.append(f"<source {source['name']}>")
-        if source.get("alwaysAllowRelaying"): lines.append("    always-allow-relaying yes")
-        if source.get("smtpService"): lines.append("    smtp-service yes")
-        if source.get("requireAuth"): lines.append("    require-auth true")
-        if source.get("addDateHeader"): lines.append("    add-date-header yes")
-        if source.get("defaultVMTA"): 
-            # Same ID resolution potentially needed for defaultVMTA
-            lines.append(f"    default-virtual-mta {source['defaultVMTA']}")
-        if source.get("maxConnections"):
-            lines.append(f"    max-connect-rate {source['maxConnections']}/min") # specific rate limit
-        lines.append("</source>")
-        lines.append("")
-
-    # 5. Users
-    lines.append("# SMTP Users")
-    for user in config_json.get("users", []):
-        if not user.get("enabled", True): continue
-        lines.append(f"<smtp-user {user['username']}>")
-        if user.get("password"): lines.append(f"    password {user['password']}")
-        if user.get("source"): lines.append(f"    source {user['source']}")
-        if user.get("maxMessagesPerHour"): lines.append(f"    max-msg-rate {user['maxMessagesPerHour']}/hour")
-        lines.append("</smtp-user>")
-        lines.append("")
-
-    # 6. Bounce Rules
-    if config_json.get("bounceRules"):
-        lines.append("# Bounce Rules")
-        lines.append("<bounce-category-patterns>")
-        for rule in config_json.get("bounceRules", []):
-            if not rule.get("enabled", True): continue
-            # Format: /pattern/  category
-            # PMTA categories: hard-bounce, soft-bounce, success, ignore...
-            # The UI has: type: hard/soft/defer, action: bounce/retry...
-            # Mapping UI to PMTA categories might be approximate.
-            cat = "soft-bounce"
-            if rule.get("type") == "hard": cat = "hard-bounce"
-            elif rule.get("type") == "defer": cat = "transient-failure" # or similar
-            
-            lines.append(f"    /{rule['pattern']}/    {cat}")
-        lines.append("</bounce-category-patterns>")
-        lines.append("")
+    return pmta_config_builder.build_config(config_json)
 
-    return "\n".join(lines)
+def write_pmta_config(config_json, writer):
+    """Streams the PMTA config built from JSON to a writable (e.g. an SFTP file)."""
+    return pmta_config_builder.write_config(config_json, writer)
 
 @app.route("/api/pmta/config", methods=["POST"])
 @jwt_required()
@@ -1956,31 +2211,36 @@ def save_pmta_config_api():
         return jsonify({"error": "System not installed"}), 400
 
     config_json = request.json
+    target = InstalledPMTA.query.filter_by(host_ip=server_ip, user_id=user_id).first()
+    issues = validate_config_text(build_pmta_config(config_json), target)
+    if pmta_config_validator.has_errors(issues):
+        return jsonify({"status": "error", "message": "Config validation failed", **_validation_response(issues)}), 400
+
     try:
-        new_config_str = build_pmta_config(config_json)
-        
         ssh = get_ssh_connection(server_ip, ssh_user, ssh_pass, ssh_port)
         
-        # Write to temp
-        sftp = ssh.open_sftp()
-        with sftp.file("/tmp/pmta_config_new", "w") as f:
-            f.write(new_config_str)
-        sftp.close()
-        
-        # Backup and Move (Sudo)
-        cmd = "cp /etc/pmta/config /etc/pmta/config.bak.$(date +%F_%T) && mv /tmp/pmta_config_new /etc/pmta/config && chmod 644 /etc/pmta/config"
-        stdin, stdout, stderr = exec_sudo_command(ssh, cmd, ssh_pass)
-        error = stderr.read().decode('utf-8')
+        # Backup (local history when the server is known, remote copy otherwise)
+        current = None
+        if target is not None:
+            current = snapshot_remote_config(ssh, ssh_pass, target, user_id)
+        else:
+            exec_sudo_command(ssh, "cp /etc/pmta/config /etc/pmta/config.bak.$(date +%F_%T)", ssh_pass)
+
+        # Write, check and swap in one transaction; reloading is left to /api/pmta/config/apply
+        result = apply_pmta_config(ssh, ssh_pass, lambda f: write_pmta_config(config_json, f), mode="none", current=current)
         ssh.close()
         
-        # Determine success - cp/mv might produce stderr warnings but verify file exists?
-        # Standard approach: exit code.
-        exit_code = stdout.channel.recv_exit_status()
-        
-        if exit_code != 0:
-            return jsonify({"status": "error", "message": f"File op error: {error}"}), 500
+        if not result["ok"]:
+            return jsonify({"status": "error", "message": f"File op error: {pmta_apply.describe_failure(result)}", "apply": result}), 500
             
-        return jsonify({"status": "success", "message": "Configuration saved"})
+        if target is not None:
+            store_config_version(target, applied_config_text(build_pmta_config(config_json), current), user_id=user_id, action="save")
+        response = {"status": "success", "message": "Configuration saved", "apply": result}
+        if current is not None:
+            # Tells the UI whether the follow-up /api/pmta/config/apply reload is enough
+            preview = preview_config_change(current, build_pmta_config(config_json))
+            response.update(action=preview["action"], reasons=preview["reasons"], summary=preview["summary"])
+        return jsonify(response)
         
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -2019,45 +2279,462 @@ def apply_pmta_config_api():
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+def refresh_server_inventory(server, ssh=None):
+    """Records the server's bound IPs and DKIM key files on the InstalledPMTA row."""
+    from ssh_validator import collect_server_inventory
+    own_ssh = ssh is None
+    if own_ssh:
+        ssh = get_ssh_connection(server.host_ip, server.ssh_username, server.ssh_password_encrypted, server.ssh_port)
+    try:
+        inventory = collect_server_inventory(ssh)
+        try:
+            inventory["dkim_registered"] = sync_dkim_registry(server, ssh)
+        except Exception as e:
+            inventory.setdefault("errors", []).append(f"DKIM registry sync failed: {str(e)}")
+    finally:
+        if own_ssh:
+            ssh.close()
+    inventory["updated_at"] = datetime.utcnow().isoformat()
+    server.inventory = inventory
+    db.session.commit()
+    return inventory
+
+def get_validation_facts(server):
+    """(server_ips, dkim_paths) from the stored inventory, or (None, None) when unknown."""
+    inventory = (server.inventory if server else None) or {}
+    ips = inventory.get("ips")
+    if ips is not None and server.host_ip not in ips:
+        ips = list(ips) + [server.host_ip]
+    return ips, inventory.get("dkim_paths")
+
+def validate_config_text(config_str, server=None, extra_dkim_paths=None):
+    """
+    Runs the local validator with whatever facts we know about the target server.
+    extra_dkim_paths: keys that will exist when the config is applied (generated first).
+    """
+    server_ips, dkim_paths = get_validation_facts(server)
+    if dkim_paths is not None and extra_dkim_paths:
+        dkim_paths = list(dkim_paths) + sorted(extra_dkim_paths)
+    return pmta_config_validator.validate_config(config_str, server_ips=server_ips, dkim_paths=dkim_paths)
+
+def _validation_response(issues):
+    errors = [i for i in issues if i["severity"] == pmta_config_validator.ERROR]
+    warnings = [i for i in issues if i["severity"] != pmta_config_validator.ERROR]
+    return {"valid": not errors, "errors": errors, "warnings": warnings}
+
+# ==========================================
+# DKIM KEY REGISTRY
+# ==========================================
+
+def dkim_public_key_b64(pem):
+    """Base64 body of a PEM public key (what goes after p= in the DKIM record)."""
+    return "".join(l.strip() for l in (pem or "").splitlines() if l.strip() and not l.startswith("-----"))
+
+def dkim_fingerprint(public_key_b64):
+    try:
+        der = base64.b64decode(public_key_b64, validate=True)
+    except (ValueError, TypeError):
+        der = public_key_b64.encode()
+    return "sha256:" + hashlib.sha256(der).hexdigest()
+
+def dkim_txt_value(key):
+    return f"v=DKIM1; k=rsa; p={key.public_key}"
+
+def _dkim_path_identity(path):
+    """(domain, selector) for the /etc/pmta/dkim/<domain>/<selector>.private layout, else None."""
+    m = re.match(r"^/etc/pmta/dkim/([^/]+)/([^/]+?)\.(?:private|pem|key)$", path or "")
+    return (m.group(1).lower(), m.group(2)) if m else None
+
+def register_dkim_key(server, domain, selector, public_key, key_path=None, source="install"):
+    """
+    Upserts the key for (server, domain, selector). `public_key` is PEM or bare base64.
+    created_at moves only when the key itself changes. Caller commits.
+    """
+    b64 = dkim_public_key_b64(public_key)
+    if not b64:
+        return None
+    fingerprint = dkim_fingerprint(b64)
+    domain = domain.lower().rstrip(".")
+    now = datetime.utcnow()
+    key = DkimKey.query.filter_by(server_id=server.id, domain=domain, selector=selector).first()
+    if key is None:
+        key = DkimKey(server_id=server.id, user_id=server.user_id, domain=domain, selector=selector, created_at=now)
+        db.session.add(key)
+    if key.fingerprint != fingerprint:
+        key.public_key, key.fingerprint, key.created_at, key.source = b64, fingerprint, now, source
+    key.key_path = key_path or key.key_path
+    key.seen_at = now
+    return key
+
+def sync_dkim_registry(server, ssh, identities=None, source="inventory", ssh_pass=None):
+    """
+    Reads public keys from the server in one SSH round trip (with sudo: the private keys
+    are 640 pmta:pmta) and registers them.
+    identities: {key_path: (domain, selector)}; default is every key under /etc/pmta/dkim
+    in the <domain>/<selector>.private layout. Returns the number of keys registered;
+    raises RuntimeError when keys exist but none could be read.
+    """
+    from ssh_validator import collect_dkim_public_keys
+    ssh_pass = ssh_pass or server.ssh_password_encrypted
+    pems = collect_dkim_public_keys(ssh, list(identities) if identities is not None else None,
+                                    run=lambda client, cmd: exec_sudo_command(client, cmd, ssh_pass))
+    count = 0
+    for path, pem in pems.items():
+        ident = identities.get(path) if identities is not None else _dkim_path_identity(path)
+        if ident and register_dkim_key(server, ident[0], ident[1], pem, key_path=path, source=source):
+            count += 1
+    db.session.commit()
+    return count
+
+def ensure_dkim_keys(ssh, ssh_pass, key_paths):
+    """
+    Generates a 2048-bit keypair at every key path that has no key yet, in one SSH round
+    trip (with sudo; 640 pmta:pmta, as the installer leaves them). Returns the paths that
+    were created; raises RuntimeError when a key is still missing afterwards.
+    """
+    steps = []
+    for path in sorted(key_paths or ()):
+        key, key_dir = shlex.quote(path), shlex.quote(os.path.dirname(path))
+        steps.append(
+            f"if [ ! -f {key} ]; then mkdir -p {key_dir} && chmod 755 {key_dir} && chown pmta:pmta {key_dir}"
+            f" && openssl genrsa -out {key} 2048 2>/dev/null && openssl rsa -in {key} -pubout -out {key}.pub 2>/dev/null"
+            f" && chmod 640 {key} && chmod 644 {key}.pub && chown pmta:pmta {key} {key}.pub && echo CREATED {key} || rm -f {key} {key}.pub; fi; "
+            f"[ -f {key} ] || echo MISSING {key}"
+        )
+    if not steps:
+        return []
+    stdin, stdout, stderr = exec_sudo_command(ssh, "sh -c " + shlex.quote("umask 077; " + "; ".join(steps)), ssh_pass)
+    lines = stdout.read().decode("utf-8", errors="replace").splitlines()
+    missing = [l.split(" ", 1)[1] for l in lines if l.startswith("MISSING ")]
+    if missing:
+        detail = stderr.read().decode("utf-8", errors="replace").strip()
+        raise RuntimeError(f"could not create DKIM key {', '.join(missing)}" + (f": {detail}" if detail else ""))
+    return [l.split(" ", 1)[1] for l in lines if l.startswith("CREATED ")]
+
+def lookup_dkim_key(user_id, domain, selector="default", server_id=None):
+    """Newest registered key for the domain (or its root domain, where installs keep subdomain keys)."""
+    domain = domain.lower().rstrip(".")
+    parts = domain.split(".")
+    candidates = [domain] + ([".".join(parts[-2:])] if len(parts) > 2 else [])
+    query = DkimKey.query.filter(DkimKey.user_id == int(user_id), DkimKey.selector == selector)
+    if server_id:
+        query = query.filter(DkimKey.server_id == int(server_id))
+    for name in candidates:
+        key = query.filter(DkimKey.domain == name).order_by(DkimKey.created_at.desc()).first()
+        if key:
+            return key
+    return None
+
+def _dkim_key_dict(key):
+    return {
+        "id": key.id,
+        "server_id": key.server_id,
+        "domain": key.domain,
+        "selector": key.selector,
+        "fingerprint": key.fingerprint,
+        "key_path": key.key_path,
+        "source": key.source,
+        "record_name": f"{key.selector}._domainkey.{key.domain}",
+        "record_value": dkim_txt_value(key),
+        "created_at": key.created_at.isoformat() if key.created_at else None,
+        "seen_at": key.seen_at.isoformat() if key.seen_at else None,
+    }
+
+# ==========================================
+# PMTA CONFIG VERSIONS (local history)
+# ==========================================
+
+def store_config_version(server, config_str, user_id=None, action="save", install_job_id=None, note=None):
+    """
+    Records config_str as the server's current config. Content is deduplicated by hash;
+    nothing is added when it matches the server's latest version. Returns the version.
+    """
+    raw = config_str.encode("utf-8")
+    sha = hashlib.sha256(raw).hexdigest()
+
+    latest = ConfigVersion.query.filter_by(server_id=server.id).order_by(ConfigVersion.id.desc()).first()
+    if latest and latest.blob_sha256 == sha:
+        return latest
+
+    if not ConfigBlob.query.filter_by(sha256=sha).first():
+        db.session.add(ConfigBlob(sha256=sha, size=len(raw), data=zlib.compress(raw, 9)))
+
+    version = ConfigVersion(
+        server_id=server.id,
+        user_id=int(user_id) if user_id else None,
+        install_job_id=install_job_id,
+        blob_sha256=sha,
+        action=action,
+        note=(note or "")[:255] or None,
+    )
+    db.session.add(version)
+    db.session.commit()
+    return version
+
+def load_config_version(version):
+    blob = ConfigBlob.query.filter_by(sha256=version.blob_sha256).first()
+    return zlib.decompress(blob.data).decode("utf-8") if blob else None
+
+def read_pmta_layout(ssh, ssh_pass=None):
+    """{path: text} for /etc/pmta/config and its conf.d include files, read in one command."""
+    cmd = pmta_confd.read_command()
+    stdin, stdout, stderr = exec_sudo_command(ssh, cmd, ssh_pass) if ssh_pass else ssh.exec_command(cmd)
+    return pmta_confd.parse_read_output(stdout.read())
+
+def read_pmta_config(ssh, ssh_pass=None):
+    """The server's config as one text (root plus conf.d files, see pmta_confd.merge)."""
+    return pmta_confd.merge(read_pmta_layout(ssh, ssh_pass))
+
+def snapshot_remote_config(ssh, ssh_pass, server, user_id=None):
+    """Reads the live config and records it (action 'snapshot') so edits made outside the dashboard are kept."""
+    current = read_pmta_config(ssh, ssh_pass)
+    if server is not None and current:
+        store_config_version(server, current, user_id=user_id, action="snapshot")
+    return current
+
+def _version_dict(version, size=None):
+    return {
+        "id": version.id,
+        "server_id": version.server_id,
+        "user_id": version.user_id,
+        "install_job_id": version.install_job_id,
+        "sha256": version.blob_sha256,
+        "size": size,
+        "action": version.action,
+        "note": version.note,
+        "created_at": version.created_at.isoformat() if version.created_at else None,
+    }
+
+def _owned_server_or_404(server_id):
+    user_id = get_jwt_identity()
+    server = InstalledPMTA.query.filter_by(id=server_id, user_id=user_id).first()
+    if not server:
+        return None, (jsonify({"status": "error", "message": "Server ID not found"}), 404)
+    return server, None
+
+@app.route("/api/server/<int:server_id>/pmta/config/versions", methods=["GET"])
+@jwt_required()
+def list_config_versions(server_id):
+    server, err = _owned_server_or_404(server_id)
+    if err:
+        return err
+    limit = min(request.args.get("limit", 50, type=int), 500)
+    offset = request.args.get("offset", 0, type=int)
+
+    rows = db.session.query(ConfigVersion, ConfigBlob.size).outerjoin(
+        ConfigBlob, ConfigBlob.sha256 == ConfigVersion.blob_sha256
+    ).filter(ConfigVersion.server_id == server.id).order_by(ConfigVersion.id.desc()).offset(offset).limit(limit).all()
+    total = ConfigVersion.query.filter_by(server_id=server.id).count()
+    return jsonify({"status": "success", "total": total, "data": [_version_dict(v, size) for v, size in rows]})
+
+@app.route("/api/server/<int:server_id>/pmta/config/versions/<int:version_id>", methods=["GET"])
+@jwt_required()
+def get_config_version(server_id, version_id):
+    server, err = _owned_server_or_404(server_id)
+    if err:
+        return err
+    version = ConfigVersion.query.filter_by(id=version_id, server_id=server.id).first()
+    if not version:
+        return jsonify({"status": "error", "message": "Version not found"}), 404
+    content = load_config_version(version)
+    return jsonify({"status": "success", "data": {**_version_dict(version, len(content or "")), "config": content}})
+
+@app.route("/api/server/<int:server_id>/pmta/config/versions/diff", methods=["GET"])
+@jwt_required()
+def diff_config_versions(server_id):
+    """Unified diff between two versions. Query: from, to (version ids; 'to' defaults to the latest)."""
+    server, err = _owned_server_or_404(server_id)
+    if err:
+        return err
+    from_id = request.args.get("from", type=int)
+    to_id = request.args.get("to", type=int)
+    if not from_id:
+        return jsonify({"status": "error", "message": "'from' version id is required"}), 400
+
+    query = ConfigVersion.query.filter_by(server_id=server.id)
+    old = query.filter_by(id=from_id).first()
+    new = query.filter_by(id=to_id).first() if to_id else query.order_by(ConfigVersion.id.desc()).first()
+    if not old or not new:
+        return jsonify({"status": "error", "message": "Version not found"}), 404
+
+    context = max(0, min(request.args.get("context", 3, type=int), 50))
+    if old.blob_sha256 == new.blob_sha256:
+        diff = []
+    else:
+        diff = list(difflib.unified_diff(
+            (load_config_version(old) or "").splitlines(),
+            (load_config_version(new) or "").splitlines(),
+            fromfile=f"version-{old.id}", tofile=f"version-{new.id}", lineterm="", n=context,
+        ))
+    added = sum(1 for l in diff if l.startswith("+") and not l.startswith("+++"))
+    removed = sum(1 for l in diff if l.startswith("-") and not l.startswith("---"))
+    return jsonify({
+        "status": "success",
+        "from": old.id, "to": new.id,
+        "identical": old.blob_sha256 == new.blob_sha256,
+        "added": added, "removed": removed,
+        "diff": "\n".join(diff),
+    })
+
+# ==========================================
+# PMTA CONFIG PREVIEW (dry-run structural diff)
+# ==========================================
+
+LIVE_AST_CACHE_SIZE = 32
+_live_ast_cache = {}  # blob sha256 -> parsed Config, oldest first
+
+def _parsed_version(version):
+    """Parsed config of a stored version, cached by content hash (versions are immutable)."""
+    tree = _live_ast_cache.pop(version.blob_sha256, None)
+    if tree is None:
+        tree = pmta_config_ast.parse(load_config_version(version) or "")
+    _live_ast_cache[version.blob_sha256] = tree
+    while len(_live_ast_cache) > LIVE_AST_CACHE_SIZE:
+        _live_ast_cache.pop(next(iter(_live_ast_cache)))
+    return tree
+
+def live_config_baseline(server, user_id=None, refresh=False):
+    """
+    (parsed config, version) the server is believed to run: the latest stored version,
+    or a fresh snapshot from the server when there is none or `refresh` is set.
+    """
+    version = None if refresh else ConfigVersion.query.filter_by(server_id=server.id).order_by(ConfigVersion.id.desc()).first()
+    if version is None:
+        ssh = get_ssh_connection(server.host_ip, server.ssh_username, server.ssh_password_encrypted, server.ssh_port)
+        try:
+            current = snapshot_remote_config(ssh, server.ssh_password_encrypted, server, user_id)
+        finally:
+            ssh.close()
+        if not current:
+            return pmta_config_ast.parse(""), None
+        version = ConfigVersion.query.filter_by(server_id=server.id).order_by(ConfigVersion.id.desc()).first()
+    return _parsed_version(version), version
+
+def preview_config_change(current, candidate):
+    """Structural diff and reload/restart classification of going from `current` to `candidate`."""
+    diff = pmta_config_diff.structural_diff(current, candidate)
+    return {**pmta_config_diff.classify(diff), "summary": pmta_config_diff.summary(diff), "diff": diff}
+
+@app.route("/api/server/<int:server_id>/pmta/config/preview", methods=["POST"])
+@jwt_required()
+def preview_pmta_config(server_id):
+    """
+    Dry run of a config save: nothing is uploaded.
+    Body: the config JSON accepted by the save endpoints, or {"config_text": "..."} for a raw config.
+    Query: refresh=1 reads the live config from the server instead of the latest stored version.
+    """
+    user_id = get_jwt_identity()
+    server, err = _owned_server_or_404(server_id)
+    if err:
+        return err
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"status": "error", "message": "JSON body required"}), 400
+    refresh = request.args.get("refresh") == "1"
+    if (refresh or not ConfigVersion.query.filter_by(server_id=server.id).first()) and not server.ssh_password_encrypted:
+        return jsonify({"status": "error", "message": "Credentials not found for this server ID."}), 403
+
+    candidate = data["config_text"] if isinstance(data.get("config_text"), str) else build_pmta_config(data)
+    try:
+        current, version = live_config_baseline(server, user_id, refresh=refresh)
+    except Exception as e:
+        return jsonify({"status": "error", "message": f"Could not read the live config: {e}"}), 500
+
+    return jsonify({
+        "status": "success",
+        **preview_config_change(current, candidate),
+        "baseline": _version_dict(version) if version else None,
+        "validation": _validation_response(validate_config_text(candidate, server)),
+    })
+
+@app.route("/api/server/<int:server_id>/pmta/config/versions/<int:version_id>/rollback", methods=["POST"])
+@jwt_required()
+def rollback_config_version(server_id, version_id):
+    """Pushes a stored version back to the server and reloads PMTA."""
+    server, err = _owned_server_or_404(server_id)
+    if err:
+        return err
+    if not server.ssh_password_encrypted:
+        return jsonify({"status": "error", "message": "Credentials not found for this server ID."}), 403
+    version = ConfigVersion.query.filter_by(id=version_id, server_id=server.id).first()
+    if not version:
+        return jsonify({"status": "error", "message": "Version not found"}), 404
+
+    content = load_config_version(version)
+    user_id = get_jwt_identity()
+    ssh_pass = server.ssh_password_encrypted
+    try:
+        ssh = get_ssh_connection(server.host_ip, server.ssh_username, ssh_pass, server.ssh_port)
+        try:
+            # Keep whatever is live now before replacing it
+            current = snapshot_remote_config(ssh, ssh_pass, server, user_id)
+
+            result = apply_pmta_config(ssh, ssh_pass, content, mode="reload", current=current)
+            if not result["ok"]:
+                return jsonify({"status": "error", "message": f"Rollback failed: {pmta_apply.describe_failure(result)}", "apply": result}), 500
+        finally:
+            ssh.close()
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+    new_version = store_config_version(server, applied_config_text(content, current), user_id=user_id,
+                                       action="rollback", note=f"Rollback to version {version.id}")
+    return jsonify({"status": "success", "message": f"Rolled back to version {version.id}", "version": _version_dict(new_version)})
+
 @app.route("/api/pmta/config/validate", methods=["POST"])
 @jwt_required()
 def validate_pmta_config_api():
-    # Mock validation for now
-    return jsonify({"valid": True, "errors": []})
+    """
+    Validates a config locally (no SSH). Body: either the JSON config structure,
+    or {"config": "<raw text>"}; optional "server_id" enables IP / DKIM checks.
+    """
+    user_id = get_jwt_identity()
+    data = request.json or {}
+    server = None
+    server_id = data.get("server_id") or request.args.get("server_id", type=int)
+    if server_id:
+        server = InstalledPMTA.query.filter_by(id=server_id, user_id=user_id).first()
+        if not server:
+            return jsonify({"status": "error", "message": "Server ID not found"}), 404
+
+    config_str = data.get("config") if isinstance(data.get("config"), str) else build_pmta_config(data)
+    return jsonify(_validation_response(validate_config_text(config_str, server)))
+
+@app.route("/api/server/<int:server_id>/inventory/refresh", methods=["POST"])
+@jwt_required()
+def refresh_server_inventory_api(server_id):
+    user_id = get_jwt_identity()
+    server = InstalledPMTA.query.filter_by(id=server_id, user_id=user_id).first()
+    if not server:
+        return jsonify({"status": "error", "message": "Server ID not found"}), 404
+    if not server.ssh_password_encrypted:
+        return jsonify({"status": "error", "message": "Credentials not found for this server ID."}), 403
+    try:
+        inventory = refresh_server_inventory(server)
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+    return jsonify({"status": "success", "data": inventory})
 
 @app.route("/api/dns/info", methods=["POST"])
 @jwt_required()
 def get_dns_info_api():
     user_id = get_jwt_identity()
-    server_ip, ssh_user, ssh_pass, ssh_port = get_install_credentials(user_id)
+    data = request.json or {}
+    server_ip, ssh_user, ssh_pass, ssh_port = get_install_credentials(user_id, data.get("server_id"))
     if not server_ip:
         return jsonify({"error": "System not installed"}), 400
     
-    data = request.json
     domain = data.get("domain")
     if not domain:
         return jsonify({"error": "Domain is required"}), 400
 
-    dkim_record_value = ""
-    try:
-        ssh = get_ssh_connection(server_ip, ssh_user, ssh_pass, ssh_port)
-        
-        # Check correct installation path for DKIM keys
-        cmd = f"cat /etc/pmta/dkim/{domain}/default.private.pub 2>/dev/null"
-        stdin, stdout, stderr = exec_sudo_command(ssh, cmd, ssh_pass)
-        dkim_content = stdout.read().decode('utf-8').strip()
-        
-        if dkim_content and "PUBLIC KEY" in dkim_content:
-            # Strip header/footer and newlines to extract base64 key
-            lines = dkim_content.split('\n')
-            base64_key = "".join([l.strip() for l in lines if not l.startswith('-----')])
-            dkim_record_value = f"v=DKIM1; k=rsa; p={base64_key}"
-        else:
-            dkim_record_value = "DKIM key not found on server. Please ensure the domain is configured in PMTA."
-             
-        ssh.close()
-    except Exception as e:
-        dkim_record_value = f"Error fetching DKIM: {str(e)}"
+    # Served from the DKIM registry (filled at install / rotation / inventory refresh) — no SSH round trip
+    selector = data.get("selector") or "default"
+    dkim_key = lookup_dkim_key(user_id, domain, selector=selector, server_id=data.get("server_id"))
+    if dkim_key:
+        dkim_record_value = dkim_txt_value(dkim_key)
+    else:
+        dkim_record_value = "DKIM key not found for this domain. Refresh the server inventory to import keys created outside the installer."
 
     # Generate records
     spf_record = f"v=spf1 ip4:{server_ip} ~all"
@@ -2076,17 +2753,57 @@ def get_dns_info_api():
         "server_ip": server_ip,
         "spf": spf_record,
         "dkim": dkim_record_value,
+        "dkim_key": _dkim_key_dict(dkim_key) if dkim_key else None,
         "dmarc": dmarc_record,
         "ns_records": ns_records,
         "formatted_records": [
             {"type": "A", "host": f"mail.{domain}", "value": server_ip},
             {"type": "A", "host": f"@", "value": server_ip},
             {"type": "TXT", "host": "@", "value": spf_record},
-            {"type": "TXT", "host": "default._domainkey", "value": dkim_record_value},
+            {"type": "TXT", "host": f"{selector}._domainkey", "value": dkim_record_value},
             {"type": "TXT", "host": "_dmarc", "value": dmarc_record}
         ]
     })
 
+@app.route("/api/dkim/keys", methods=["GET"])
+@jwt_required()
+def list_dkim_keys():
+    """Registered DKIM keys for the user's servers. Optional ?domain= and ?server_id= filters."""
+    user_id = get_jwt_identity()
+    query = DkimKey.query.filter_by(user_id=int(user_id))
+    if request.args.get("domain"):
+        query = query.filter_by(domain=request.args["domain"].lower().rstrip("."))
+    if request.args.get("server_id", type=int):
+        query = query.filter_by(server_id=request.args.get("server_id", type=int))
+    keys = query.order_by(DkimKey.domain, DkimKey.selector).all()
+    return jsonify({"status": "success", "data": [_dkim_key_dict(k) for k in keys]})
+
+
+# One shared `tail -F` per server, fanned out to every viewer (SSE) and to the polling endpoints
+PMTA_LOG_PATH = "/var/log/pmta/log"
+pmta_log_hub = LogFollowerHub(
+    buffer_lines=int(os.getenv("PMTA_LOG_FOLLOW_BUFFER", 1000)),
+    idle_timeout=float(os.getenv("PMTA_LOG_FOLLOW_IDLE", 60)),
+)
+
+def _pmta_log_key(host_ip, ssh_port=22):
+    return f"{host_ip}:{int(ssh_port or 22)}"
+
+def _buffered_pmta_log(user_id, host_ip, ssh_port, ssh_user, ssh_pass, lines):
+    """
+    Returns the last `lines` lines from a running follower as text, or None if nobody is following.
+    Only served when the caller owns the server and supplied its stored SSH credentials; anyone
+    else goes through the SSH path, which checks the credentials against the server itself.
+    """
+    server = InstalledPMTA.query.filter_by(host_ip=host_ip, user_id=int(user_id)).first()
+    if (server is None or int(server.ssh_port or 22) != int(ssh_port or 22) or server.ssh_username != ssh_user
+            or not server.ssh_password_encrypted or not ssh_pass
+            or not secrets.compare_digest(str(server.ssh_password_encrypted), str(ssh_pass))):
+        return None
+    buffered = pmta_log_hub.snapshot(_pmta_log_key(host_ip, ssh_port), limit=lines)
+    if buffered is None:
+        return None
+    return "".join(f"{ln}\n" for ln in buffered)
 
 @app.route("/logs", methods=["POST"])
 @jwt_required()
@@ -2097,6 +2814,10 @@ def get_logs():
     ssh_pass = data["ssh_pass"]
     ssh_port = int(data.get("ssh_port", 22))
 
+    buffered = _buffered_pmta_log(get_jwt_identity(), server_ip, ssh_port, ssh_user, ssh_pass, 100)
+    if buffered is not None:
+        return jsonify({"status": "success", "logs": buffered})
+
     logs = ""
     try:
         ssh = get_ssh_connection(server_ip, ssh_user, ssh_pass, ssh_port)
@@ -2130,28 +2851,57 @@ def get_feature_flags():
 # SAFE CONFIG MANAGEMENT (STABILITY LOCK VII)
 # ==========================================
 
-def safe_update_pmta_config(server_ip, ssh_user, ssh_pass, ssh_port, update_type, update_data):
+PMTA_CHECK_CMD = os.getenv("PMTA_CHECK_CMD", pmta_apply.DEFAULT_CHECK_CMD)
+
+# New installs write VMTAs and pools to conf.d include files (see pmta_confd)
+PMTA_CONFD_LAYOUT = os.getenv("PMTA_CONFD_LAYOUT", "1") == "1"
+
+def apply_pmta_config(ssh, ssh_pass, config, mode="reload", current=None):
+    """
+    Uploads and applies a config in one remote transaction (install, check, reload,
+    automatic rollback). `config` is a string or a callable writing to a file object.
+
+    On servers using the conf.d layout the config is split into its files and only
+    the files that differ from `current` (the merged text returned by
+    snapshot_remote_config; read from the server when omitted) are uploaded.
+    """
+    run = lambda client, cmd: exec_sudo_command(client, cmd, ssh_pass)
+    if current is None and isinstance(config, str) and pmta_confd.uses_confd(config):
+        current = read_pmta_config(ssh, ssh_pass)
+    if current is not None and (pmta_confd.uses_confd(current) or (isinstance(config, str) and pmta_confd.uses_confd(config))):
+        if callable(config):
+            buf = io.StringIO()
+            config(buf)
+            config = buf.getvalue()
+        files = pmta_confd.plan(pmta_confd.split(config), pmta_confd.unmerge(current))
+        if not files:
+            return pmta_apply.unchanged_result()
+        return pmta_apply.apply_files(ssh, files, run=run, mode=mode, check_cmd=PMTA_CHECK_CMD)
+    return pmta_apply.apply_config(ssh, config, run=run, mode=mode, check_cmd=PMTA_CHECK_CMD)
+
+def applied_config_text(config_str, current=None):
+    """The (merged) text the server holds after apply_pmta_config(config_str); used for the version history."""
+    if pmta_confd.uses_confd(current) or pmta_confd.uses_confd(config_str):
+        return pmta_confd.merge(pmta_confd.split(config_str))
+    return config_str
+
+def safe_update_pmta_config(server_ip, ssh_user, ssh_pass, ssh_port, update_type, update_data, user_id):
     """
     Safely updates PMTA config with rollback.
     update_type: 'smtp' or 'settings'
     update_data: dict of values to update
+    user_id: owner of the server (host IPs are not unique across accounts)
+    Returns (success, message, apply_result) — apply_result carries per-step timings.
     """
     ssh = get_ssh_connection(server_ip, ssh_user, ssh_pass, ssh_port)
-    timestamp = int(time.time())
-    backup_file = f"/etc/pmta/config.backup.{timestamp}"
+    target = InstalledPMTA.query.filter_by(host_ip=server_ip, user_id=user_id).first()
     
     try:
-        # 1. Create Backup
-        print(f"Creating backup: {backup_file}")
-        exec_sudo_command(ssh, f"cp /etc/pmta/config {backup_file}", ssh_pass)
-        
-        # 2. Read Current Config
-        stdin, stdout, stderr = exec_sudo_command(ssh, "cat /etc/pmta/config", ssh_pass)
-        current_config = stdout.read().decode('utf-8')
-        
-        new_config = current_config
+        # 1. Read Current Config (recorded in the local version history as the backup)
+        current_config = snapshot_remote_config(ssh, ssh_pass, target)
+        tree = pmta_config_ast.parse(current_config)
         
-        # 3. Apply Changes (Regex based on update_type)
+        # 2. Apply Changes on the parsed config
         if update_type == 'smtp':
             if not flag.ENABLE_STRUCTURED_EDITOR:
                  raise Exception("Structured Editor is disabled by Feature Flag.")
@@ -2165,36 +2915,17 @@ def safe_update_pmta_config(server_ip, ssh_user, ssh_pass, ssh_port, update_type
             user = update_data.get('username')
             password = update_data.get('password')
             
-            # 1. Update <smtp-user> if exists
             if user and password:
-                # Find <smtp-user USERNAME> block and update password
-                # This is complex to do safely with regex on nested blocks.
-                # Simplification: We look for "password OLD_PASS" inside the block? No.
-                # We assume standard format:
-                # <smtp-user USER>
-                #     password SECRET
-                # </smtp-user>
-                
-                # Check if user exists
-                user_pattern = f"(<smtp-user\\s+{re.escape(user)}>)(.*?)(</smtp-user>)"
-                if re.search(user_pattern, new_config, re.DOTALL):
-                    # User exists, update password
-                    def replace_password(match):
-                        header = match.group(1)
-                        body = match.group(2)
-                        footer = match.group(3)
-                        # Replace password line
-                        new_body = re.sub(r"password\s+.*", f"password {password}", body)
-                        # If password not found in body, append it
-                        if "password" not in new_body:
-                             new_body += f"\n    password {password}\n"
-                        return f"{header}{new_body}{footer}"
-                        
-                    new_config = re.sub(user_pattern, replace_password, new_config, flags=re.DOTALL)
+                block = tree.index("smtp-user").get(user)
+                if block is not None:
+                    # User exists, update (or add) its password line
+                    block.set("password", password)
                 else:
                     # User doesn't exist, append new block at end
-                    new_block = f"\n<smtp-user {user}>\n    password {password}\n    authentication-method password\n</smtp-user>\n"
-                    new_config += new_block
+                    block = pmta_config_ast.Block("smtp-user", user)
+                    block.set("password", password)
+                    block.set("authentication-method", "password")
+                    tree.append(block)
 
         elif update_type == 'settings':
             if not flag.ENABLE_STRUCTURED_EDITOR:
@@ -2205,80 +2936,94 @@ def safe_update_pmta_config(server_ip, ssh_user, ssh_pass, ssh_port, update_type
             if not set(update_data.keys()).issubset(allowed_settings_keys):
                 raise Exception("Unauthorized directive in update.")
             
-            # Update directives
-            directives = {
-                'log-connections': update_data.get('log_connections'),
-                'log-commands': update_data.get('log_commands'),
-                'log-transfer': update_data.get('log_transfer'),
-                'allow-relaying': update_data.get('allow_relaying')
-            }
-            
-            # Apply to <source 0/0> block primarily
-            source_pattern = r"(<source 0/0>)(.*?)(</source>)"
-            
-            # For now, we will just do global replacement as per original logic logic but safer with regex
-            # The previous logic was complex. Let's simplify and just use regex replacement globally for these settings
-            # as they are usually unique or we want them applied globally.
-            
-            for key, val in directives.items():
-                if val is not None:
-                    # simplistic global replacement for now, aiming for safety
-                    # pattern: ^\s*key\s+.*$
-                    pattern = f"(?m)^\\s*{key}\\s+.*$"
-                    replacement = f"{key} {val}"
-                    if re.search(pattern, new_config):
-                        new_config = re.sub(pattern, replacement, new_config)
-                    else:
-                        # Append to end if not found? Or maybe inserting after <source 0/0> is better but risky if missing.
-                        # Let's just append to end of file if not found, usually safe for global settings.
-                        new_config += f"\n{key} {val}" 
-
-        # 4. Write New Config via Temp File
-        temp_remote_path = f"/tmp/config.new.{timestamp}"
-        
-        # Create temp file
-        sftp = ssh.open_sftp()
-        with sftp.file(temp_remote_path, 'w') as f:
-            f.write(new_config)
-        sftp.close()
-        
-        # Move to /etc/pmta/config
-        exec_sudo_command(ssh, f"mv {temp_remote_path} /etc/pmta/config", ssh_pass)
-        
-        # 5. Validate
-        stdin, stdout, stderr = exec_sudo_command(ssh, "pmta check", ssh_pass)
-        exit_code = stdout.channel.recv_exit_status()
-        output = stdout.read().decode() + stderr.read().decode()
-        
-        if exit_code != 0:
-            raise Exception(f"Config Validation Failed: {output}")
-            
-        # 6. Reload
-        exec_sudo_command(ssh, "pmta reload", ssh_pass)
-        
-        return True, "Configuration updated and reloaded successfully."
+            # max-msg-rate is the default in <domain *> only: per-ISP <domain ...> and smtp-user
+            # blocks keep their own rates
+            rate = update_data.get('max-msg-rate')
+            if rate is not None:
+                block = tree.index("domain").get("*")
+                if block is None:
+                    block = pmta_config_ast.Block("domain", "*")
+                    tree.append(block)
+                block.set("max-msg-rate", str(rate))
+
+            # Logging / relaying settings live at top level and in <source> blocks
+            for key in allowed_settings_keys - {'max-msg-rate'}:
+                val = update_data.get(key)
+                if val is None:
+                    continue
+                val = str(val)
+                found = False
+                for block in [tree] + list(tree.walk("source")):
+                    for d in block.directives(key):
+                        d.set(val)
+                        found = True
+                if not found:
+                    tree.append(pmta_config_ast.Directive(key, val), separate=False)
+
+        new_config = tree.render()
+
+        # Local validation: reject only problems introduced by this edit
+        before = {(i["code"], i["message"]) for i in validate_config_text(current_config, target)}
+        introduced = [i for i in validate_config_text(new_config, target)
+                      if i["severity"] == pmta_config_validator.ERROR and (i["code"], i["message"]) not in before]
+        if introduced:
+            return False, "Config Validation Failed: " + "; ".join(pmta_config_validator.format_issue(i) for i in introduced), None
+
+        if new_config == current_config:
+            return True, "No changes to apply.", None
+
+        # 3. Write, check, swap, reload — one remote transaction with automatic rollback
+        result = apply_pmta_config(ssh, ssh_pass, new_config, mode="reload", current=current_config)
+        print(f"[PMTA-APPLY] {server_ip} {update_type}: {result['result']} {result['timings']}")
+        if not result["ok"]:
+            return False, f"Update failed: {pmta_apply.describe_failure(result)}", result
+
+        if target is not None:
+            store_config_version(target, applied_config_text(new_config, current_config), action="update", note=f"{update_type} update")
+        return True, "Configuration updated and reloaded successfully.", result
 
     except Exception as e:
         print(f"Update Failed: {e}")
-        # Rollback
-        try:
-            print("Rolling back configuration...")
-            exec_sudo_command(ssh, f"cp {backup_file} /etc/pmta/config", ssh_pass)
-            exec_sudo_command(ssh, "pmta reload", ssh_pass)
-        except Exception as rollback_e:
-            return False, f"Update failed AND Rollback failed! Critical: {rollback_e}"
-            
-        return False, f"Update failed (Rolled back): {str(e)}"
+        return False, f"Update failed: {str(e)}", None
         
     finally:
         ssh.close()
 
+# ==========================================
+# POWERDNS API CLIENT (live zone views)
+# ==========================================
+PDNS_HOST = os.getenv("PDNS_HOST", "192.119.169.12")  # Default to known IP
+PDNS_PORT = int(os.getenv("PDNS_PORT", 8081))
+PDNS_ZONE_MAX_AGE = int(os.getenv("PDNS_ZONE_MAX_AGE", 300))  # seconds
+PDNS_BULK_CONCURRENCY = int(os.getenv("PDNS_BULK_CONCURRENCY", 8))  # zones in flight for bulk export/import
+PDNS_PATCH_BATCH = int(os.getenv("PDNS_PATCH_BATCH", 500))  # rrsets per PATCH on import
+
+_pdns_client = None
+_pdns_client_lock = threading.Lock()
+
+
+def get_pdns_client():
+    """Shared keep-alive client (None while PDNS_API_KEY is not configured)."""
+    global _pdns_client
+    api_key = os.getenv("PDNS_API_KEY")
+    if not api_key:
+        return None
+    with _pdns_client_lock:
+        if _pdns_client is None:
+            _pdns_client = pdns_client.PdnsClient(
+                PDNS_HOST, api_key.strip(), port=PDNS_PORT, max_age=PDNS_ZONE_MAX_AGE,
+                pool_size=max(pdns_client.POOL_SIZE, PDNS_BULK_CONCURRENCY),
+            )
+        return _pdns_client
+
+
 # [NEW] Phase 19/22: Live DNS Records from PowerDNS
 @app.route("/api/server/<int:server_id>/dns-records-live", methods=["GET"])
 @jwt_required()
 def get_server_dns_records_live(server_id):
     # This endpoint fetches DIRECTLY from PowerDNS API on the inbound server/nameserver
-    # It requires PDNS_HOST and PDNS_API_KEY env vars
+    # It requires PDNS_HOST and PDNS_API_KEY env vars.
+    # Optional filters: ?type=TXT&name=_dmarc (relative or full name); ?refresh=1 bypasses the zone cache.
     
     if not flag.ENABLE_LIVE_DNS:
         return jsonify({"status": "disabled", "message": "Live DNS feature is disabled"}), 403
@@ -2286,57 +3031,153 @@ def get_server_dns_records_live(server_id):
     domain = request.args.get("domain")
     if not domain:
         return jsonify({"status": "error", "message": "Domain is required"}), 400
-        
-    pdns_host = os.getenv("PDNS_HOST", "192.119.169.12") # Default to known IP
-    pdns_api_key = os.getenv("PDNS_API_KEY")
-    
-    if not pdns_api_key:
+
+    client = get_pdns_client()
+    if client is None:
         return jsonify({"status": "error", "message": "PDNS_API_KEY not configured on backend."}), 500
-        
-    # PDNS API URL
-    # GET /api/v1/servers/localhost/zones/{domain}.
-    # Note: Domain in PDNS usually requires trailing dot
-    
-    # Ensure trailing dot for initial query
-    canonical_domain = domain if domain.endswith('.') else f"{domain}."
-    url = f"http://{pdns_host}:8081/api/v1/servers/localhost/zones/{canonical_domain}"
-    
+
     try:
-        headers = {"X-API-Key": pdns_api_key}
-        resp = requests.get(url, headers=headers, timeout=5)
-        
-        if resp.status_code == 200:
-            data = resp.json()
-            # Extract RRsets
-            rrsets = data.get("rrsets", [])
-            records = []
-            
-            for rr in rrsets:
-                r_name = rr.get("name", "").rstrip('.')
-                r_type = rr.get("type", "")
-                r_ttl = rr.get("ttl", 0)
-                
-                for res in rr.get("records", []):
-                    r_content = res.get("content", "")
-                    records.append({
-                        "name": r_name,
-                        "type": r_type,
-                        "ttl": r_ttl,
-                        "content": r_content,
-                        "disabled": res.get("disabled", False)
-                    })
-            
-            return jsonify({"status": "success", "data": records})
-            
-        elif resp.status_code == 404:
-             return jsonify({"status": "error", "message": f"Zone {domain} not found in PowerDNS."}), 404
-        elif resp.status_code == 401:
-             return jsonify({"status": "error", "message": "PowerDNS Authentication Failed (Check API Key)."}), 500
+        records, info = client.records(
+            domain,
+            rtype=request.args.get("type") or None,
+            name=request.args.get("name") or None,
+            refresh=request.args.get("refresh") == "1",
+        )
+        return jsonify({"status": "success", "data": records, "zone": info})
+
+    except pdns_client.PdnsError as e:
+        if e.status == 404:
+            return jsonify({"status": "error", "message": f"Zone {domain} not found in PowerDNS."}), 404
+        if e.status == 401:
+            return jsonify({"status": "error", "message": "PowerDNS Authentication Failed (Check API Key)."}), 500
+        if e.status == 0:
+            return jsonify({"status": "error", "message": e.message}), 500
+        return jsonify({"status": "error", "message": f"PowerDNS Error: {e.status} - {e.message}"}), 500
+
+
+# ==========================================
+# BULK ZONE EXPORT / IMPORT (see zone_transfer.py)
+# ==========================================
+zone_transfer_pool = zone_transfer.ZoneTransfer(max_workers=PDNS_BULK_CONCURRENCY, batch_size=PDNS_PATCH_BATCH)
+
+
+def _user_zone_names(user_id, client):
+    """
+    PowerDNS zones of the user's sender domains. Ownership comes from the Domain table only:
+    dns_details is client-supplied (POST /api/pmta/installed) and must not grant access to
+    another tenant's zone. Installs provision the root domain's zone, so each domain maps to
+    the longest existing zone above it, or to its root domain when there is none yet (an
+    import creates it). Raises pdns_client.PdnsError when the zone list cannot be read.
+    """
+    existing = client.zone_names()
+    zones = set()
+    for d in Domain.query.filter_by(user_id=user_id).all():
+        name = (d.name or "").strip().lower().rstrip(".")
+        if name:
+            zones.add(zone_transfer.owning_zone(name, existing) or ".".join(name.split(".")[-2:]))
+    return sorted(zones)
+
+
+@app.route("/api/dns/zones/export", methods=["GET"])
+@jwt_required()
+def export_dns_zones():
+    """
+    Streams every zone of the user's sender domains.
+    ?format=json (default) or bind; ?domains=a.com,b.com limits the export; ?refresh=1 bypasses the zone cache.
+    Zones that cannot be read are reported in place ({"zone", "error"} / a "; error" comment).
+    """
+    if not flag.ENABLE_LIVE_DNS:
+        return jsonify({"status": "disabled", "message": "Live DNS feature is disabled"}), 403
+    client = get_pdns_client()
+    if client is None:
+        return jsonify({"status": "error", "message": "PDNS_API_KEY not configured on backend."}), 500
+
+    fmt = (request.args.get("format") or "json").lower()
+    if fmt not in ("json", "bind"):
+        return jsonify({"status": "error", "message": "format must be json or bind"}), 400
+    try:
+        zones = _user_zone_names(int(get_jwt_identity()), client)
+    except pdns_client.PdnsError as e:
+        return jsonify({"status": "error", "message": f"Could not list PowerDNS zones: {e.message}"}), 500
+    if request.args.get("domains"):
+        wanted = {d.strip().lower().rstrip(".") for d in request.args["domains"].split(",") if d.strip()}
+        resolved = {d: zone_transfer.owning_zone(d, zones) for d in wanted}
+        unknown = [d for d, zone in resolved.items() if zone is None]
+        if unknown:
+            return jsonify({"status": "error", "message": f"Not your domains: {', '.join(sorted(unknown))}"}), 403
+        zones = sorted(set(resolved.values()))
+    refresh = request.args.get("refresh") == "1"
+
+    def generate():
+        exports = zone_transfer_pool.export(client, zones, refresh=refresh)
+        if fmt == "bind":
+            yield f"; Disabled records are kept as '{zone_transfer.DISABLED_PREFIX}<record>' lines and imported as disabled.\n\n"
+            for export in exports:
+                if export.get("error"):
+                    yield f"; zone {export['zone']}: error: {export['error']}\n\n"
+                else:
+                    yield zone_transfer.render_bind(export) + "\n"
+            return
+        yield '{"status": "success", "format": "json", "zones": ['
+        for i, export in enumerate(exports):
+            yield ("," if i else "") + json.dumps(export)
+        yield "]}"
+
+    stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    filename = f"zones-{stamp}.{'zone' if fmt == 'bind' else 'json'}"
+    return Response(generate(), mimetype="text/plain" if fmt == "bind" else "application/json", headers={
+        "Content-Disposition": f"attachment; filename={filename}",
+        "X-Zone-Count": str(len(zones)),
+    })
+
+
+@app.route("/api/dns/zones/import", methods=["POST"])
+@jwt_required()
+def import_dns_zones():
+    """
+    Applies zones from an export. Body: the JSON export ({"zones": [{"zone", "rrsets"}]}) or BIND
+    text (text/plain, one $ORIGIN section per zone). Options as query args or JSON keys:
+    dry_run (report the changes only), prune (delete live rrsets missing from the import).
+    Only zones of the user's sender domains are accepted.
+    """
+    if not flag.ENABLE_LIVE_DNS:
+        return jsonify({"status": "disabled", "message": "Live DNS feature is disabled"}), 403
+    client = get_pdns_client()
+    if client is None:
+        return jsonify({"status": "error", "message": "PDNS_API_KEY not configured on backend."}), 500
+
+    data = request.get_json(silent=True) if request.is_json else None
+    options = data if isinstance(data, dict) else {}
+    dry_run = bool(options.get("dry_run")) or request.args.get("dry_run") == "1"
+    prune = bool(options.get("prune")) or request.args.get("prune") == "1"
+    try:
+        if data is not None:
+            zones = data.get("zones") if isinstance(data, dict) else None
+            if not isinstance(zones, list) or not all(isinstance(z, dict) and z.get("zone") for z in zones):
+                return jsonify({"status": "error", "message": "zones must be a list of {zone, rrsets}"}), 400
+            zones = [{**z, "zone": z["zone"].strip().lower().rstrip(".")} for z in zones]
         else:
-             return jsonify({"status": "error", "message": f"PowerDNS Error: {resp.status_code} - {resp.text}"}), 500
-             
-    except Exception as e:
-        return jsonify({"status": "error", "message": f"Failed to contact PowerDNS: {str(e)}"}), 500
+            zones = zone_transfer.parse_bind(request.get_data(as_text=True))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    if not zones:
+        return jsonify({"status": "error", "message": "No zones in the import"}), 400
+
+    try:
+        owned = set(_user_zone_names(int(get_jwt_identity()), client))
+    except pdns_client.PdnsError as e:
+        return jsonify({"status": "error", "message": f"Could not list PowerDNS zones: {e.message}"}), 500
+    for entry in zones:
+        if entry["zone"] not in owned and not entry.get("error"):
+            entry["error"] = "not one of your domains"
+
+    results = zone_transfer_pool.import_zones(client, zones, prune=prune, dry_run=dry_run)
+    return jsonify({
+        "status": "success",
+        "dry_run": dry_run,
+        "summary": zone_transfer.summarize(results),
+        "data": results,
+    })
 
 
 @app.route("/api/server/<int:server_id>/pmta/update", methods=["POST"])
@@ -2375,12 +3216,86 @@ def update_pmta_config(server_id):
     update_type = data.get('type')
     update_data = data.get('data')
     
-    success, msg = safe_update_pmta_config(host_ip, ssh_user, ssh_pass, ssh_port, update_type, update_data)
+    success, msg, apply_result = safe_update_pmta_config(host_ip, ssh_user, ssh_pass, ssh_port, update_type, update_data, user_id)
     
     if success:
-        return jsonify({"status": "success", "message": msg})
+        return jsonify({"status": "success", "message": msg, "apply": apply_result})
     else:
-        return jsonify({"status": "error", "message": msg}), 400
+        return jsonify({"status": "error", "message": msg, "apply": apply_result}), 400
+
+# ==========================================
+# PMTA LIVE STATS (http-mgmt-port over SSH)
+# ==========================================
+
+PMTA_STATS_TTL = int(os.getenv("PMTA_STATS_TTL", 15))  # seconds
+PMTA_HTTP_PORT = int(os.getenv("PMTA_HTTP_PORT", pmta_stats.DEFAULT_HTTP_PORT))
+THROUGHPUT_WINDOW_MIN = 15
+
+_pmta_stats_cache = pmta_stats.StatsCache(PMTA_STATS_TTL)
+
+def _pmta_http_port(tree):
+    port = tree.get("http-mgmt-port") if tree is not None else None
+    return int(port) if port and port.strip().isdigit() else PMTA_HTTP_PORT
+
+def get_pmta_live_stats(server, ssh=None, port=None, refresh=False):
+    """
+    (stats, age_seconds) from the server's management port, cached for PMTA_STATS_TTL.
+    Uses `ssh` when given, otherwise connects only on a cache miss. Raises pmta_stats.StatsError.
+    Without `port` the config's http-mgmt-port is used: from the latest stored version, else
+    read from the server.
+    """
+    def load():
+        client = ssh or get_ssh_connection(server.host_ip, server.ssh_username, server.ssh_password_encrypted, server.ssh_port)
+        try:
+            mgmt_port = port
+            if mgmt_port is None:
+                version = ConfigVersion.query.filter_by(server_id=server.id).order_by(ConfigVersion.id.desc()).first()
+                tree = (_parsed_version(version) if version is not None
+                        else pmta_config_ast.parse(read_pmta_config(client, server.ssh_password_encrypted)))
+                mgmt_port = _pmta_http_port(tree)
+            return pmta_stats.fetch_live_stats(client, mgmt_port)
+        finally:
+            if ssh is None:
+                client.close()
+    return _pmta_stats_cache.get(server.id, load, refresh=refresh)
+
+def vmta_throughput(server_id, minutes=THROUGHPUT_WINDOW_MIN):
+    """Delivered messages per minute per VMTA over the last `minutes`, from the accounting rollups."""
+    since = (int(time.time()) - minutes * 60) // 60 * 60
+    rows = db.session.query(DeliveryRollup.vmta, db.func.sum(DeliveryRollup.delivered)).filter(
+        DeliveryRollup.server_id == server_id,
+        DeliveryRollup.resolution == "minute",
+        DeliveryRollup.bucket >= since,
+    ).group_by(DeliveryRollup.vmta).all()
+    return {vmta: round((total or 0) / minutes, 2) for vmta, total in rows}
+
+def _vmta_live_status(stats, live_available):
+    if not live_available:
+        return "enabled"  # No live data: listed in config
+    if stats is None:
+        return "not-loaded"  # In the config file but not running (not reloaded yet)
+    if stats["paused"]:
+        return "paused"
+    if stats["connections"] or stats["queued_recipients"]:
+        return "active"
+    return "idle"
+
+@app.route("/api/server/<int:server_id>/pmta/stats", methods=["GET"])
+@jwt_required()
+def get_pmta_stats(server_id):
+    """Live PMTA status and per-VMTA counters (cached; ?refresh=1 forces a new fetch)."""
+    server, err = _owned_server_or_404(server_id)
+    if err:
+        return err
+    if not server.ssh_password_encrypted:
+        return jsonify({"status": "error", "message": "Credentials not found for this server ID."}), 403
+    try:
+        stats, age = get_pmta_live_stats(server, refresh=request.args.get("refresh") == "1")
+    except pmta_stats.StatsError as e:
+        return jsonify({"status": "error", "message": str(e)}), 502
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+    return jsonify({"status": "success", "age_seconds": round(age, 1), "data": stats})
 
 @app.route("/api/server/<int:server_id>/pmta/vmtas", methods=["GET"])
 @jwt_required()
@@ -2407,53 +3322,787 @@ def get_pmta_vmtas(server_id):
 
     try:
         ssh = get_ssh_connection(host_ip, ssh_user, ssh_pass, ssh_port)
-        stdin, stdout, stderr = exec_sudo_command(ssh, "cat /etc/pmta/config", ssh_pass)
-        config_content = stdout.read().decode('utf-8')
-        ssh.close()
-        
-        # Parse VMTAs
-        # <virtual-mta name>
-        #    smtp-source-host 1.2.3.4 example.com
-        #    domain-key selector, /path/to/key
-        # </virtual-mta>
+        try:
+            config_content = read_pmta_config(ssh, ssh_pass)
+            tree = pmta_config_ast.parse(config_content)
+            # Live counters from the management port, reusing this connection on a cache miss
+            live, live_age, live_error = None, None, None
+            try:
+                live, live_age = get_pmta_live_stats(server, ssh=ssh, port=_pmta_http_port(tree),
+                                                     refresh=request.args.get("refresh") == "1")
+            except pmta_stats.StatsError as e:
+                live_error = str(e)
+        finally:
+            ssh.close()
+        throughput = vmta_throughput(server.id)
         
         vmtas = []
-        # Find all virtual-mta blocks
-        vmta_blocks = re.finditer(r"<virtual-mta\s+(.*?)>(.*?)</virtual-mta>", config_content, re.DOTALL)
-        
-        for match in vmta_blocks:
-            vmta_name = match.group(1).strip()
-            block_content = match.group(2)
-            
-            # Extract details
-            ip = "N/A"
-            domain = "N/A"
-            dkim_path = "N/A"
-            
+        for block in tree.walk("virtual-mta"):
+            name = block.arg.strip()
             # smtp-source-host IP DOMAIN
-            source_match = re.search(r"smtp-source-host\s+([\d\.]+)\s+([\w\.-]+)", block_content)
-            if source_match:
-                ip = source_match.group(1)
-                domain = source_match.group(2)
-                
-            # domain-key selector, path
-            dkim_match = re.search(r"domain-key\s+[\w\.-]+,\s+(.*)", block_content)
-            if dkim_match:
-                dkim_path = dkim_match.group(1).strip()
-                
+            source = (block.get("smtp-source-host") or "").split()
+            # domain-key selector,domain,path
+            domain_key = _parse_domain_key(block.get("domain-key"))
+            stats = live["vmtas"].get(name) if live else None
+
             vmtas.append({
-                "name": vmta_name,
-                "ip": ip,
-                "domain": domain,
-                "dkim_path": dkim_path,
-                "status": "enabled" # Assume enabled if in config
+                "name": name,
+                "ip": source[0] if source else "N/A",
+                "domain": source[1] if len(source) > 1 else "N/A",
+                "dkim_path": domain_key["keyPath"] if domain_key else "N/A",
+                "status": _vmta_live_status(stats, live is not None),
+                "connections": stats["connections"] if stats else None,
+                "queued_recipients": stats["queued_recipients"] if stats else None,
+                "queued_domains": stats["queued_domains"] if stats else None,
+                "delivered_per_min": throughput.get(name, 0),
             })
             
-        return jsonify({"status": "success", "data": vmtas})
+        return jsonify({
+            "status": "success",
+            "data": vmtas,
+            "live": {"available": live is not None, "age_seconds": round(live_age, 1) if live_age is not None else None,
+                     "error": live_error},
+        })
+
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route("/api/server/<int:server_id>/pmta/vmtas/bulk", methods=["POST"])
+@jwt_required()
+def bulk_pmta_vmtas(server_id):
+    """
+    Applies a batch of VMTA operations (create / delete / move / rotate_dkim, see
+    pmta_vmta_ops) to the live config as one edit: parsed once, validated locally,
+    uploaded and reloaded once. Body: {"operations": [...], "dry_run": false}.
+    rotate_dkim generates any missing key at the new paths before the reload and returns
+    the TXT records to publish in "dkim_keys".
+    """
+    if not flag.ENABLE_VMTA_MANAGER:
+        return jsonify({"status": "disabled", "message": "VMTA Management is disabled"}), 403
+
+    server, err = _owned_server_or_404(server_id)
+    if err:
+        return err
+    if not server.ssh_password_encrypted:
+        return jsonify({"status": "error", "message": "Credentials not found for this server ID."}), 403
+
+    data = request.json or {}
+    dry_run = bool(data.get("dry_run"))
+    user_id = get_jwt_identity()
+    ssh_pass = server.ssh_password_encrypted
+    try:
+        ssh = get_ssh_connection(server.host_ip, server.ssh_username, ssh_pass, server.ssh_port)
+        try:
+            current_config = snapshot_remote_config(ssh, ssh_pass, server, user_id)
+            tree = pmta_config_ast.parse(current_config)
+            try:
+                results = pmta_vmta_ops.apply_operations(tree, data.get("operations"))
+            except ValueError as e:
+                return jsonify({"status": "error", "message": str(e)}), 400
+            new_config = tree.render()
+            rotated_paths = {p for r in results if r["op"] == "rotate_dkim" for p in r.get("key_paths", [])}
+
+            # Reject only errors introduced by this batch (pre-existing ones are reported as warnings upstream)
+            before = {(i["code"], i["message"]) for i in validate_config_text(current_config, server)}
+            issues = validate_config_text(new_config, server, extra_dkim_paths=rotated_paths)
+            introduced = [i for i in issues
+                          if i["severity"] == pmta_config_validator.ERROR and (i["code"], i["message"]) not in before]
+            if introduced:
+                return jsonify({
+                    "status": "error",
+                    "message": f"Config Validation Failed ({len(introduced)} errors)",
+                    "results": results,
+                    "errors": introduced[:200],
+                }), 400
+
+            created_keys = []
+            if rotated_paths and not dry_run:
+                # Rotated VMTAs sign with the new keys as soon as PMTA reloads, so they must exist first
+                try:
+                    created_keys = ensure_dkim_keys(ssh, ssh_pass, rotated_paths)
+                except RuntimeError as e:
+                    return jsonify({"status": "error", "message": f"DKIM key generation failed: {e}",
+                                    "results": results}), 500
 
+            if dry_run or new_config == current_config:
+                return jsonify({
+                    "status": "success",
+                    "message": "Dry run, nothing applied." if dry_run else "No changes to apply.",
+                    "results": results,
+                    "validation": _validation_response(issues),
+                })
+
+            result = apply_pmta_config(ssh, ssh_pass, new_config, mode="reload", current=current_config)
+            print(f"[PMTA-APPLY] {server.host_ip} bulk ({len(results)} ops): {result['result']} {result['timings']}")
+            if not result["ok"]:
+                return jsonify({"status": "error", "message": f"Bulk update failed: {pmta_apply.describe_failure(result)}",
+                                "results": results, "apply": result}), 500
+
+            dkim_error, dkim_keys = None, []
+            if rotated_paths:
+                # Register the keys the VMTAs now sign with (selector/domain as written in domain-key)
+                identities = {}
+                for block in tree.walk("virtual-mta"):
+                    for directive in block.directives("domain-key"):
+                        parsed = _parse_domain_key(directive.value)
+                        if parsed and parsed["keyPath"] in rotated_paths:
+                            identities[parsed["keyPath"]] = (parsed["domain"], parsed["selector"])
+                try:
+                    sync_dkim_registry(server, ssh, identities, source="rotate", ssh_pass=ssh_pass)
+                except Exception as e:
+                    db.session.rollback()
+                    dkim_error = f"DKIM registry not updated, /api/dns/info still serves the previous keys: {e}"
+                    print(f"[DKIM] Registry update after rotation failed on {server.host_ip}: {e}")
+                # The TXT records to publish for the new selectors
+                for path, (domain, selector) in sorted(identities.items()):
+                    key = DkimKey.query.filter_by(server_id=server.id, domain=domain, selector=selector).first()
+                    dkim_keys.append({
+                        "domain": domain,
+                        "selector": selector,
+                        "key_path": path,
+                        "created": path in created_keys,
+                        "dns": {"type": "TXT", "host": f"{selector}._domainkey.{domain}",
+                                "value": dkim_txt_value(key)} if key else None,
+                    })
+        finally:
+            ssh.close()
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+    note = ", ".join(f"{r['op']}" for r in results)
+    version = store_config_version(server, applied_config_text(new_config, current_config), user_id=user_id,
+                                   action="bulk", note=f"Bulk VMTA: {note}")
+    return jsonify({
+        "status": "success",
+        "message": "Bulk VMTA changes applied and PMTA reloaded.",
+        "results": results,
+        "apply": result,
+        "version": _version_dict(version),
+        "dkim_error": dkim_error,
+        "dkim_keys": dkim_keys,
+    })
+
+# ==========================================
+# PMTA TUNING PROFILE (resource-aware limits)
+# ==========================================
+
+def probe_server_resources(ssh):
+    from ssh_validator import collect_server_resources
+    return collect_server_resources(ssh)
+
+def build_tuning_profile(resources, vmta_count, overrides=None):
+    """(tuning record for InstalledPMTA.tuning, override errors)."""
+    profile, errors = pmta_tuning.apply_overrides(pmta_tuning.derive_profile(resources, vmta_count), overrides)
+    record = {
+        "profile": profile,
+        "overrides": profile.pop("overrides"),
+        "resources": {k: v for k, v in (resources or {}).items() if k != "errors"},
+        "vmta_count": vmta_count,
+        "updated_at": datetime.utcnow().isoformat(),
+    }
+    return record, errors
+
+@app.route("/api/server/<int:server_id>/pmta/tuning", methods=["GET"])
+@jwt_required()
+def get_pmta_tuning(server_id):
+    server, err = _owned_server_or_404(server_id)
+    if err:
+        return err
+    return jsonify({"status": "success", "data": server.tuning, "limits": pmta_tuning.LIMITS})
+
+@app.route("/api/server/<int:server_id>/pmta/tuning", methods=["POST"])
+@jwt_required()
+def retune_pmta(server_id):
+    """
+    Re-derives the tuning profile from freshly measured resources and the current VMTA
+    count, and writes it into the live config (reload only).
+    Body: {"overrides": {key: int}, "dry_run": false}. Omitted overrides keep the stored ones;
+    {} clears them.
+    """
+    server, err = _owned_server_or_404(server_id)
+    if err:
+        return err
+    if not server.ssh_password_encrypted:
+        return jsonify({"status": "error", "message": "Credentials not found for this server ID."}), 403
+
+    data = request.json or {}
+    dry_run = bool(data.get("dry_run"))
+    overrides = data["overrides"] if "overrides" in data else (server.tuning or {}).get("overrides")
+    if overrides is not None and not isinstance(overrides, dict):
+        return jsonify({"status": "error", "message": "overrides must be an object"}), 400
+    user_id = get_jwt_identity()
+    ssh_pass = server.ssh_password_encrypted
+    try:
+        ssh = get_ssh_connection(server.host_ip, server.ssh_username, ssh_pass, server.ssh_port)
+        try:
+            resources = probe_server_resources(ssh)
+            current_config = snapshot_remote_config(ssh, ssh_pass, server, user_id)
+            tree = pmta_config_ast.parse(current_config)
+            record, errors = build_tuning_profile(resources, sum(1 for _ in tree.walk("virtual-mta")), overrides)
+            if errors:
+                return jsonify({"status": "error", "message": "; ".join(errors)}), 400
+
+            changes = pmta_tuning.apply_to_config(tree, record["profile"], record["overrides"])
+            new_config = tree.render()
+            preview = preview_config_change(current_config, new_config)
+            issues = validate_config_text(new_config, server)
+            if dry_run or not changes:
+                return jsonify({
+                    "status": "success",
+                    "message": "Dry run, nothing applied." if dry_run else "Config already matches the profile.",
+                    "data": record, "changes": changes, "action": preview["action"],
+                    "validation": _validation_response(issues),
+                })
+            if pmta_config_validator.has_errors(issues):
+                return jsonify({"status": "error", "message": "Config validation failed", **_validation_response(issues)}), 400
+
+            result = apply_pmta_config(ssh, ssh_pass, new_config, mode=pmta_config_diff.apply_mode(preview),
+                                       current=current_config)
+            if not result["ok"]:
+                return jsonify({"status": "error", "message": f"Tuning failed: {pmta_apply.describe_failure(result)}",
+                                "apply": result}), 500
+        finally:
+            ssh.close()
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+    server.tuning = record
+    db.session.commit()
+    version = store_config_version(server, applied_config_text(new_config, current_config), user_id=user_id,
+                                   action="tune", note=f"Tuning: {len(changes)} values")
+    return jsonify({
+        "status": "success",
+        "message": f"Tuning profile applied ({len(changes)} values changed).",
+        "data": record,
+        "changes": changes,
+        "apply": result,
+        "version": _version_dict(version),
+    })
+
+@app.route("/api/server/<int:server_id>/pmta/config/split", methods=["POST"])
+@jwt_required()
+def split_pmta_config(server_id):
+    """
+    Moves a monolithic /etc/pmta/config to the conf.d layout (one include file per
+    sender domain and per pool), so later edits upload only the affected files.
+    """
+    server, err = _owned_server_or_404(server_id)
+    if err:
+        return err
+    if not server.ssh_password_encrypted:
+        return jsonify({"status": "error", "message": "Credentials not found for this server ID."}), 403
+
+    user_id = get_jwt_identity()
+    ssh_pass = server.ssh_password_encrypted
+    try:
+        ssh = get_ssh_connection(server.host_ip, server.ssh_username, ssh_pass, server.ssh_port)
+        try:
+            current_config = snapshot_remote_config(ssh, ssh_pass, server, user_id)
+            if pmta_confd.uses_confd(current_config):
+                return jsonify({"status": "success", "message": "Server already uses the conf.d layout."})
+
+            layout = pmta_confd.split(current_config)
+            new_config = pmta_confd.merge(layout)
+            before = {(i["code"], i["message"]) for i in validate_config_text(current_config, server)}
+            introduced = [i for i in validate_config_text(new_config, server)
+                          if i["severity"] == pmta_config_validator.ERROR and (i["code"], i["message"]) not in before]
+            if introduced:
+                return jsonify({"status": "error", "message": "Config Validation Failed", "errors": introduced[:200]}), 400
+
+            result = apply_pmta_config(ssh, ssh_pass, new_config, mode="reload", current=current_config)
+            if not result["ok"]:
+                return jsonify({"status": "error", "message": f"Split failed: {pmta_apply.describe_failure(result)}", "apply": result}), 500
+        finally:
+            ssh.close()
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+    version = store_config_version(server, new_config, user_id=user_id, action="split", note=f"{len(layout) - 1} include files")
+    return jsonify({
+        "status": "success",
+        "message": f"Config split into {len(layout) - 1} include files.",
+        "files": sorted(layout),
+        "apply": result,
+        "version": _version_dict(version),
+    })
+
+# ==========================================
+# PMTA ACCOUNTING INGESTION (acct.csv)
+# ==========================================
+
+ACCT_INGEST_INTERVAL = int(os.getenv("ACCT_INGEST_INTERVAL", 300))  # seconds, 0 disables the background collector
+ACCT_INGEST_MAX_BYTES = int(os.getenv("ACCT_INGEST_MAX_MB", 256)) * 1024 * 1024  # per server per run
+ACCT_INSERT_BATCH = 2000
+ACCT_RETENTION_DAYS = int(os.getenv("ACCT_RETENTION_DAYS", 30))  # raw acct_records kept; 0 keeps them forever
+ACCT_PRUNE_BATCH = 20000
+
+_acct_ingest_locks = {}
+_acct_ingest_locks_guard = threading.Lock()
+
+def _acct_cursor_dict(cursor):
+    return {
+        "server_id": cursor.server_id,
+        "path": cursor.path,
+        "inode": cursor.inode,
+        "offset": cursor.offset or 0,
+        "records_total": cursor.records_total or 0,
+        "last_run_at": cursor.last_run_at.isoformat() if cursor.last_run_at else None,
+        "last_error": cursor.last_error,
+    }
+
+def ingest_pmta_accounting(server):
+    """
+    Pulls new acct.csv bytes from one server and bulk-inserts them into acct_records.
+    Records are streamed and flushed every ACCT_INSERT_BATCH rows, so memory stays
+    constant regardless of file size. Returns the number of records inserted, or
+    None if another ingestion for this server is already running.
+    """
+    with _acct_ingest_locks_guard:
+        lock = _acct_ingest_locks.setdefault(server.id, threading.Lock())
+    if not lock.acquire(blocking=False):
+        return None
+
+    try:
+        cursor = AcctCursor.query.filter_by(server_id=server.id).first()
+        if not cursor:
+            cursor = AcctCursor(server_id=server.id, path=acct_ingest.ACCT_PATH, offset=0, records_total=0)
+            db.session.add(cursor)
+            db.session.commit()
+
+        ssh_pass = server.ssh_password_encrypted
+        ssh = get_ssh_connection(server.host_ip, server.ssh_username, ssh_pass, server.ssh_port)
+        inserted = 0
+        batch = []
+
+        def flush(inode, offset, cols):
+            nonlocal inserted, batch
+            if batch:
+                db.session.execute(AcctRecord.__table__.insert(), batch)
+                _apply_delivery_rollups(server.id, batch)
+            cursor.inode = inode
+            cursor.offset = offset
+            if cols:
+                cursor.header = ",".join(cols)
+            cursor.records_total = (cursor.records_total or 0) + len(batch)
+            cursor.last_run_at = datetime.utcnow()
+            cursor.last_error = None
+            db.session.commit()
+            inserted += len(batch)
+            batch = []
+
+        try:
+            cmd = acct_ingest.build_pull_command(cursor.path, cursor.inode, cursor.offset or 0, ACCT_INGEST_MAX_BYTES)
+            stdin, stdout, stderr = exec_sudo_command(ssh, cmd, ssh_pass)
+            first_line = stdout.readline()
+            if isinstance(first_line, bytes):
+                first_line = first_line.decode("utf-8", errors="replace")
+            ident = acct_ingest.parse_identity(first_line)
+            if ident is None:
+                cursor.last_run_at = datetime.utcnow()
+                cursor.last_error = f"{cursor.path} not found on server"
+                db.session.commit()
+                return 0
+
+            header = cursor.header.split(",") if cursor.header else None
+
+            # 1. Unread tail of the rotated file (still identified by the cursor's inode)
+            if ident["old_bytes"]:
+                old_reader = acct_ingest.LimitedReader(stdout, ident["old_bytes"])
+                offset, cols = cursor.offset or 0, header
+                for record, offset, cols in acct_ingest.iter_acct_records(old_reader, offset, header):
+                    batch.append(acct_ingest.to_row(record, server.id))
+                    if len(batch) >= ACCT_INSERT_BATCH:
+                        flush(cursor.inode, offset, cols)
+                flush(cursor.inode, offset, cols)
+                old_reader.drain()
+
+            # 2. Current file. A new inode or a shrunk file restarts from 0 with its own header row.
+            if ident["inode"] != cursor.inode or ident["start"] != (cursor.offset or 0):
+                header = None
+                cursor.header = None
+            offset, cols = ident["start"], header
+            for record, offset, cols in acct_ingest.iter_acct_records(stdout, offset, header):
+                batch.append(acct_ingest.to_row(record, server.id))
+                if len(batch) >= ACCT_INSERT_BATCH:
+                    flush(ident["inode"], offset, cols)
+            flush(ident["inode"], offset, cols)
+        finally:
+            ssh.close()
+
+        return inserted
+    finally:
+        lock.release()
+
+# ==========================================
+# DELIVERY METRICS ROLLUPS
+# ==========================================
+
+_isp_groups_cache = {"mtime": None, "groups": {}}
+
+def get_isp_groups():
+    """Receiving-domain groups from the domain-macro lines of the PMTA template (reloaded when it changes)."""
+    path = os.path.join(BASE_DIR, PMTA_TEMPLATE)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {}
+    if _isp_groups_cache["mtime"] != mtime:
+        _isp_groups_cache["groups"] = delivery_metrics.load_isp_groups(path)
+        _isp_groups_cache["mtime"] = mtime
+    return _isp_groups_cache["groups"]
+
+def _apply_delivery_rollups(server_id, rows):
+    """Adds the counters of a batch of acct rows to the rollup table. Runs inside the caller's transaction."""
+    deltas = delivery_metrics.aggregate(rows, get_isp_groups())
+    if not deltas:
+        return
+
+    by_resolution = {}
+    for key in deltas:
+        by_resolution.setdefault(key[0], set()).add(key[1])
+
+    existing = {}
+    for resolution, buckets in by_resolution.items():
+        for row in DeliveryRollup.query.filter(
+            DeliveryRollup.server_id == server_id,
+            DeliveryRollup.resolution == resolution,
+            DeliveryRollup.bucket.in_(buckets),
+        ):
+            existing[(row.resolution, row.bucket, row.vmta or "", row.sender_domain or "", row.isp_group)] = row
+
+    new_rows = []
+    for key, counts in deltas.items():
+        row = existing.get(key)
+        if row is not None:
+            row.delivered = (row.delivered or 0) + counts["delivered"]
+            row.deferred = (row.deferred or 0) + counts["deferred"]
+            row.bounced = (row.bounced or 0) + counts["bounced"]
+        else:
+            resolution, bucket, vmta, sender_domain, group = key
+            new_rows.append({
+                "server_id": server_id, "resolution": resolution, "bucket": bucket,
+                "vmta": vmta, "sender_domain": sender_domain, "isp_group": group, **counts,
+            })
+    if new_rows:
+        db.session.execute(DeliveryRollup.__table__.insert(), new_rows)
+    db.session.flush()
+
+def prune_acct_records():
+    """
+    Deletes acct_records older than ACCT_RETENTION_DAYS (the delivery rollups keep the
+    history). Runs per server so the (server_id, logged_at) index is used, in batches of
+    ACCT_PRUNE_BATCH so no single statement holds the table for long. Returns the count.
+    """
+    if ACCT_RETENTION_DAYS <= 0:
+        return 0
+    cutoff = int(time.time()) - ACCT_RETENTION_DAYS * 86400
+    deleted = 0
+    for (server_id,) in db.session.query(AcctRecord.server_id).distinct().all():
+        while True:
+            ids = [row.id for row in db.session.query(AcctRecord.id).filter(
+                AcctRecord.server_id == server_id, AcctRecord.logged_at < cutoff).limit(ACCT_PRUNE_BATCH)]
+            if not ids:
+                break
+            AcctRecord.query.filter(AcctRecord.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+            deleted += len(ids)
+    return deleted
+
+def prune_delivery_rollups():
+    """Drops buckets past their resolution's retention; coarser resolutions keep the history."""
+    now = int(time.time())
+    for resolution, cutoff in delivery_metrics.retention_cutoffs(now):
+        DeliveryRollup.query.filter(
+            DeliveryRollup.resolution == resolution,
+            DeliveryRollup.bucket < cutoff,
+        ).delete(synchronize_session=False)
+    db.session.commit()
+
+_METRIC_DIMENSIONS = {
+    "server": DeliveryRollup.server_id,
+    "vmta": DeliveryRollup.vmta,
+    "sender_domain": DeliveryRollup.sender_domain,
+    "isp_group": DeliveryRollup.isp_group,
+}
+
+@app.route("/api/metrics/delivery", methods=["GET"])
+@jwt_required()
+def get_delivery_metrics():
+    """
+    Delivered / deferred / bounced series.
+    Query: since, until (epoch seconds, default last 24h), step (seconds, default 300),
+           group_by (server|vmta|sender_domain|isp_group), server_id, vmta, sender_domain, isp_group filters.
+    """
+    user_id = get_jwt_identity()
+    claims = get_jwt()
+    now = int(time.time())
+    try:
+        until = int(request.args.get("until", now))
+        since = int(request.args.get("since", until - 86400))
+        step = int(request.args.get("step", 300))
+    except ValueError:
+        return jsonify({"status": "error", "message": "since, until and step must be integers"}), 400
+    step = max(60, step - step % 60)
+    if since >= until:
+        return jsonify({"status": "error", "message": "since must be before until"}), 400
+    if (until - since) // step > 5000:
+        return jsonify({"status": "error", "message": "Too many points; increase step"}), 400
+
+    group_by = request.args.get("group_by", "vmta")
+    dimension = _METRIC_DIMENSIONS.get(group_by)
+    if dimension is None:
+        return jsonify({"status": "error", "message": f"group_by must be one of {sorted(_METRIC_DIMENSIONS)}"}), 400
+
+    resolution = delivery_metrics.pick_resolution(step, since, now)
+    width = delivery_metrics.RESOLUTIONS[resolution]
+    slot = (DeliveryRollup.bucket - DeliveryRollup.bucket % step).label("slot")
+
+    query = db.session.query(
+        slot,
+        dimension.label("dim"),
+        db.func.sum(DeliveryRollup.delivered),
+        db.func.sum(DeliveryRollup.deferred),
+        db.func.sum(DeliveryRollup.bounced),
+    ).filter(
+        DeliveryRollup.resolution == resolution,
+        DeliveryRollup.bucket >= since - since % width,
+        DeliveryRollup.bucket < until,
+    )
+
+    if claims.get("role") not in ["admin", "super_admin"]:
+        owned = [s.id for s in InstalledPMTA.query.with_entities(InstalledPMTA.id).filter_by(user_id=user_id)]
+        query = query.filter(DeliveryRollup.server_id.in_(owned or [-1]))
+    if request.args.get("server_id"):
+        query = query.filter(DeliveryRollup.server_id == request.args.get("server_id", type=int))
+    for field in ("vmta", "sender_domain", "isp_group"):
+        if request.args.get(field):
+            query = query.filter(getattr(DeliveryRollup, field) == request.args[field])
+
+    series = {}
+    for slot_start, dim, delivered, deferred, bounced in query.group_by("slot", "dim").order_by("slot"):
+        series.setdefault(str(dim), []).append({
+            "t": int(slot_start),
+            "delivered": int(delivered or 0),
+            "deferred": int(deferred or 0),
+            "bounced": int(bounced or 0),
+        })
+
+    return jsonify({
+        "status": "success",
+        "since": since,
+        "until": until,
+        "step": step,
+        "resolution": resolution,
+        "group_by": group_by,
+        "series": series,
+    })
+
+def ingest_all_accounting():
+    """Background collector: ingests acct.csv from every server with stored credentials."""
+    servers = InstalledPMTA.query.filter(InstalledPMTA.ssh_password_encrypted.isnot(None)).all()
+    for server in servers:
+        try:
+            ingest_pmta_accounting(server)
+        except Exception as e:
+            db.session.rollback()
+            _logging.warning("[acct-ingest] Server %s (%s) failed: %s", server.id, server.host_ip, e)
+            try:
+                cursor = AcctCursor.query.filter_by(server_id=server.id).first()
+                if cursor:
+                    cursor.last_error = str(e)
+                    cursor.last_run_at = datetime.utcnow()
+                    db.session.commit()
+            except Exception:
+                db.session.rollback()
+
+@app.route("/api/server/<int:server_id>/acct/ingest", methods=["POST"])
+@jwt_required()
+def trigger_acct_ingest(server_id):
+    user_id = get_jwt_identity()
+    server = InstalledPMTA.query.filter_by(id=server_id, user_id=user_id).first()
+    if not server:
+        return jsonify({"status": "error", "message": "Server ID not found"}), 404
+    if not server.ssh_password_encrypted:
+        return jsonify({"status": "error", "message": "Credentials not found for this server ID."}), 403
+
+    try:
+        inserted = ingest_pmta_accounting(server)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 500
+    if inserted is None:
+        return jsonify({"status": "busy", "message": "Ingestion already running for this server"}), 409
+
+    cursor = AcctCursor.query.filter_by(server_id=server.id).first()
+    return jsonify({"status": "success", "inserted": inserted, "cursor": _acct_cursor_dict(cursor)})
+
+@app.route("/api/server/<int:server_id>/acct/status", methods=["GET"])
+@jwt_required()
+def get_acct_status(server_id):
+    user_id = get_jwt_identity()
+    server = InstalledPMTA.query.filter_by(id=server_id, user_id=user_id).first()
+    if not server:
+        return jsonify({"status": "error", "message": "Server ID not found"}), 404
+    cursor = AcctCursor.query.filter_by(server_id=server.id).first()
+    return jsonify({"status": "success", "cursor": _acct_cursor_dict(cursor) if cursor else None})
+
+# ==========================================
+# PMTA QUEUE MONITORING (ring-buffer time series)
+# ==========================================
+
+QUEUE_SAMPLE_RESOLUTION = int(os.getenv("QUEUE_SAMPLE_RESOLUTION", pmta_queue_series.DEFAULT_RESOLUTION))  # seconds
+QUEUE_SAMPLE_RETENTION = int(float(os.getenv("QUEUE_SAMPLE_RETENTION_HOURS", 48)) * 3600)
+QUEUE_SAMPLE_INTERVAL = int(os.getenv("QUEUE_SAMPLE_INTERVAL", QUEUE_SAMPLE_RESOLUTION))  # 0 disables the sampler
+QUEUE_SAMPLE_SLOTS = pmta_queue_series.ring_slots(QUEUE_SAMPLE_RESOLUTION, QUEUE_SAMPLE_RETENTION)
+
+QUEUE_ALERT_THRESHOLDS = {
+    "total_recipients": int(os.getenv("QUEUE_ALERT_TOTAL_RCPT", 100000)),
+    "domain_recipients": int(os.getenv("QUEUE_ALERT_DOMAIN_RCPT", 20000)),
+    "backoff_recipients": int(os.getenv("QUEUE_ALERT_BACKOFF_RCPT", 1000)),
+}
+QUEUE_ALERT_COOLDOWN = int(os.getenv("QUEUE_ALERT_COOLDOWN", 3600))  # seconds between repeats of one alert
+
+_queue_alerts_sent = {}  # (server_id, alert key) -> last sent, epoch seconds
+
+def sample_pmta_queues(server):
+    """Stores one queue depth sample for a server in its ring slot. Returns the stored rows."""
+    # Shares the live stats cache, so a dashboard poll and the sampler never fetch twice per TTL
+    stats, _ = get_pmta_live_stats(server)
+    ts = stats["fetched_at"]
+    bucket = pmta_queue_series.bucket_of(ts, QUEUE_SAMPLE_RESOLUTION)
+    slot = pmta_queue_series.slot_of(ts, QUEUE_SAMPLE_RESOLUTION, QUEUE_SAMPLE_SLOTS)
+    rows = pmta_queue_series.build_rows(stats)
+
+    # Overwrite the slot: drops the sample from one lap ago (or an earlier one in this bucket)
+    QueueSample.query.filter_by(server_id=server.id, slot=slot).delete(synchronize_session=False)
+    db.session.execute(QueueSample.__table__.insert(), [{
+        "server_id": server.id, "slot": slot, "bucket": bucket,
+        "scope": row["scope"], "name": (row["name"] or "")[:255],
+        "recipients": int(row["recipients"] or 0), "kb": int(row["kb"] or 0),
+        "connections": int(row["connections"] or 0), "backoff": bool(row["backoff"]),
+        "spool_files": int(row["spool_files"]) if row["spool_files"] is not None else None,
+    } for row in rows])
+    db.session.commit()
+    return rows
+
+def _send_queue_alerts(server, alerts):
+    """Emails new alerts to the server owner; each alert repeats at most once per QUEUE_ALERT_COOLDOWN."""
+    now = time.time()
+    fresh = []
+    for alert in alerts:
+        key = (server.id, alert["key"])
+        if now - _queue_alerts_sent.get(key, 0) >= QUEUE_ALERT_COOLDOWN:
+            _queue_alerts_sent[key] = now
+            fresh.append(alert)
+    if not fresh:
+        return []
+    owner = User.query.get(server.user_id)
+    if not owner or not owner.email:
+        return []
+
+    labels = {
+        "total_recipients": "Total queued recipients",
+        "domain_recipients": "Queued recipients for domain",
+        "backoff_recipients": "Domain in backoff with queued recipients",
+    }
+    items = "".join(
+        f"<li>{labels.get(a['metric'], a['metric'])}{' ' + a['name'] if a['name'] else ''}: "
+        f"<b>{a['value']}</b> (threshold {a['threshold']})</li>"
+        for a in fresh
+    )
+    html_content = f"""
+    <h3>PowerMTA queue alert for {server.host_ip}</h3>
+    <ul>{items}</ul>
+    <p>Check the queue charts in the dashboard for the trend.</p>
+    """
+    send_email(owner.email, f"Queue alert: {server.host_ip}", html_content)
+    return fresh
+
+def sample_all_queues():
+    """Background sampler: records queue depth for every server with stored credentials and checks thresholds."""
+    servers = InstalledPMTA.query.filter(InstalledPMTA.ssh_password_encrypted.isnot(None)).all()
+    for server in servers:
+        try:
+            rows = sample_pmta_queues(server)
+            _send_queue_alerts(server, pmta_queue_series.check_thresholds(rows, QUEUE_ALERT_THRESHOLDS))
+        except Exception as e:
+            db.session.rollback()
+            _logging.warning("[queue-sampler] Server %s (%s) failed: %s", server.id, server.host_ip, e)
+
+@app.route("/api/server/<int:server_id>/pmta/queue-series", methods=["GET"])
+@jwt_required()
+def get_queue_series(server_id):
+    """
+    Queue depth series for charts.
+    Query: scope (server|domain|vmta, default server), name (one domain/VMTA; default the
+           `top` busiest in the window), top (default 10), since, until (epoch seconds, default
+           the last 6h), step (seconds, multiple of the sample resolution; max of each step is kept).
+    """
+    server, err = _owned_server_or_404(server_id)
+    if err:
+        return err
+    now = int(time.time())
+    try:
+        until = int(request.args.get("until", now))
+        since = int(request.args.get("since", until - 6 * 3600))
+        step = int(request.args.get("step", QUEUE_SAMPLE_RESOLUTION))
+        top = min(int(request.args.get("top", 10)), 50)
+    except ValueError:
+        return jsonify({"status": "error", "message": "since, until, step and top must be integers"}), 400
+    step = max(QUEUE_SAMPLE_RESOLUTION, step - step % QUEUE_SAMPLE_RESOLUTION)
+    if since >= until:
+        return jsonify({"status": "error", "message": "since must be before until"}), 400
+    if (until - since) // step > 5000:
+        return jsonify({"status": "error", "message": "Too many points; increase step"}), 400
+    scope = request.args.get("scope", "server")
+    if scope not in pmta_queue_series.SCOPES:
+        return jsonify({"status": "error", "message": f"scope must be one of {list(pmta_queue_series.SCOPES)}"}), 400
+
+    base = QueueSample.query.filter(
+        QueueSample.server_id == server.id,
+        QueueSample.scope == scope,
+        QueueSample.bucket >= since,
+        QueueSample.bucket < until,
+    )
+    if request.args.get("name"):
+        names = [request.args["name"].lower() if scope == "domain" else request.args["name"]]
+    elif scope == "server":
+        names = [""]
+    else:
+        names = [name for name, _ in base.with_entities(QueueSample.name, db.func.max(QueueSample.recipients))
+                 .group_by(QueueSample.name).order_by(db.func.max(QueueSample.recipients).desc()).limit(top)]
+
+    slot = (QueueSample.bucket - QueueSample.bucket % step).label("t")
+    query = base.filter(QueueSample.name.in_(names or [None])).with_entities(
+        slot,
+        QueueSample.name,
+        db.func.max(QueueSample.recipients),
+        db.func.max(QueueSample.kb),
+        db.func.max(QueueSample.connections),
+        db.func.max(db.case((QueueSample.backoff, 1), else_=0)),  # max() of a boolean isn't portable
+        db.func.max(QueueSample.spool_files),
+    ).group_by("t", QueueSample.name).order_by("t")
+
+    series = {name: [] for name in names}
+    for t, name, recipients, kb, connections, backoff, spool_files in query:
+        point = {"t": int(t), "recipients": int(recipients or 0), "kb": int(kb or 0),
+                 "connections": int(connections or 0), "backoff": bool(backoff)}
+        if scope == "server":
+            point["spool_files"] = int(spool_files) if spool_files is not None else None
+        series.setdefault(name, []).append(point)
+
+    return jsonify({
+        "status": "success",
+        "since": since,
+        "until": until,
+        "step": step,
+        "resolution": QUEUE_SAMPLE_RESOLUTION,
+        "retention_seconds": QUEUE_SAMPLE_RETENTION,
+        "scope": scope,
+        "thresholds": QUEUE_ALERT_THRESHOLDS,
+        "series": series,
+    })
+
 def generate_temp_password(length=16):
     alphabet = string.ascii_letters + string.digits
     return ''.join(secrets.choice(alphabet) for i in range(length))
@@ -2519,6 +4168,9 @@ def run_install(data, user_id, job_db_id=None):
     raw_mappings = data.get("mappings", [])
     fresh_install = data.get("fresh_install", False)
     install_ok = False
+    event_job_id = _install_job_public_id(job_db_id)
+    if event_job_id:
+        job_event_bus.hold(event_job_id)
 
     # 1. Expand Mappings (Ranges/CIDRs to Individual IP objects)
     mappings = []
@@ -2612,6 +4264,8 @@ def run_install(data, user_id, job_db_id=None):
         
         if message:
             log(f"[{step_id.upper()}] {message}")
+        if event_job_id:
+            job_event_bus.publish(event_job_id, "install.progress", {"step": step_id, "status": mapped_status, "message": message})
 
 
     # Helper functions need to use current_active_pass, not ssh_pass directly
@@ -2638,22 +4292,17 @@ def run_install(data, user_id, job_db_id=None):
     # Actually, simpler to just updating the `run_command` and `upload_file` to call the new `create_ssh_client`
     # passed above.
     
-    # ... (Keep get_ptr, check_a_record helpers same) ...
+    # PTR / A lookups go through the shared resolver cache (dns_verifier)
     def get_ptr(ip):
         try:
-            hostname, _, _ = socket.gethostbyaddr(ip)
-            return hostname
-        except socket.herror:
-            return None
-        except Exception:
+            answer = dns_verifier.lookup(ipaddress.ip_address(ip).reverse_pointer, "PTR")
+        except ValueError:
             return None
+        return answer["values"][0].rstrip(".") if answer["values"] else None
 
     def check_a_record(hostname):
-        try:
-            msg_ip = socket.gethostbyname(hostname)
-            return msg_ip
-        except Exception:
-            return None
+        answer = dns_verifier.lookup(hostname, "A")
+        return answer["values"][0] if answer["values"] else None
 
     def run_command(cmd, description):
         log(f"--- {description} ---")
@@ -2712,40 +4361,16 @@ def run_install(data, user_id, job_db_id=None):
             if client: client.close()
             return False
 
-    def validate_pmta_config(config_str):
-        issues = []
-        
-        # 1. Check for properly closed pools
-        open_pools = config_str.count("<virtual-mta-pool")
-        close_pools = config_str.count("</virtual-mta-pool>")
-        if open_pools != close_pools:
-            issues.append(f"Pool Mismatch: {open_pools} opened, {close_pools} closed")
-        
-        # 2. Check for Forbidden Directives in Domain Blocks
-        lines = config_str.split('\n')
-        in_domain = False
-        curr_domain = ""
-        
-        for line in lines:
-            line = line.strip()
-            if line.startswith("<domain"):
-                in_domain = True
-                curr_domain = line
-            elif line.startswith("</domain>"):
-                in_domain = False
-            
-            if in_domain:
-                # Forbidden directives
-                if line.startswith("use-virtual-mta") or line.startswith("use-virtual-mta-pool") or "source-ip" in line:
-                     issues.append(f"Forbidden Routing Directive in '{curr_domain}': {line}")
-        
-        # 3. Check for Mandatory Global Directives
+    def validate_pmta_config(config_str, external_names=None):
+        issues = [
+            pmta_config_validator.format_issue(i)
+            for i in pmta_config_validator.validate_config(config_str, external_names=external_names)
+            if i["severity"] == pmta_config_validator.ERROR
+        ]
+
+        # Mandatory Global Directives
         if "add-date-header yes" not in config_str:
             issues.append("Missing Mandatory Directive: 'add-date-header yes'")
-            
-        # 4. Safety Check: No Placeholder Domains
-        if "myplatform.com" in config_str:
-             issues.append("CRITICAL: Placeholder domain 'myplatform.com' found in config. Aborting!")
 
         return issues
 
@@ -2884,6 +4509,7 @@ def run_install(data, user_id, job_db_id=None):
             return False
 
     mode = data.get("mode", "install")
+    tuning_record = None  # set by a fresh install (see pmta_tuning.py)
     
     # === CORE FLOW ===
     try:
@@ -2980,15 +4606,17 @@ def run_install(data, user_id, job_db_id=None):
              pass
 
         # [NEW] Deduplication for Onboarding (Additive Mode)
+        existing_names = []
+        current_config = None
         if mode == "onboard":
             log(">>> [ONBOARDING] Fetching existing config for deduplication...")
             ssh = create_ssh_client()
             if ssh:
                 try:
-                    stdin, stdout, stderr = ssh.exec_command("cat /etc/pmta/config")
-                    current_config = stdout.read().decode('utf-8')
+                    current_config = read_pmta_config(ssh)
                     parsed_config = parse_pmta_config(current_config)
                     ssh.close()
+                    existing_names = [v["name"] for v in parsed_config["vmtas"]] + [p["name"] for p in parsed_config["pools"]]
 
                     # Extract existing IPs/Domains to check against
                     existing_ips = set()
@@ -3107,6 +4735,12 @@ def run_install(data, user_id, job_db_id=None):
             
             vmta_names_all = []
             vmta_global_idx = 1
+            # New VMTAs are numbered after the highest existing vmtaN (onboarding), so existing
+            # blocks keep their names; gaps are not reused and non-vmtaN names are ignored.
+            for existing_name in existing_names:
+                m_idx = re.match(r"^vmta(\d+)$", existing_name)
+                if m_idx:
+                    vmta_global_idx = max(vmta_global_idx, int(m_idx.group(1)) + 1)
             
             # --- 3a. Provision CLIENT IDENTITY + Generate VMTA Blocks (Multi-Home Mode) ---
             # We treat every domain as its own sender identity (Client Mode)
@@ -3137,6 +4771,7 @@ def run_install(data, user_id, job_db_id=None):
                 log(f"!!! [DNS] Ensure the PowerDNS service (pdns) is running on {pdns_host} and port {pdns_port} is open.")
                 log(f"!!! [DNS] DNS records will NOT be provisioned. VMTA configuration will continue.")
 
+            dns_batch = []
             for d_name, ips in active_gen_domains.items():
                 log(f">>> [DEBUG] Processing domain: {d_name} with IPs: {ips}")
                 parts = d_name.split('.')
@@ -3145,46 +4780,17 @@ def run_install(data, user_id, job_db_id=None):
                 # Retrieve key for DNS provisioning
                 pub_key = dkim_pub_keys.get(d_name, "")
 
-                # Provision Client Sender Identity (SPF/DKIM/DMARC)
+                # Provision Client Sender Identity (SPF/DKIM/DMARC) — queued, sent as one batch below
                 if pub_key and pdns_key and pdns_reachable:
-                    try:
-                        cmd_client = [
-                            sys.executable, os.path.join(BASE_DIR, "pdns_automator.py"),
-                            "--domain", root_domain,
-                            "--selector", "default",
-                            "--dkim-key", pub_key,
-                            "--dmarc-email", f"postmaster@{root_domain}"
-                        ]
-
+                    dns_batch.append({
+                        "domain": root_domain,
+                        "ip": list(ips),
+                        "selector": "default",
+                        "dkim_key": pub_key,
+                        "dmarc_email": f"postmaster@{root_domain}",
                         # Pass Inbound IP for Split-Role DNS (MX -> Inbound)
-                        inbound_ip = data.get("inbound_ip")
-                        if inbound_ip:
-                            cmd_client.extend(["--inbound-ip", inbound_ip])
-
-                        for ip in ips:
-                            cmd_client.extend(["--ip", ip])
-
-                        # [FIX] Capture and log subprocess result — previously silent on failure
-                        result = subprocess.run(
-                            cmd_client,
-                            capture_output=True,
-                            text=True,
-                            env=env,
-                            cwd=BASE_DIR  # [FIX] Explicit working dir so pdns_automator.py is always found
-                        )
-                        if result.returncode == 0:
-                            log(f">>> [DNS] Provisioned DNS records for {root_domain}")
-                            if result.stdout.strip():
-                                log(f">>> [DNS] Output: {result.stdout.strip()}")
-                        else:
-                            log(f"!!! [DNS] pdns_automator FAILED for {root_domain} (exit {result.returncode})")
-                            if result.stderr.strip():
-                                log(f"!!! [DNS] STDERR: {result.stderr.strip()}")
-                            if result.stdout.strip():
-                                log(f"!!! [DNS] STDOUT: {result.stdout.strip()}")
-
-                    except Exception as dns_err:
-                        log(f"!!! WARNING: DNS provisioning failed for {root_domain}: {dns_err} (continuing with VMTA generation)")
+                        "inbound_ip": data.get("inbound_ip"),
+                    })
                 elif pub_key and not pdns_reachable:
                     log(f"!!! [DNS] Skipping DNS provisioning for {root_domain} (PowerDNS unreachable — check service status on {pdns_host})")
                 elif pub_key:
@@ -3214,6 +4820,33 @@ def run_install(data, user_id, job_db_id=None):
                 # We do NOT generate <domain> blocks for local delivery anymore.
                 pass
 
+            # One pdns_automator run for every domain: shared API session, only changed rrsets are PATCHed
+            if dns_batch:
+                try:
+                    result = subprocess.run(
+                        [sys.executable, os.path.join(BASE_DIR, "pdns_automator.py"), "--batch", "-"],
+                        input=json.dumps(dns_batch),
+                        capture_output=True,
+                        text=True,
+                        env=env,
+                        cwd=BASE_DIR  # [FIX] Explicit working dir so pdns_automator.py is always found
+                    )
+                    for line in result.stdout.strip().splitlines():
+                        log(f">>> [DNS] {line}")
+                    if result.returncode != 0:
+                        log(f"!!! [DNS] pdns_automator reported failures (exit {result.returncode})")
+                        if result.stderr.strip():
+                            log(f"!!! [DNS] STDERR: {result.stderr.strip()}")
+
+                    # Watch resolvers pick up the domains whose records were just written
+                    changed = set(re.findall(r"^DNS Provisioned for ([^\s:]+)", result.stdout, re.MULTILINE))
+                    watch_entries = [e for e in dns_batch if e["domain"] in changed]
+                    if watch_entries and event_job_id:
+                        start_propagation_watch(event_job_id, user_id, watch_entries)
+                        log(f">>> [DNS] Watching propagation for {len(watch_entries)} domain(s)")
+                except Exception as dns_err:
+                    log(f"!!! WARNING: DNS provisioning failed: {dns_err} (continuing with VMTA generation)")
+
             # 4. Finalize Config Blocks
             if vmta_names_all:
                 pool_members = "\n    ".join([f"virtual-mta {n}" for n in vmta_names_all])
@@ -3242,7 +4875,7 @@ def run_install(data, user_id, job_db_id=None):
 
             # 5. Validate & Apply Config
             if mode != "install":
-                validation_issues = validate_pmta_config(final_config_str)
+                validation_issues = validate_pmta_config(final_config_str, external_names=existing_names)
                 if validation_issues:
                     log("!!! CONFIG VALIDATION FAILED !!!")
                     for issue in validation_issues:
@@ -3253,7 +4886,39 @@ def run_install(data, user_id, job_db_id=None):
                 with open(PMTA_TEMPLATE, "r") as f:
                     script = f.read()
 
-                script = script.replace("{{VMTA_BLOCK}}", final_config_str)
+                # Connection caps and rates sized to this box (operator overrides from data["tuning"] win)
+                tuning_resources = None
+                tune_ssh = create_ssh_client()
+                if tune_ssh:
+                    try:
+                        tuning_resources = probe_server_resources(tune_ssh)
+                    except Exception as tune_e:
+                        log(f"--- [TUNING] Resource probe failed, using defaults: {tune_e}")
+                    finally:
+                        tune_ssh.close()
+                tuning_record, tuning_errors = build_tuning_profile(tuning_resources, len(vmta_names_all), data.get("tuning"))
+                for tuning_error in tuning_errors:
+                    log(f"--- [TUNING] Ignored override: {tuning_error}")
+                script = pmta_tuning.render_template(script, tuning_record["profile"])
+                log(f">>> [TUNING] {tuning_record['profile']['source']} profile: "
+                    f"{pmta_tuning.directive_values(tuning_record['profile'])}")
+                for tuning_note in tuning_record["profile"]["notes"]:
+                    log(f"--- [TUNING] {tuning_note}")
+
+                fragment_script = ""
+                if PMTA_CONFD_LAYOUT:
+                    # Root keeps sources/users and includes conf.d; VMTAs and pools go to per-domain/pool files
+                    layout = pmta_confd.split(final_config_str)
+                    script = script.replace("{{VMTA_BLOCK}}", layout.pop(pmta_confd.ROOT_PATH).rstrip("\n"))
+                    fragment_script = (
+                        f"mkdir -p {pmta_confd.POOL_DIR}\n"
+                        f"rm -f {pmta_confd.CONF_DIR}/*.conf {pmta_confd.POOL_DIR}/*.conf\n"
+                    )
+                    for frag_path, frag_text in layout.items():
+                        fragment_script += f"cat > {frag_path} <<'PMTA_CONF_D_EOF'\n{frag_text}PMTA_CONF_D_EOF\n"
+                    log(f">>> [CONFIG] conf.d layout: {len(layout)} include files")
+                else:
+                    script = script.replace("{{VMTA_BLOCK}}", final_config_str)
                 script = script.replace("{{DOMAIN_BLOCK}}", "")
                 script = script.replace("{{HOSTNAME}}", "localhost.localdomain") 
 
@@ -3266,7 +4931,7 @@ def run_install(data, user_id, job_db_id=None):
                     if script.startswith("#!/bin/bash"):
                         script = script[11:].lstrip()
                     
-                    final_script = safety_header + "\n" + script + """
+                    final_script = safety_header + "\n" + script + "\n" + fragment_script + """
     # Validate & Start
     echo "Validating Config..."
     # /usr/sbin/pmtad --debug --dontSend > /var/log/pmta_validation.log 2>&1 &
@@ -3278,6 +4943,24 @@ def run_install(data, user_id, job_db_id=None):
                         f_dbg.write(final_script)
                     tmp.write(final_script.encode('utf-8'))
                     tmp_path = tmp.name
+            elif pmta_confd.uses_confd(current_config):
+                # conf.d layout: merge the new blocks and upload only the include files that changed
+                log(">>> [ONBOARDING] conf.d layout detected, applying changed include files only...")
+                tree = pmta_config_ast.parse(current_config)
+                merged = pmta_vmta_ops.merge_fragment(tree, final_config_str)
+                log(f"--- {merged['added']} blocks added, {merged['members']} pool members added, {merged['kept']} existing kept")
+                apply_ssh = create_ssh_client()
+                if not apply_ssh: raise Exception("Failed to connect for config apply.")
+                try:
+                    apply_result = apply_pmta_config(apply_ssh, current_active_pass, tree.render(), mode="reload", current=current_config)
+                finally:
+                    apply_ssh.close()
+                log(f">>> [PMTA-APPLY] {apply_result['result']}: {len(apply_result['files'])} files {apply_result['timings']}")
+                for changed_path in apply_result["files"]:
+                    log(f"    {changed_path}")
+                if not apply_result["ok"]:
+                    raise Exception(f"Config application failed: {pmta_apply.describe_failure(apply_result)}")
+                tmp_path = None
             else:
                 # ADDITIVE SCRIPT GENERATION
                 log(f">>> [ONBOARDING] Generating additive config script...")
@@ -3297,8 +4980,9 @@ def run_install(data, user_id, job_db_id=None):
                     tmp.write(final_script.encode('utf-8'))
                     tmp_path = tmp.name
 
-            if not upload_file(tmp_path, "/root/pmta-apply-config.sh"): raise Exception("Config apply script upload failed.")
-            if not run_command("bash /root/pmta-apply-config.sh", "Apply Configuration"): raise Exception("Config application failed.")
+            if tmp_path:
+                if not upload_file(tmp_path, "/root/pmta-apply-config.sh"): raise Exception("Config apply script upload failed.")
+                if not run_command("bash /root/pmta-apply-config.sh", "Apply Configuration"): raise Exception("Config application failed.")
             
             log(">>> [STEP:FINISH] PMTA configuration completed successfully.")
 
@@ -3314,6 +4998,12 @@ def run_install(data, user_id, job_db_id=None):
             log("-" * 60)
             log(f"{'IP':<16} {'Current PTR':<25} {'Required PTR':<25} {'Result'}")
             log("-" * 60)
+
+            # Resolve every PTR at once; get_ptr below is then served from the cache
+            dns_verifier.lookup_many([
+                (ipaddress.ip_address(m["ip"]).reverse_pointer, "PTR")
+                for m in mappings if validate_ip(m["ip"])
+            ])
             
             for m in mappings:
                 ip = m["ip"]
@@ -3446,6 +5136,44 @@ def run_install(data, user_id, job_db_id=None):
                         existing.installed_at = datetime.utcnow()
                         db.session.commit()
                         log(f">>> [DB] Updated InstalledPMTA record for {server_ip}")
+
+                    # DKIM registry: the public keys were already read during key generation
+                    try:
+                        key_server = InstalledPMTA.query.filter_by(host_ip=server_ip, user_id=user_id).first()
+                        registered = set()
+                        for d_name, pub_key in dkim_pub_keys.items():
+                            parts = d_name.split('.')
+                            root_domain = ".".join(parts[-2:]) if len(parts) > 2 else d_name
+                            if root_domain in registered:
+                                continue
+                            if register_dkim_key(key_server, root_domain, "default", pub_key,
+                                                 key_path=f"/etc/pmta/dkim/{root_domain}/default.private", source="install"):
+                                registered.add(root_domain)
+                        db.session.commit()
+                        log(f">>> [DB] DKIM registry: {len(registered)} keys recorded")
+                    except Exception as dk_e:
+                        db.session.rollback()
+                        log(f"--- [DB] DKIM registry update skipped: {dk_e}")
+
+                    # Record bound IPs / DKIM keys for local config validation, and the applied config version
+                    inv_ssh = create_ssh_client()
+                    if inv_ssh:
+                        try:
+                            server_row = InstalledPMTA.query.filter_by(host_ip=server_ip, user_id=user_id).first()
+                            if tuning_record is not None:
+                                server_row.tuning = tuning_record
+                            inventory = refresh_server_inventory(server_row, inv_ssh)
+                            log(f">>> [DB] Inventory: {len(inventory['ips'])} IPs, {len(inventory['dkim_paths'])} DKIM keys")
+
+                            applied_config = read_pmta_config(inv_ssh)
+                            if applied_config:
+                                version = store_config_version(server_row, applied_config, user_id=user_id,
+                                                               action=mode, install_job_id=job_db_id)
+                                log(f">>> [DB] Stored config version #{version.id}")
+                        except Exception as inv_e:
+                            log(f"--- [DB] Inventory/config snapshot skipped: {inv_e}")
+                        finally:
+                            inv_ssh.close()
                 except Exception as e:
                     log(f"!!! [DB] Failed to save record: {e}")
 
@@ -3514,6 +5242,9 @@ def run_install(data, user_id, job_db_id=None):
                         db.session.commit()
             except Exception:
                 pass
+        if event_job_id:
+            job_event_bus.publish(event_job_id, "job.status", {"status": "success" if install_ok else "failed"})
+            job_event_bus.release(event_job_id)
         
         try:
             with app.app_context():
@@ -3538,20 +5269,32 @@ def run_install(data, user_id, job_db_id=None):
         else:
              log("Password was not rotated or already reverted (Stability Mode).")
 
+        # Job finished: move its log into the archive store (unless another job is still writing to it)
+        try:
+            with app.app_context():
+                still_running = InstallJob.query.filter(
+                    InstallJob.user_id == user_id,
+                    InstallJob.id != job_db_id,
+                    InstallJob.status.in_([JobStatus.PENDING, JobStatus.RUNNING, JobStatus.RETRYING]),
+                ).count()
+            if not still_running:
+                archive_job_log(user_id, job_db_id)
+        except Exception as e:
+            print(f"Failed to archive job log: {e}")
+
 @app.route("/api/install/logs", methods=["GET"])
 @app.route("/install_logs", methods=["GET"])
 @limiter.limit("120 per minute") # Allow frequent polling (2 requests per second)
 @jwt_required()
 def get_install_logs():
     user_id = get_jwt_identity()
-    log_file = get_log_file(user_id)
-    if os.path.exists(log_file):
-        try:
-            with open(log_file, "r", encoding="utf-8") as f:
-                return jsonify({"logs": f.read()})
-        except Exception:
-             return jsonify({"logs": "Error reading log file"})
-    return jsonify({"logs": ""})
+    try:
+        content = read_job_log(user_id)
+    except Exception:
+        return jsonify({"logs": "Error reading log file"})
+    if content is None:
+        return jsonify({"logs": ""})
+    return jsonify({"logs": content.decode("utf-8", errors="replace")})
 
 
 @app.route("/api/logs", methods=["GET"])
@@ -3569,28 +5312,23 @@ def get_realtime_logs():
     if offset < 0:
         offset = 0
 
-    log_file_path = get_log_file(user_id)
-    if not os.path.exists(log_file_path):
-        return jsonify({"logs": [], "next_offset": offset})
-
     max_read_bytes = 200_000
     logs = []
     next_offset = offset
 
     try:
-        with open(log_file_path, "rb") as f:
-            f.seek(offset, os.SEEK_SET)
-            chunk = f.read(max_read_bytes)
-            if not chunk:
-                return jsonify({"logs": [], "next_offset": offset})
+        # Live file while the job runs, compressed archive afterwards (same byte offsets)
+        chunk = read_job_log(user_id, offset, max_read_bytes)
+        if not chunk:
+            return jsonify({"logs": [], "next_offset": offset})
 
-            # Avoid returning a partial last line when truncated mid-line
-            if len(chunk) == max_read_bytes and not chunk.endswith(b"\n"):
-                tail = f.readline()
-                if tail:
-                    chunk += tail
+        # Avoid returning a partial last line when truncated mid-line
+        if len(chunk) == max_read_bytes and not chunk.endswith(b"\n"):
+            cut = chunk.rfind(b"\n")
+            if cut != -1:
+                chunk = chunk[:cut + 1]
 
-            next_offset = offset + len(chunk)
+        next_offset = offset + len(chunk)
 
         text = chunk.decode("utf-8", errors="replace")
         logs = [ln for ln in text.splitlines() if ln != ""]
@@ -3601,6 +5339,22 @@ def get_realtime_logs():
     return jsonify({"logs": logs, "next_offset": next_offset})
 
 
+DNS_VERIFY_NAMESERVERS = [ns.strip() for ns in os.getenv("DNS_VERIFY_NAMESERVERS", "8.8.8.8,1.1.1.1").split(",") if ns.strip()]
+DNS_CACHE_MAX_ENTRIES = int(os.getenv("DNS_CACHE_MAX_ENTRIES", 10000))  # per upstream set (LRU)
+DKIM_SELECTORS = ['default', 'dkim', 'pmta']
+
+# Shared by every request (verification, audits, installs): one resolver, one lookup pool, one LRU/TTL cache
+dns_verifier = dns_engine.shared(DNS_VERIFY_NAMESERVERS, max_entries=DNS_CACHE_MAX_ENTRIES)
+
+@app.route("/api/dns/resolver/stats", methods=["GET"])
+@jwt_required()
+def get_dns_resolver_stats():
+    """Cache metrics of every shared resolver (hits, misses, negative hits, coalesced, evictions)."""
+    claims = get_jwt()
+    if claims.get("role") not in ["admin", "super_admin"]:
+        return jsonify({"status": "error", "message": "Unauthorized"}), 403
+    return jsonify({"status": "success", "resolvers": dns_engine.all_stats()})
+
 @app.route("/api/dns/records", methods=["GET"])
 @app.route("/dns/records", methods=["GET"]) # Legacy alias
 @jwt_required()
@@ -3610,81 +5364,668 @@ def get_dns_records():
     
     # Clean domain
     domain = domain.strip().rstrip('.')
+    refresh = request.args.get("refresh") == "1"
     
-    resolver = dns.resolver.Resolver()
-    # Use reliable public resolvers
-    resolver.nameservers = ['8.8.8.8', '1.1.1.1'] 
+    mail_host = f"mail.{domain}"
+    dmarc_host = f"_dmarc.{domain}"
+    dkim_hosts = [f"{selector}._domainkey.{domain}" for selector in DKIM_SELECTORS]
+
+    # Every lookup for the domain at once; the response waits only for the slowest
+    t0 = time.time()
+    answers = dns_verifier.lookup_many(
+        [(mail_host, 'A'), (domain, 'TXT'), (dmarc_host, 'TXT')] + [(h, 'TXT') for h in dkim_hosts] + [(domain, 'NS')],
+        refresh=refresh,
+    )
+    a_ans, txt_ans, dmarc_ans = answers[:3]
+    dkim_answers = answers[3:3 + len(dkim_hosts)]
+    ns_ans = answers[-1]
     
     records = []
-    
-    def query_record(name, rtype):
-        try:
-            answers = resolver.resolve(name, rtype)
-            return [r.to_text().strip('"') for r in answers]
-        except (dns.resolver.NoAnswer, dns.resolver.NXDOMAIN):
-            return []
-        except Exception as e:
-            return [] # Return empty on error, don't fail whole request
+
+    def add(rtype, name, value, status, answer):
+        records.append({"type": rtype, "name": name, "value": value, "status": status,
+                        "latency_ms": answer["latency_ms"], "cached": answer["cached"]})
 
     # 1. A Record (Mail Host)
     # Convention: mail.<domain>
-    mail_host = f"mail.{domain}"
-    a_records = query_record(mail_host, 'A')
-    for ip in a_records:
-        records.append({"type": "A", "name": mail_host, "value": ip, "status": "ok"})
-        
-    if not a_records:
-        records.append({"type": "A", "name": mail_host, "value": "Missing", "status": "missing"})
+    for ip in a_ans["values"]:
+        add("A", mail_host, ip, "ok", a_ans)
+    if not a_ans["values"]:
+        add("A", mail_host, "Missing", "missing", a_ans)
 
     # 2. SPF Record (TXT @)
-    txt_records = query_record(domain, 'TXT')
-    spf_found = False
-    for txt in txt_records:
-        if "v=spf1" in txt:
-            records.append({"type": "TXT", "name": domain, "value": txt, "status": "ok"})
-            spf_found = True
-    
-    if not spf_found:
-        records.append({"type": "TXT", "name": domain, "value": "v=spf1 ...", "status": "missing"})
+    spf = [txt for txt in txt_ans["values"] if "v=spf1" in txt]
+    for txt in spf:
+        add("TXT", domain, txt, "ok", txt_ans)
+    if not spf:
+        add("TXT", domain, "v=spf1 ...", "missing", txt_ans)
 
     # 3. DMARC Record (TXT _dmarc)
-    dmarc_host = f"_dmarc.{domain}"
-    dmarc_records = query_record(dmarc_host, 'TXT')
-    dmarc_found = False
-    for txt in dmarc_records:
-        if "v=DMARC1" in txt:
-            records.append({"type": "TXT", "name": dmarc_host, "value": txt, "status": "ok"})
-            dmarc_found = True
-            
-    if not dmarc_found:
-         records.append({"type": "TXT", "name": dmarc_host, "value": "v=DMARC1 ...", "status": "missing"})
+    dmarc = [txt for txt in dmarc_ans["values"] if "v=DMARC1" in txt]
+    for txt in dmarc:
+        add("TXT", dmarc_host, txt, "ok", dmarc_ans)
+    if not dmarc:
+        add("TXT", dmarc_host, "v=DMARC1 ...", "missing", dmarc_ans)
 
-    # 4. DKIM Record (TXT default._domainkey OR dkim._domainkey)
-    # We try 'default' and 'dkim' selectors
-    dkim_selectors = ['default', 'dkim', 'pmta']
+    # 4. DKIM Record (TXT <selector>._domainkey for each known selector)
     dkim_found = False
-    
-    for selector in dkim_selectors:
-        dkim_host = f"{selector}._domainkey.{domain}"
-        dkim_recs = query_record(dkim_host, 'TXT')
-        for txt in dkim_recs:
-             if "v=DKIM1" in txt:
-                 records.append({"type": "TXT", "name": dkim_host, "value": txt[:50] + "...", "status": "ok"})
-                 dkim_found = True
-                 
+    for dkim_host, dkim_ans in zip(dkim_hosts, dkim_answers):
+        for txt in dkim_ans["values"]:
+            if "v=DKIM1" in txt:
+                add("TXT", dkim_host, txt[:50] + "...", "ok", dkim_ans)
+                dkim_found = True
     if not dkim_found:
-        records.append({"type": "TXT", "name": "default._domainkey." + domain, "value": "v=DKIM1 ...", "status": "missing"})
+        add("TXT", "default._domainkey." + domain, "v=DKIM1 ...", "missing", dkim_answers[0])
 
     # 5. NS Records
-    ns_recs = query_record(domain, 'NS')
+    ns_recs = ns_ans["values"]
     
     return jsonify({
         "status": "success",
         "domain": domain,
         "nameservers": ns_recs,
-        "records": records
+        "records": records,
+        "lookups": {
+            "total_ms": round((time.time() - t0) * 1000, 1),
+            "queries": len(answers),
+            "cached": sum(1 for a in answers if a["cached"]),
+            "errors": [{"name": a["name"], "type": a["type"], "error": a["error"]} for a in answers if a["status"] == dns_engine.ERROR],
+        },
+    })
+
+# ==========================================
+# FORWARD-CONFIRMED REVERSE DNS (bulk PTR checks)
+# ==========================================
+
+FCRDNS_MAX_IPS = int(os.getenv("FCRDNS_MAX_IPS", 2048))
+
+def _expected_ptr_hosts(servers):
+    """{ip: hostname} from the PTR records the installs stored (mail.<root domain> per mapping)."""
+    expected = {}
+    for server in sorted(servers, key=lambda s: s.installed_at or datetime.min):
+        for entry in server.dns_details or []:
+            for rec in (entry.get("records") or []) if isinstance(entry, dict) else []:
+                if rec.get("type") == "PTR" and rec.get("name") and rec.get("value"):
+                    expected[rec["name"].strip()] = rec["value"]
+    return expected
+
+def _ip_item_size(item):
+    """Number of addresses a single IP / CIDR / range entry covers (None when it does not parse)."""
+    item = item.strip()
+    try:
+        if "/" in item:
+            return ipaddress.IPv4Network(item, strict=False).num_addresses
+        if "-" in item:
+            start, _, end = item.partition("-")
+            return abs(int(ipaddress.IPv4Address(end.strip())) - int(ipaddress.IPv4Address(start.strip()))) + 1
+        ipaddress.ip_address(item)
+        return 1
+    except ValueError:
+        return None
+
+@app.route("/api/dns/fcrdns", methods=["POST"])
+@jwt_required()
+def check_fcrdns():
+    """
+    Bulk forward-confirmed reverse DNS. Body: {"server_id": n} (its mapped IPs) or
+    {"ips": ["1.2.3.4", "10.0.0.0/28", "1.2.3.10-1.2.3.20"]}; "refresh": true re-resolves
+    instead of using cached answers (after a PTR change at the provider).
+    Expected PTR hostnames come from the install mappings of the user's servers.
+    """
+    user_id = int(get_jwt_identity())
+    data = request.json or {}
+    servers = InstalledPMTA.query.filter_by(user_id=user_id).all()
+
+    if data.get("server_id"):
+        server = next((s for s in servers if s.id == int(data["server_id"])), None)
+        if server is None:
+            return jsonify({"status": "error", "message": "Server ID not found"}), 404
+        expected = _expected_ptr_hosts([server])
+        ips = list(expected)
+        if not ips:
+            return jsonify({"status": "error", "message": "No IP mappings stored for this server"}), 404
+    else:
+        items = data.get("ips")
+        if not isinstance(items, list) or not items:
+            return jsonify({"status": "error", "message": "server_id or a non-empty ips list is required"}), 400
+        ips = []
+        for item in items:
+            # Size CIDRs and ranges before expanding them: a /8 would otherwise be built in full
+            size = _ip_item_size(str(item))
+            if size is not None and len(ips) + size > FCRDNS_MAX_IPS:
+                return jsonify({"status": "error", "message": f"Too many IPs (max {FCRDNS_MAX_IPS})"}), 400
+            expanded = expand_ips(str(item))
+            if not expanded:
+                return jsonify({"status": "error", "message": f"Invalid IP, range or CIDR: {item}"}), 400
+            ips.extend(expanded)
+        expected = _expected_ptr_hosts(servers)
+
+    ips = list(dict.fromkeys(ips))
+    if len(ips) > FCRDNS_MAX_IPS:
+        return jsonify({"status": "error", "message": f"Too many IPs ({len(ips)}, max {FCRDNS_MAX_IPS})"}), 400
+
+    started = time.time()
+    results = fcrdns.check(dns_verifier, ips, expected, refresh=bool(data.get("refresh")))
+    return jsonify({
+        "status": "success",
+        "counts": fcrdns.counts(results),
+        "elapsed_ms": round((time.time() - started) * 1000, 1),
+        "data": results,
     })
 
+# ==========================================
+# DNS HEALTH SCANNER (all sender domains)
+# ==========================================
+
+DNS_HEALTH_INTERVAL = int(os.getenv("DNS_HEALTH_INTERVAL", 3600))  # seconds, 0 disables the background scanner
+DNS_HEALTH_BATCH = int(os.getenv("DNS_HEALTH_BATCH", 25))  # domains whose lookups run concurrently
+
+_dns_health_lock = threading.Lock()
+
+def _published_dns_records(user_ids=None):
+    """
+    {(user_id, domain): records} from the dns_details the installs stored. An install has
+    one entry per mapped IP, so a domain's records are the entries of its server combined.
+    """
+    query = InstalledPMTA.query.filter(InstalledPMTA.dns_details.isnot(None))
+    if user_ids is not None:
+        query = query.filter(InstalledPMTA.user_id.in_(user_ids))
+    published = {}
+    # Oldest first, so a newer install's records win for the same domain
+    for server in query.order_by(InstalledPMTA.installed_at):
+        records = {}
+        for entry in server.dns_details or []:
+            if isinstance(entry, dict) and entry.get("domain"):
+                records.setdefault((server.user_id, entry["domain"].lower()), []).extend(entry.get("records") or [])
+        published.update(records)
+    return published
+
+def _health_dict(row, details=False):
+    data = {
+        "domain": row.domain,
+        "status": row.status,
+        "checked_at": row.checked_at.isoformat() if row.checked_at else None,
+        "changed_at": row.changed_at.isoformat() if row.changed_at else None,
+        "failing": [c["check"] for c in row.checks or [] if c["status"] != dns_health.OK],
+    }
+    if details:
+        data["checks"] = row.checks
+    return data
+
+def scan_domain_health(domains=None, refresh=False):
+    """
+    Checks the given Domain rows (default: every domain) in batches of DNS_HEALTH_BATCH,
+    storing the latest snapshot and a history event whenever a check changes status.
+    Returns the number of domains scanned, or None if a scan is already running.
+    """
+    if not _dns_health_lock.acquire(blocking=False):
+        return None
+    try:
+        domains = Domain.query.all() if domains is None else domains
+        published = _published_dns_records({d.user_id for d in domains})
+        scanned = 0
+        for i in range(0, len(domains), DNS_HEALTH_BATCH):
+            batch = domains[i:i + DNS_HEALTH_BATCH]
+            expected = [dns_health.expected_records(d.name, published.get((d.user_id, d.name.lower()))) for d in batch]
+            queries = [q for exp in expected for q in dns_health.lookups(exp)]
+            answers = dns_verifier.lookup_many(queries, refresh=refresh)
+
+            existing = {h.domain_id: h for h in DomainHealth.query.filter(DomainHealth.domain_id.in_([d.id for d in batch]))}
+            now = datetime.utcnow()
+            pos = 0
+            for domain, exp in zip(batch, expected):
+                checks = dns_health.evaluate(exp, answers[pos:pos + len(exp)])
+                pos += len(exp)
+                status = dns_health.overall_status(checks)
+                row = existing.get(domain.id)
+                if row is None:
+                    row = DomainHealth(domain_id=domain.id, user_id=domain.user_id, domain=domain.name, changed_at=now)
+                    db.session.add(row)
+                else:
+                    diff = dns_health.changes(dns_health.fingerprint(row.checks or []), dns_health.fingerprint(checks))
+                    if diff:
+                        db.session.add(DomainHealthEvent(domain_id=domain.id, status_from=row.status, status_to=status, changes=diff))
+                        row.changed_at = now
+                row.user_id = domain.user_id
+                row.status = status
+                row.checks = checks
+                row.checked_at = now
+                scanned += 1
+            db.session.commit()
+        return scanned
+    finally:
+        _dns_health_lock.release()
+
+def scan_all_domain_health():
+    """Background scanner entry point."""
+    scanned = scan_domain_health()
+    if scanned:
+        _logging.info("[dns-health] Scanned %s domains", scanned)
+
+@app.route("/api/dns/health", methods=["GET"])
+@jwt_required()
+def get_dns_health():
+    """Latest DNS health of all the user's domains from the stored snapshots (no live lookups). ?details=1 adds every check."""
+    user_id = get_jwt_identity()
+    details = request.args.get("details") == "1"
+    rows = {h.domain_id: h for h in DomainHealth.query.filter_by(user_id=int(user_id))}
+    data, counts = [], {}
+    for domain in Domain.query.filter_by(user_id=int(user_id)).order_by(Domain.name):
+        row = rows.get(domain.id)
+        item = _health_dict(row, details) if row else {"domain": domain.name, "status": "pending", "checked_at": None,
+                                                        "changed_at": None, "failing": []}
+        counts[item["status"]] = counts.get(item["status"], 0) + 1
+        data.append(item)
+    return jsonify({"status": "success", "counts": counts, "data": data})
+
+@app.route("/api/dns/health/scan", methods=["POST"])
+@jwt_required()
+def trigger_dns_health_scan():
+    """Rescans the user's domains now (fresh lookups). Body: {"domain": "..."} for a single domain."""
+    user_id = get_jwt_identity()
+    name = ((request.json or {}).get("domain") or "").strip().lower().rstrip(".")
+    query = Domain.query.filter_by(user_id=int(user_id))
+    if name:
+        query = query.filter(db.func.lower(Domain.name) == name)
+    domains = query.all()
+    if not domains:
+        return jsonify({"status": "error", "message": "Domain not found"}), 404
+    scanned = scan_domain_health(domains, refresh=True)
+    if scanned is None:
+        return jsonify({"status": "busy", "message": "A DNS health scan is already running"}), 409
+    rows = DomainHealth.query.filter(DomainHealth.domain_id.in_([d.id for d in domains])).order_by(DomainHealth.domain)
+    return jsonify({"status": "success", "scanned": scanned, "data": [_health_dict(r, details=bool(name)) for r in rows]})
+
+@app.route("/api/dns/health/<string:domain_name>/history", methods=["GET"])
+@jwt_required()
+def get_dns_health_history(domain_name):
+    user_id = get_jwt_identity()
+    domain = Domain.query.filter_by(user_id=int(user_id)).filter(
+        db.func.lower(Domain.name) == domain_name.strip().lower().rstrip(".")).first()
+    if not domain:
+        return jsonify({"status": "error", "message": "Domain not found"}), 404
+    limit = min(request.args.get("limit", 100, type=int), 1000)
+    events = DomainHealthEvent.query.filter_by(domain_id=domain.id).order_by(DomainHealthEvent.id.desc()).limit(limit)
+    row = DomainHealth.query.filter_by(domain_id=domain.id).first()
+    return jsonify({
+        "status": "success",
+        "current": _health_dict(row, details=True) if row else None,
+        "history": [{
+            "status_from": e.status_from,
+            "status_to": e.status_to,
+            "changes": e.changes,
+            "created_at": e.created_at.isoformat() if e.created_at else None,
+        } for e in events],
+    })
+
+# ==========================================
+# DNSBL REPUTATION SCANNER (all sending IPs)
+# ==========================================
+
+DNSBL_SCAN_INTERVAL = int(os.getenv("DNSBL_SCAN_INTERVAL", 86400))  # seconds, 0 disables the background scanner
+DNSBL_ZONES = dnsbl.parse_zones(os.getenv("DNSBL_ZONES"))  # "zone[:qps],..."
+# Several lists refuse queries from big public resolvers: the system resolver is used unless
+# DNSBL_NAMESERVERS names others, and public ones need DNSBL_ALLOW_PUBLIC_RESOLVERS=1
+DNSBL_ALLOW_PUBLIC_RESOLVERS = os.getenv("DNSBL_ALLOW_PUBLIC_RESOLVERS", "0") == "1"
+DNSBL_NAMESERVERS, _dnsbl_refused = dnsbl.select_nameservers(os.getenv("DNSBL_NAMESERVERS"), DNSBL_ALLOW_PUBLIC_RESOLVERS)
+if _dnsbl_refused:
+    _logging.warning("[dnsbl] Ignoring public resolvers %s (set DNSBL_ALLOW_PUBLIC_RESOLVERS=1 to use them)",
+                     ", ".join(_dnsbl_refused))
+
+# None when no usable resolver is configured; scans are then refused
+dnsbl_scanner = (dnsbl.Scanner(dns_engine.shared(DNSBL_NAMESERVERS, max_entries=DNS_CACHE_MAX_ENTRIES), DNSBL_ZONES)
+                 if DNSBL_NAMESERVERS else None)
+_dnsbl_lock = threading.Lock()
+
+def sending_ips(server):
+    """Public IPs a server sends from: A records the install published plus the VMTA source IPs of its latest stored config."""
+    ips = set()
+    for entry in server.dns_details or []:
+        for rec in (entry.get("records") or []) if isinstance(entry, dict) else []:
+            if rec.get("type") == "A" and rec.get("value"):
+                ips.add(rec["value"].strip())
+    version = ConfigVersion.query.filter_by(server_id=server.id).order_by(ConfigVersion.id.desc()).first()
+    if version is not None:
+        for block in _parsed_version(version).walk("virtual-mta"):
+            host = (block.get("smtp-source-host") or "").split()
+            if host:
+                ips.add(host[0])
+    return sorted(ip for ip in ips if dnsbl.is_checkable(ip))
+
+def _listing_dict(row):
+    return {
+        "id": row.id,
+        "server_id": row.server_id,
+        "ip": row.ip,
+        "zone": row.zone,
+        "codes": row.codes,
+        "detail": row.detail,
+        "reason": row.reason,
+        "listed_at": row.listed_at.isoformat() if row.listed_at else None,
+        "delisted_at": row.delisted_at.isoformat() if row.delisted_at else None,
+        "last_checked_at": row.last_checked_at.isoformat() if row.last_checked_at else None,
+    }
+
+def scan_dnsbl(servers=None, refresh=False, trigger="schedule"):
+    """
+    Checks every sending IP of the given servers (default: all) against DNSBL_ZONES.
+    Each IP is looked up once even if several servers use it. Opens a listing period
+    when an IP becomes listed and closes it when it is clean again; lookup errors
+    leave the state as it was. Returns the DnsblScan row, or None if a scan is running.
+    Raises RuntimeError when no DNSBL resolver is configured.
+    """
+    if dnsbl_scanner is None:
+        raise RuntimeError("No DNSBL resolver configured (set DNSBL_NAMESERVERS to a non-public recursor)")
+    if not _dnsbl_lock.acquire(blocking=False):
+        return None
+    try:
+        servers = InstalledPMTA.query.all() if servers is None else servers
+        owners = {}
+        for server in servers:
+            for ip in sending_ips(server):
+                owners.setdefault(ip, []).append(server)
+        run = DnsblScan(trigger=trigger, servers=len(servers), ips=len(owners), started_at=datetime.utcnow())
+        db.session.add(run)
+        db.session.commit()
+
+        results = dnsbl_scanner.scan(sorted(owners), refresh=refresh)
+        now = datetime.utcnow()
+        server_ids = [s.id for s in servers]
+        open_rows = {}
+        if server_ids:
+            for row in DnsblListing.query.filter(DnsblListing.delisted_at.is_(None), DnsblListing.server_id.in_(server_ids)):
+                open_rows[(row.server_id, row.ip, row.zone)] = row
+        for result in results:
+            if result["status"] == dnsbl.ERROR:
+                continue
+            for server in owners[result["ip"]]:
+                row = open_rows.get((server.id, result["ip"], result["zone"]))
+                if result["status"] == dnsbl.LISTED:
+                    if row is None:
+                        row = DnsblListing(server_id=server.id, user_id=server.user_id, ip=result["ip"],
+                                           zone=result["zone"], listed_at=now)
+                        db.session.add(row)
+                    row.codes, row.detail, row.reason = result["codes"], result["detail"], result["reason"]
+                    row.last_checked_at = now
+                elif row is not None:
+                    row.delisted_at = row.last_checked_at = now
+
+        summary = dnsbl.summarize(results)
+        run.queries, run.cached, run.listed, run.errors = summary["queries"], summary["cached"], summary["listed"], summary["errors"]
+        run.finished_at = datetime.utcnow()
+        db.session.commit()
+        return run
+    finally:
+        _dnsbl_lock.release()
+
+def scan_all_dnsbl():
+    """Background scanner entry point."""
+    if dnsbl_scanner is None:
+        _logging.warning("[dnsbl] Skipping scan: no DNSBL resolver configured")
+        return
+    run = scan_dnsbl()
+    if run:
+        _logging.info("[dnsbl] Checked %s IPs (%s queries, %s cached): %s listings, %s errors",
+                      run.ips, run.queries, run.cached, run.listed, run.errors)
+
+def _dnsbl_scope_query(model):
+    """Rows of the caller's servers; admins see the whole fleet."""
+    if get_jwt().get("role") in ["admin", "super_admin"]:
+        return model.query
+    return model.query.filter(model.user_id == int(get_jwt_identity()))
+
+@app.route("/api/dnsbl/listed", methods=["GET"])
+@jwt_required()
+def get_dnsbl_listed():
+    """Currently listed IPs (open listing periods), fleet-wide for admins. ?zone= / ?server_id= filter."""
+    query = _dnsbl_scope_query(DnsblListing).filter(DnsblListing.delisted_at.is_(None))
+    if request.args.get("zone"):
+        query = query.filter(DnsblListing.zone == request.args["zone"].lower())
+    if request.args.get("server_id", type=int):
+        query = query.filter(DnsblListing.server_id == request.args.get("server_id", type=int))
+    rows = query.order_by(DnsblListing.ip, DnsblListing.zone).all()
+    last_scan = DnsblScan.query.filter(DnsblScan.finished_at.isnot(None)).order_by(DnsblScan.id.desc()).first()
+    return jsonify({
+        "status": "success",
+        "count": len(rows),
+        "ips": len({r.ip for r in rows}),
+        "last_scan_at": last_scan.finished_at.isoformat() if last_scan else None,
+        "zones": [z["zone"] for z in DNSBL_ZONES],
+        "data": [_listing_dict(r) for r in rows],
+    })
+
+@app.route("/api/dnsbl/history", methods=["GET"])
+@jwt_required()
+def get_dnsbl_history():
+    """Listing periods (open and closed), newest first. ?ip= narrows to one IP."""
+    query = _dnsbl_scope_query(DnsblListing)
+    if request.args.get("ip"):
+        query = query.filter(DnsblListing.ip == request.args["ip"].strip())
+    limit = min(request.args.get("limit", 200, type=int), 1000)
+    rows = query.order_by(DnsblListing.listed_at.desc()).limit(limit).all()
+    return jsonify({"status": "success", "data": [_listing_dict(r) for r in rows]})
+
+@app.route("/api/dnsbl/scan", methods=["POST"])
+@jwt_required()
+def trigger_dnsbl_scan():
+    """Rescans now with fresh lookups. Body: {"server_id": n} for one server; admins without it scan the fleet."""
+    user_id = int(get_jwt_identity())
+    server_id = (request.json or {}).get("server_id")
+    is_admin = get_jwt().get("role") in ["admin", "super_admin"]
+    query = InstalledPMTA.query
+    if server_id:
+        query = query.filter_by(id=int(server_id))
+    if not is_admin:
+        query = query.filter_by(user_id=user_id)
+    servers = query.all()
+    if not servers:
+        return jsonify({"status": "error", "message": "Server not found"}), 404
+    if dnsbl_scanner is None:
+        return jsonify({"status": "error", "message": "No DNSBL resolver configured (set DNSBL_NAMESERVERS to a non-public recursor)"}), 503
+    run = scan_dnsbl(servers, refresh=True, trigger="manual")
+    if run is None:
+        return jsonify({"status": "busy", "message": "A DNSBL scan is already running"}), 409
+    return jsonify({
+        "status": "success",
+        "scan": {"ips": run.ips, "queries": run.queries, "cached": run.cached, "listed": run.listed, "errors": run.errors},
+    })
+
+# ==========================================
+# DNS PROPAGATION WATCHER (after provisioning)
+# ==========================================
+# "label=ip" or bare IPs, comma separated
+DNS_PROPAGATION_RESOLVERS = dict(
+    (item.split("=", 1) if "=" in item else (item, item))
+    for item in (i.strip() for i in os.getenv("DNS_PROPAGATION_RESOLVERS", "").split(",")) if item
+) or dns_propagation.DEFAULT_PUBLIC_RESOLVERS
+DNS_PROPAGATION_DEADLINE = int(os.getenv("DNS_PROPAGATION_DEADLINE", 7200))  # seconds
+DNS_PROPAGATION_MAX_DELAY = int(os.getenv("DNS_PROPAGATION_MAX_DELAY", 300))  # seconds between polls, max
+DNS_PROPAGATION_CONCURRENCY = int(os.getenv("DNS_PROPAGATION_CONCURRENCY", 8))  # in-flight queries, all watches
+
+propagation_watcher = dns_propagation.PropagationWatcher(
+    public_resolvers=DNS_PROPAGATION_RESOLVERS,
+    max_delay=DNS_PROPAGATION_MAX_DELAY,
+    deadline=DNS_PROPAGATION_DEADLINE,
+    max_concurrency=DNS_PROPAGATION_CONCURRENCY,
+)
+
+# Per-job event streams (install progress, propagation), served as SSE
+job_event_bus = job_events.JobEventBus()
+# Jobs run by a Celery worker publish into the worker's own bus; their SSE stream polls the DB status instead
+JOB_STATUS_POLL_SECONDS = float(os.getenv("JOB_STATUS_POLL_SECONDS", 5))
+
+def _install_job_public_id(job_db_id):
+    if not job_db_id:
+        return None
+    try:
+        with app.app_context():
+            job = InstallJob.query.get(job_db_id)
+            return job.job_id if job else None
+    except Exception:
+        return None
+
+def _propagation_dict(row):
+    return {
+        "domain": row.domain,
+        "status": row.status,
+        "resolvers": row.resolvers,
+        "summary": row.summary,
+        "results": row.results,
+        "started_at": row.started_at.isoformat() if row.started_at else None,
+        "completed_at": row.completed_at.isoformat() if row.completed_at else None,
+    }
+
+def _watch_domain_propagation(job_id, user_id, entry):
+    import pdns_automator
+    domain = entry["domain"].lower().rstrip(".")
+    rrsets = pdns_automator.build_rrsets(
+        domain + ".", entry["ip"], entry.get("selector") or "default", entry.get("dkim_key") or "none",
+        entry.get("dmarc_email") or f"postmaster@{domain}",
+        client_only=bool(entry.get("client_only")), inbound_ip=entry.get("inbound_ip"),
+    )
+    records = dns_propagation.targets(rrsets)
+    with app.app_context():
+        row = DnsPropagation(job_id=job_id, user_id=int(user_id), domain=domain, status="watching")
+        db.session.add(row)
+        db.session.commit()
+        row_id = row.id
+    try:
+        resolvers = propagation_watcher.resolvers_for(domain, PDNS_HOST)
+        job_event_bus.publish(job_id, "dns.propagation.started", {
+            "domain": domain,
+            "records": [{"name": r["name"], "type": r["type"]} for r in records],
+            "resolvers": resolvers,
+        })
+
+        def on_visible(result):
+            job_event_bus.publish(job_id, "dns.propagation.visible", {"domain": domain, **{
+                k: result[k] for k in ("name", "type", "resolver", "seconds", "attempts")}})
+
+        results = propagation_watcher.watch(records, resolvers, on_visible=on_visible)
+        summary = dns_propagation.summarize(results)
+        status = summary["status"]
+    except Exception as e:
+        print(f"[DNS-PROPAGATION] {domain}: {e}")
+        resolvers, results, summary, status = None, None, {"records": None}, "error"
+
+    with app.app_context():
+        row = DnsPropagation.query.get(row_id)
+        row.status, row.resolvers, row.results, row.summary = status, resolvers, results, summary["records"]
+        row.completed_at = datetime.utcnow()
+        db.session.commit()
+        job_event_bus.publish(job_id, "dns.propagation.domain", _propagation_dict(row))
+    return domain, status
+
+def start_propagation_watch(job_id, user_id, entries):
+    """Watches each provisioned domain in its own thread (queries share the watcher's pool)."""
+    job_event_bus.hold(job_id)
+
+    def run():
+        outcome = {}
+        try:
+            def one(entry):
+                domain, status = _watch_domain_propagation(job_id, user_id, entry)
+                outcome[domain] = status
+            threads = [threading.Thread(target=one, args=(e,), daemon=True) for e in entries]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            job_event_bus.publish(job_id, "dns.propagation.complete", {"domains": outcome})
+            job_event_bus.release(job_id)
+
+    threading.Thread(target=run, name=f"dns-propagation-{job_id[:8]}", daemon=True).start()
+
+@app.route("/api/jobs/<job_id>/events", methods=["GET"])
+@jwt_required()
+def stream_job_events(job_id):
+    """
+    Job events as Server-Sent Events (install.progress, job.status, dns.propagation.*).
+    Reconnects resume after Last-Event-ID (or ?after=). The event bus is per process, so a
+    job with no stream here (queued to a Celery worker) only gets job.status events, polled
+    from the database until the job finishes.
+    """
+    user_id = get_jwt_identity()
+    job = InstallJob.query.filter_by(job_id=job_id, user_id=user_id).first()
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+
+    after = request.headers.get("Last-Event-ID") or request.args.get("after") or 0
+    try:
+        after = int(after)
+    except ValueError:
+        after = 0
+    local = bool(job_event_bus.events(job_id))
+    if not local and job.status not in (JobStatus.SUCCESS, JobStatus.FAILED):
+        return _poll_job_status_stream(job.id)
+    # Finished before this process started (restart): no stream will ever be produced
+    lost = not local
+    sub = job_event_bus.subscribe(job_id, after_id=after)
+
+    def fmt(item):
+        return f"id: {item['id']}\nevent: {item['event']}\ndata: {json.dumps(item['data'])}\n\n"
+
+    def generate():
+        try:
+            for item in sub.backlog:
+                yield fmt(item)
+            if lost:
+                yield f"event: job.status\ndata: {json.dumps({'status': job.status.value})}\n\n"
+            if lost or sub.finished:
+                yield "event: end\ndata: \n\n"
+                return
+            while True:
+                try:
+                    item = sub.get(timeout=15)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if item is job_events.END_OF_STREAM:
+                    yield "event: end\ndata: \n\n"
+                    break
+                yield fmt(item)
+        finally:
+            job_event_bus.unsubscribe(sub)
+
+    return Response(generate(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+def _poll_job_status_stream(job_db_id):
+    """SSE of job.status changes read from the database, for jobs produced in another process."""
+    def generate():
+        last = None
+        while True:
+            with app.app_context():
+                job = InstallJob.query.get(job_db_id)
+                status = job.status.value if job and job.status else None
+            if status != last:
+                yield f"event: job.status\ndata: {json.dumps({'status': status})}\n\n"
+                last = status
+            if status in (None, JobStatus.SUCCESS.value, JobStatus.FAILED.value):
+                yield "event: end\ndata: \n\n"
+                return
+            time.sleep(JOB_STATUS_POLL_SECONDS)
+            yield ": keep-alive\n\n"
+
+    return Response(generate(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+@app.route("/api/jobs/<job_id>/propagation", methods=["GET"])
+@jwt_required()
+def get_job_propagation(job_id):
+    user_id = get_jwt_identity()
+    job = InstallJob.query.filter_by(job_id=job_id, user_id=user_id).first()
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    rows = DnsPropagation.query.filter_by(job_id=job_id).order_by(DnsPropagation.domain).all()
+    return jsonify({"status": "success", "data": [_propagation_dict(r) for r in rows]})
+
+
 # --- LOGGING ENDPOINTS ---
 
 @app.route("/api/test-ssh", methods=["POST"])
@@ -3925,9 +6266,41 @@ def get_install_history():
              history.append({"filename": fname, "timestamp": dt})
         except Exception:
             pass
-            
+
+    # Finished jobs live in the archive store
+    for a in log_archive.list_archives(LOG_ARCHIVE_DIR, prefix=_job_log_archive_prefix(user_id)):
+        history.append({
+            "filename": a["name"],
+            "timestamp": datetime.fromtimestamp(a.get("source_mtime") or a["created_at"]).isoformat(),
+            "archived": True,
+            "size": a["raw_size"],
+            "job_id": a["meta"].get("job_id"),
+        })
+
     return jsonify({"history": sorted(history, key=lambda x: x['timestamp'], reverse=True)})
 
+@app.route("/api/logs/install/archive/<name>", methods=["GET"])
+@jwt_required()
+def get_archived_install_log(name):
+    """Reads an archived job log by byte offset (same paging contract as /api/logs)"""
+    user_id = get_jwt_identity()
+    if not name.startswith(_job_log_archive_prefix(user_id)):
+        return jsonify({"error": "Log not found"}), 404
+
+    offset = max(request.args.get("offset", 0, type=int) or 0, 0)
+    limit = min(max(request.args.get("limit", 200_000, type=int) or 200_000, 1), 2_000_000)
+    try:
+        chunk = log_archive.read_archive(LOG_ARCHIVE_DIR, name, offset, limit)
+    except ValueError:
+        return jsonify({"error": "Log not found"}), 404
+    if chunk is None:
+        return jsonify({"error": "Log not found"}), 404
+
+    return jsonify({
+        "logs": chunk.decode("utf-8", errors="replace"),
+        "next_offset": offset + len(chunk),
+    })
+
 @app.route("/api/logs/system", methods=["GET"])
 @jwt_required()
 def get_system_logs():
@@ -3975,6 +6348,10 @@ def get_pmta_logs():
     
     if not all([server_ip, ssh_user, ssh_pass]):
         return jsonify({"error": "Missing credentials"}), 400
+
+    buffered = _buffered_pmta_log(get_jwt_identity(), server_ip, 22, ssh_user, ssh_pass, 50)
+    if buffered is not None:
+        return jsonify({"logs": buffered, "status": "success"})
         
     try:
         ssh = get_ssh_connection(server_ip, ssh_user, ssh_pass)
@@ -3992,6 +6369,61 @@ def get_pmta_logs():
     except Exception as e:
         return jsonify({"error": str(e), "status": "error"}), 500
 
+@app.route("/api/server/<int:server_id>/logs/pmta/stream", methods=["GET"])
+@jwt_required()
+def stream_pmta_logs(server_id):
+    """Live PMTA log as Server-Sent Events. Viewers of the same server share one SSH `tail -F`."""
+    user_id = get_jwt_identity()
+    server = InstalledPMTA.query.filter_by(id=server_id, user_id=user_id).first()
+    if not server:
+        return jsonify({"status": "error", "message": "Server ID not found"}), 404
+
+    host_ip = server.host_ip
+    ssh_user = server.ssh_username
+    ssh_port = server.ssh_port
+    ssh_pass = server.ssh_password_encrypted
+    if not ssh_pass:
+        return jsonify({"status": "error", "message": "Credentials not found for this server ID."}), 403
+
+    def connect():
+        return get_ssh_connection(host_ip, ssh_user, ssh_pass, ssh_port)
+
+    def start(ssh):
+        stdin, stdout, stderr = exec_sudo_command(ssh, f"tail -n 100 -F {PMTA_LOG_PATH}", ssh_pass)
+        return stdout.channel
+
+    sub = pmta_log_hub.subscribe(_pmta_log_key(host_ip, ssh_port), connect, start)
+
+    def generate():
+        try:
+            for line in sub.backlog:
+                yield f"data: {line}\n\n"
+            while True:
+                try:
+                    line = sub.get(timeout=15)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if line is None:
+                    yield "event: end\ndata: \n\n"
+                    break
+                yield f"data: {line}\n\n"
+        finally:
+            pmta_log_hub.unsubscribe(sub)
+
+    return Response(generate(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+@app.route("/api/logs/pmta/followers", methods=["GET"])
+@jwt_required()
+def get_pmta_log_followers():
+    claims = get_jwt()
+    if claims.get("role") not in ["admin", "super_admin"]:
+        return jsonify({"success": False, "message": "Unauthorized"}), 403
+    return jsonify({"followers": pmta_log_hub.stats()})
+
 
 # Serve React Frontend
 
@@ -4225,6 +6657,7 @@ if __name__ == "__main__":
                 "ALTER TABLE user ADD COLUMN plan VARCHAR(50);",
                 "ALTER TABLE user ADD COLUMN is_active BOOLEAN DEFAULT 1;",
                 "ALTER TABLE user ADD COLUMN subscription_expires_at DATETIME;",
+                "ALTER TABLE installed_pmta ADD COLUMN inventory JSON;",
             ]:
                 try:
                     db.session.execute(text(col_sql))
@@ -4257,4 +6690,17 @@ if __name__ == "__main__":
         except Exception as e:
             print(f"[ERROR] Failed to initialize DB or seed admin: {e}")
 
+    # --- BACKGROUND MAINTENANCE ---
+    _start_periodic("log-retention", 3600, sweep_job_logs)
+    if ACCT_INGEST_INTERVAL > 0:
+        _start_periodic("acct-ingest", ACCT_INGEST_INTERVAL, ingest_all_accounting)
+    _start_periodic("acct-retention", 3600, prune_acct_records)
+    _start_periodic("metrics-prune", 3600, prune_delivery_rollups)
+    if QUEUE_SAMPLE_INTERVAL > 0:
+        _start_periodic("queue-sampler", QUEUE_SAMPLE_INTERVAL, sample_all_queues)
+    if DNS_HEALTH_INTERVAL > 0:
+        _start_periodic("dns-health", DNS_HEALTH_INTERVAL, scan_all_domain_health)
+    if DNSBL_SCAN_INTERVAL > 0:
+        _start_periodic("dnsbl-scan", DNSBL_SCAN_INTERVAL, scan_all_dnsbl)
+
     app.run(debug=os.getenv("FLASK_DEBUG", "False").lower() == "true", host='0.0.0.0', port=5000)
@@ -0,0 +1,154 @@
+"""
+Benchmarks for the PMTA config parser and builder on synthetic configs.
+
+Usage:
+    python bench_pmta_config.py                 # 1k .. 20k VMTAs
+    python bench_pmta_config.py 10000 50000     # custom sizes
+    python bench_pmta_config.py > bench_output.txt
+
+Prints time per size and per VMTA; roughly constant us/VMTA means linear scaling.
+"""
+import ipaddress
+import sys
+import time
+
+import pmta_config_ast
+import pmta_config_builder
+import pmta_vmta_ops
+
+DEFAULT_SIZES = [1000, 2500, 5000, 10000, 20000]
+
+
+def make_config(n_vmtas, pool_size=2000):
+    """Synthetic config shaped like the installer output: n VMTAs, pools of pool_size members."""
+    lines = [
+        "# Global Settings",
+        "run-as-user pmta",
+        "log-file /var/log/pmta/log",
+        "http-mgmt-port 8080",
+        "",
+        "<source 0/0>",
+        "    always-allow-relaying yes",
+        "    smtp-service yes",
+        "</source>",
+        "",
+        "domain-macro gmail gmail.com",
+        "<domain $gmail>",
+        "    max-msg-rate 100/10m",
+        "</domain>",
+        "",
+    ]
+    for i in range(n_vmtas):
+        ip = f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"
+        lines += [
+            f"<virtual-mta vmta{i}>",
+            f"    smtp-source-host {ip} mail{i}.example.com",
+            f"    domain-key default,mail{i}.example.com,/etc/pmta/dkim/mail{i}.example.com.pem",
+            "</virtual-mta>",
+            "",
+        ]
+    for start in range(0, n_vmtas, pool_size):
+        lines.append(f"<virtual-mta-pool pool{start // pool_size}>")
+        lines += [f"    virtual-mta vmta{i}" for i in range(start, min(start + pool_size, n_vmtas))]
+        lines += ["</virtual-mta-pool>", ""]
+    return "\n".join(lines) + "\n"
+
+
+def timed(fn, repeat=3):
+    best = None
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def bench_parse(sizes):
+    print(f"{'vmtas':>8} {'lines':>9} {'parse ms':>10} {'us/vmta':>9} {'render ms':>10}  round-trip")
+    for n in sizes:
+        text = make_config(n)
+        parse_s, tree = timed(lambda: pmta_config_ast.parse(text))
+        render_s, out = timed(lambda: tree.render())
+        vmtas = sum(1 for _ in tree.walk("virtual-mta"))
+        assert vmtas == n, f"expected {n} VMTAs, parsed {vmtas}"
+        print(f"{n:>8} {text.count(chr(10)):>9} {parse_s * 1000:>10.1f} {parse_s / n * 1e6:>9.2f} "
+              f"{render_s * 1000:>10.1f}  {'ok' if out == text else 'MISMATCH'}")
+
+
+def make_config_json(n_vmtas, pool_size=2000):
+    """UI-shaped config: new-style VMTA IDs, so every pool member needs an ID lookup."""
+    vmtas = [{
+        "id": f"vmta-{1700000000000 + i}",
+        "name": f"vmta{i}",
+        "smtpSourceHost": f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255} mail{i}.example.com",
+        "dkimEnabled": True,
+        "domainKey": {"selector": "default", "domain": f"mail{i}.example.com",
+                      "keyPath": f"/etc/pmta/dkim/mail{i}.example.com.pem"},
+    } for i in range(n_vmtas)]
+    pools = [{
+        "id": f"pool-{start}",
+        "name": f"pool{start // pool_size}",
+        "vmtas": [v["id"] for v in vmtas[start:start + pool_size]],
+    } for start in range(0, n_vmtas, pool_size)]
+    return {
+        "global": {"runAsUser": "pmta", "logFile": "/var/log/pmta/log", "httpPort": 8080},
+        "vmtas": vmtas,
+        "pools": pools,
+        "sources": [{"name": "0/0", "smtpService": True, "defaultVMTA": pools[0]["id"] if pools else None}],
+        "users": [],
+    }
+
+
+class _CountingWriter:
+    def __init__(self):
+        self.chars = 0
+        self.writes = 0
+
+    def write(self, data):
+        self.chars += len(data)
+        self.writes += 1
+
+
+def bench_build(sizes):
+    print(f"{'vmtas':>8} {'build ms':>10} {'us/vmta':>9} {'stream ms':>10} {'writes':>7} {'MB':>7}")
+    for n in sizes:
+        config_json = make_config_json(n)
+        build_s, text = timed(lambda: pmta_config_builder.build_config(config_json))
+        writer = _CountingWriter()
+        stream_s, _ = timed(lambda: pmta_config_builder.write_config(config_json, writer), repeat=1)
+        assert writer.chars == len(text)
+        print(f"{n:>8} {build_s * 1000:>10.1f} {build_s / n * 1e6:>9.2f} {stream_s * 1000:>10.1f} "
+              f"{writer.writes:>7} {len(text) / 1e6:>7.2f}")
+
+
+def bench_bulk(sizes):
+    """One batch per size: create n VMTAs from a range, re-pool them, rotate DKIM, delete half."""
+    print(f"{'vmtas':>8} {'ops ms':>10} {'render ms':>10} {'us/vmta':>9}")
+    for n in sizes:
+        tree = pmta_config_ast.parse(make_config(n))
+        ops = [
+            {"op": "create", "ips": f"172.16.0.1-{ipaddress.ip_address('172.16.0.1') + n - 1}",
+             "domain": "bulk.example.com", "pool": "bulk"},
+            {"op": "move", "select": {"pool": "pool0"}, "to_pool": "bulk"},
+            {"op": "rotate_dkim", "select": {"all": True}, "selector": "s2"},
+            {"op": "delete", "select": {"ips": "10.0.0.0/9"}},
+        ]
+        t0 = time.perf_counter()
+        pmta_vmta_ops.apply_operations(tree, ops)
+        ops_s = time.perf_counter() - t0
+        render_s, _ = timed(lambda: tree.render(), repeat=1)
+        print(f"{n:>8} {ops_s * 1000:>10.1f} {render_s * 1000:>10.1f} {ops_s / n * 1e6:>9.2f}")
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or DEFAULT_SIZES
+    print("== parse (pmta_config_ast) ==")
+    bench_parse(sizes)
+    print()
+    print("== build (pmta_config_builder) ==")
+    bench_build(sizes)
+    print()
+    print("== bulk VMTA ops (pmta_vmta_ops) ==")
+    bench_bulk(sizes)
@@ -0,0 +1,106 @@
+"""
+Time-bucketed delivery counters derived from PMTA accounting records.
+
+Accounting rows are folded into minute, hour and day buckets keyed by
+(server, vmta, sender domain, receiving ISP group). Older data is kept only at
+coarser resolutions, so dashboards read a few thousand pre-aggregated rows
+instead of scanning raw accounting records.
+
+Receiving ISP groups come from the `domain-macro` lines of the PMTA template,
+so the grouping matches the per-ISP delivery rules actually deployed.
+"""
+import os
+import re
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Bucket width in seconds per resolution
+RESOLUTIONS: Dict[str, int] = {"minute": 60, "hour": 3600, "day": 86400}
+
+# How long each resolution is kept (seconds). None = forever.
+DEFAULT_RETENTION: Dict[str, Optional[int]] = {
+    "minute": 8 * 86400,
+    "hour": 120 * 86400,
+    "day": None,
+}
+
+OTHER_GROUP = "other"
+
+# PMTA record type -> counter
+_TYPE_COUNTER = {
+    "d": "delivered",
+    "t": "deferred",
+    "tq": "deferred",
+    "b": "bounced",
+    "rb": "bounced",
+}
+
+_MACRO_RE = re.compile(r"^\s*domain-macro\s+(\S+)\s+(.+?)\s*$")
+
+RollupKey = Tuple[str, int, str, str, str]  # resolution, bucket, vmta, sender_domain, isp_group
+
+
+def load_isp_groups(template_path: str) -> Dict[str, str]:
+    """Maps receiving domain -> macro name from `domain-macro` lines of a PMTA config template."""
+    groups: Dict[str, str] = {}
+    if not os.path.exists(template_path):
+        return groups
+    with open(template_path, "r", encoding="utf-8") as f:
+        for line in f:
+            m = _MACRO_RE.match(line)
+            if not m:
+                continue
+            name = m.group(1)
+            for domain in m.group(2).split(","):
+                domain = domain.strip().lower()
+                if domain:
+                    groups.setdefault(domain, name)
+    return groups
+
+
+def isp_group(rcpt_domain: Optional[str], groups: Dict[str, str]) -> str:
+    if not rcpt_domain:
+        return OTHER_GROUP
+    return groups.get(rcpt_domain.lower(), OTHER_GROUP)
+
+
+def _domain(address: Optional[str]) -> str:
+    if not address or "@" not in address:
+        return ""
+    return address.rsplit("@", 1)[-1].lower()[:255]
+
+
+def aggregate(rows: Iterable[Dict[str, Any]], groups: Dict[str, str]) -> Dict[RollupKey, Dict[str, int]]:
+    """
+    Folds acct_records rows (see acct_ingest.to_row) into counter deltas for every resolution.
+    Rows without a timestamp or with a record type that is not a delivery outcome are skipped.
+    """
+    deltas: Dict[RollupKey, Dict[str, int]] = defaultdict(lambda: {"delivered": 0, "deferred": 0, "bounced": 0})
+    for row in rows:
+        counter = _TYPE_COUNTER.get((row.get("record_type") or "").lower())
+        ts = row.get("logged_at")
+        if counter is None or ts is None:
+            continue
+        vmta = (row.get("vmta") or "")[:100]
+        sender = _domain(row.get("orig"))
+        group = isp_group(row.get("rcpt_domain"), groups)
+        for resolution, width in RESOLUTIONS.items():
+            deltas[(resolution, ts - ts % width, vmta, sender, group)][counter] += 1
+    return deltas
+
+
+def pick_resolution(step: int, since: int, now: int, retention: Dict[str, Optional[int]] = DEFAULT_RETENTION) -> str:
+    """Finest resolution that divides `step` and still holds data back to `since`."""
+    for resolution, width in RESOLUTIONS.items():
+        keep = retention.get(resolution)
+        if step % width != 0:
+            continue
+        if keep is not None and since < now - keep:
+            continue
+        return resolution
+    return "day"
+
+
+def retention_cutoffs(now: int, retention: Dict[str, Optional[int]] = DEFAULT_RETENTION) -> List[Tuple[str, int]]:
+    """(resolution, oldest bucket to keep) for every resolution with a finite retention."""
+    return [(res, now - keep) for res, keep in retention.items() if keep is not None]
@@ -0,0 +1,226 @@
+"""
+Shared DNS lookup engine for record verification.
+
+One resolver and one thread pool serve every request: all lookups needed for a
+domain are issued at once and the caller waits for the slowest, instead of
+paying for each round trip in turn. Results are cached for the TTL the answer
+carries (clamped to [MIN_TTL, MAX_TTL]); NXDOMAIN / no-data answers are cached
+for the zone's negative TTL (SOA minimum), and timeouts or server failures for
+ERROR_TTL only, so a flaky resolver is retried soon.
+
+The cache is an LRU bounded by `max_entries`: hits move an entry to the
+front, inserts past the bound evict the least recently used one. Identical
+queries that are already in flight (from another request, or twice in one
+batch) wait for the same answer instead of going out again. stats() reports
+hits, misses, negative hits, coalesced queries and evictions.
+
+Engines are meant to be shared: shared(nameservers) returns one engine per
+upstream set, so every code path resolving through the same nameservers
+reads the same cache.
+
+Each result reports its own latency and whether it came from the cache:
+
+  {"name", "type", "status": ok|nxdomain|nodata|error, "values": [...],
+   "ttl", "latency_ms", "cached", "error"}
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import dns.exception
+import dns.rdatatype
+import dns.resolver
+
+DEFAULT_NAMESERVERS = ("8.8.8.8", "1.1.1.1")
+DEFAULT_TIMEOUT = 3.0       # seconds per query, all nameservers included
+MIN_TTL = 5
+MAX_TTL = 3600
+NEGATIVE_TTL = 300          # when the response carries no SOA
+ERROR_TTL = 5
+MAX_ENTRIES = 10000
+MAX_WORKERS = 32
+
+OK = "ok"
+NXDOMAIN = "nxdomain"
+NODATA = "nodata"
+ERROR = "error"
+
+Query = Tuple[str, str]
+
+
+def _normalize(name: str) -> str:
+    return name.strip().rstrip(".").lower()
+
+
+def _rdata_text(rdata: Any) -> str:
+    if rdata.rdtype in (dns.rdatatype.TXT, dns.rdatatype.SPF):
+        # Long TXT records come in several strings; verifiers need them joined
+        return b"".join(rdata.strings).decode("utf-8", errors="replace")
+    return rdata.to_text()
+
+
+def _negative_ttl(response: Any) -> int:
+    """SOA-derived negative caching TTL (RFC 2308) from a response, else NEGATIVE_TTL."""
+    try:
+        for rrset in response.authority:
+            if rrset.rdtype == dns.rdatatype.SOA:
+                return min(rrset.ttl, rrset[0].minimum)
+    except Exception:
+        pass
+    return NEGATIVE_TTL
+
+
+class DnsEngine:
+    def __init__(
+        self,
+        nameservers: Sequence[str] = DEFAULT_NAMESERVERS,
+        timeout: float = DEFAULT_TIMEOUT,
+        max_workers: int = MAX_WORKERS,
+        max_entries: int = MAX_ENTRIES,
+    ):
+        self.resolver = dns.resolver.Resolver(configure=False)
+        self.resolver.nameservers = list(nameservers)
+        self.resolver.lifetime = timeout
+        self.resolver.timeout = timeout
+        self.max_entries = max(1, max_entries)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dns-engine")
+        self._cache: "OrderedDict[Query, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._inflight: Dict[Query, Future] = {}
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "negative_hits": 0, "misses": 0, "coalesced": 0, "expired": 0, "evictions": 0, "errors": 0}
+
+    # --- cache ---
+
+    def _cached(self, key: Query, count: bool = True) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            expires, result = entry
+            if expires <= time.time():
+                del self._cache[key]
+                self._counters["expired"] += 1
+                return None
+            self._cache.move_to_end(key, last=False)
+            if count:
+                self._counters["hits"] += 1
+                if result["status"] in (NXDOMAIN, NODATA):
+                    self._counters["negative_hits"] += 1
+        remaining = int(expires - time.time())
+        return {**result, "ttl": remaining, "latency_ms": 0.0, "cached": True}
+
+    def _store(self, key: Query, result: Dict[str, Any], ttl: int) -> None:
+        with self._lock:
+            self._cache[key] = (time.time() + ttl, result)
+            self._cache.move_to_end(key, last=False)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=True)
+                self._counters["evictions"] += 1
+
+    def peek(self, name: str, rtype: str) -> Optional[Dict[str, Any]]:
+        """Cached result for (name, rtype) without resolving; None on a miss."""
+        return self._cached((_normalize(name), rtype.upper()), count=False)
+
+    def invalidate(self, name: Optional[str] = None) -> None:
+        """Drops cached answers for `name` (every type), or the whole cache."""
+        with self._lock:
+            if name is None:
+                self._cache.clear()
+                return
+            name = _normalize(name)
+            for key in [k for k in self._cache if k[0] == name]:
+                del self._cache[key]
+
+    # --- lookups ---
+
+    def _query(self, name: str, rtype: str) -> Tuple[Dict[str, Any], int]:
+        result: Dict[str, Any] = {"name": name, "type": rtype, "status": OK, "values": [], "ttl": None, "error": None}
+        t0 = time.time()
+        try:
+            answer = self.resolver.resolve(name, rtype, search=False)
+            result["values"] = [_rdata_text(r) for r in answer]
+            ttl = max(MIN_TTL, min(MAX_TTL, answer.rrset.ttl))
+        except dns.resolver.NXDOMAIN as e:
+            result["status"] = NXDOMAIN
+            responses = e.kwargs.get("responses") or {}
+            ttl = _negative_ttl(next(iter(responses.values()))) if responses else NEGATIVE_TTL
+        except dns.resolver.NoAnswer as e:
+            result["status"] = NODATA
+            ttl = _negative_ttl(e.kwargs.get("response"))
+        except dns.exception.DNSException as e:  # timeouts, SERVFAIL from every nameserver, ...
+            result["status"] = ERROR
+            result["error"] = str(e) or e.__class__.__name__
+            ttl = ERROR_TTL
+        result["latency_ms"] = round((time.time() - t0) * 1000, 1)
+        ttl = max(MIN_TTL, min(MAX_TTL, ttl))
+        result["ttl"] = ttl
+        return result, ttl
+
+    def _resolve(self, key: Query) -> Tuple[Dict[str, Any], int]:
+        try:
+            result, ttl = self._query(*key)
+            self._store(key, result, ttl)
+            if result["status"] == ERROR:
+                with self._lock:
+                    self._counters["errors"] += 1
+            return result, ttl
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def lookup(self, name: str, rtype: str, refresh: bool = False) -> Dict[str, Any]:
+        return self.lookup_many([(name, rtype)], refresh=refresh)[0]
+
+    def lookup_many(self, queries: Iterable[Query], refresh: bool = False) -> List[Dict[str, Any]]:
+        """Results in the order of `queries`; uncached ones are resolved concurrently."""
+        keys = [(_normalize(name), rtype.upper()) for name, rtype in queries]
+        results: List[Optional[Dict[str, Any]]] = [None if refresh else self._cached(k) for k in keys]
+
+        pending: Dict[Query, Future] = {}
+        with self._lock:
+            for key, result in zip(keys, results):
+                if result is not None or key in pending:
+                    continue
+                future = self._inflight.get(key)
+                if future is None:
+                    self._counters["misses"] += 1
+                    future = self._inflight[key] = self._pool.submit(self._resolve, key)
+                else:
+                    self._counters["coalesced"] += 1
+                pending[key] = future
+        resolved = {key: {**future.result()[0], "cached": False} for key, future in pending.items()}
+
+        return [r if r is not None else resolved[k] for k, r in zip(keys, results)]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"] + self._counters["coalesced"]
+            return {
+                "entries": len(self._cache),
+                "max_entries": self.max_entries,
+                "nameservers": list(self.resolver.nameservers),
+                **self._counters,
+                "hit_ratio": round((lookups - self._counters["misses"]) / lookups, 3) if lookups else None,
+            }
+
+
+_engines: Dict[Tuple[str, ...], DnsEngine] = {}
+_engines_lock = threading.Lock()
+
+
+def shared(nameservers: Sequence[str] = DEFAULT_NAMESERVERS, **kwargs: Any) -> DnsEngine:
+    """The process-wide engine for this upstream set (created with kwargs on first use)."""
+    key = tuple(nameservers)
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = _engines[key] = DnsEngine(nameservers, **kwargs)
+        return engine
+
+
+def all_stats() -> List[Dict[str, Any]]:
+    with _engines_lock:
+        engines = list(_engines.values())
+    return [engine.stats() for engine in engines]
@@ -0,0 +1,169 @@
+"""
+Sender domain DNS health checks.
+
+For every domain the records we expect are derived from what the install
+published (InstalledPMTA.dns_details: mail host A record, SPF, DKIM and DMARC
+TXT values), falling back to the conventional names when a domain has no
+install record. One check per record kind is evaluated against live lookups:
+
+  a      mail.<domain> resolves to one of the domain's IPs
+  spf    exactly one v=spf1 TXT record, authorizing every IP the domain sends from
+  dkim   <selector>._domainkey TXT with the published public key
+  dmarc  v=DMARC1 TXT at _dmarc.<domain>
+  mx     the domain has MX records (warning only; sending works without)
+
+Each check is ok / missing / mismatch / error, and the domain's status is the
+worst of them: "fail" when a required check is not ok, "warn" when only
+optional ones are, "error" when lookups failed, else "ok". fingerprint() is
+what change history compares, so TTL churn or reordered values don't count as
+changes.
+"""
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+OK = "ok"
+MISSING = "missing"
+MISMATCH = "mismatch"
+ERROR = "error"
+
+REQUIRED_CHECKS = ("a", "spf", "dkim", "dmarc")
+OPTIONAL_CHECKS = ("mx",)
+
+_P_RE = re.compile(r"(?:^|;)\s*p=([^;]*)", re.IGNORECASE)
+_IP4_RE = re.compile(r"\bip4:([0-9./]+)", re.IGNORECASE)
+_INDIRECT_RE = re.compile(r"(?:^|\s)[+?~-]?(?:include:|redirect=|a\b|a:|mx\b|mx:|exists:)", re.IGNORECASE)
+
+DEFAULT_SELECTOR = "default"
+
+
+def _root_domain(domain: str) -> str:
+    parts = domain.split(".")
+    return ".".join(parts[-2:]) if len(parts) > 2 else domain
+
+
+def _dkim_key(value: Optional[str]) -> Optional[str]:
+    m = _P_RE.search(value or "")
+    return re.sub(r"\s+", "", m.group(1)) if m else None
+
+
+def expected_records(domain: str, published: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    {check: {"name", "type", "value"}} for a domain. `published` is the record list
+    the install stored for it (dns_details[i]["records"] of every entry for the domain,
+    one per mapped IP); values may be None when unknown. The A value is the list of the
+    domain's IPs, and the SPF value authorizes all of them.
+    """
+    domain = domain.lower().rstrip(".")
+    expected: Dict[str, Dict[str, Any]] = {
+        "a": {"name": f"mail.{_root_domain(domain)}", "type": "A", "value": None},
+        "spf": {"name": domain, "type": "TXT", "value": None},
+        "dkim": {"name": f"{DEFAULT_SELECTOR}._domainkey.{domain}", "type": "TXT", "value": None},
+        "dmarc": {"name": f"_dmarc.{domain}", "type": "TXT", "value": None},
+        "mx": {"name": domain, "type": "MX", "value": None},
+    }
+    a_ips: List[str] = []
+    spf_values: List[str] = []
+    for rec in published or []:
+        rtype, name, value = (rec.get("type") or "").upper(), (rec.get("name") or "").lower().rstrip("."), rec.get("value")
+        if rtype == "A":
+            if value and value not in a_ips:
+                a_ips.append(value)
+            expected["a"] = {"name": name, "type": "A", "value": a_ips or None}
+        elif rtype == "TXT" and "._domainkey." in name:
+            # "(Key not available)" placeholders carry no key to compare against
+            expected["dkim"] = {"name": name, "type": "TXT", "value": value if _dkim_key(value) else None}
+        elif rtype == "TXT" and name.startswith("_dmarc."):
+            expected["dmarc"] = {"name": name, "type": "TXT", "value": value}
+        elif rtype == "TXT" and (value or "").lower().startswith("v=spf1"):
+            if value not in spf_values:
+                spf_values.append(value)
+            expected["spf"] = {"name": name, "type": "TXT", "value": value}
+    if len(spf_values) > 1:
+        ips = list(dict.fromkeys(ip for v in spf_values for ip in _expected_ips(v)))
+        expected["spf"]["value"] = " ".join(["v=spf1"] + [f"ip4:{ip}" for ip in ips] + ["~all"])
+    return expected
+
+
+def lookups(expected: Dict[str, Dict[str, Any]]) -> List[Tuple[str, str]]:
+    """(name, type) queries needed to evaluate `expected`, in check order."""
+    return [(rec["name"], rec["type"]) for rec in expected.values()]
+
+
+def _check(kind: str, rec: Dict[str, Any], status: str, found: List[str], detail: str = "") -> Dict[str, Any]:
+    return {"check": kind, "name": rec["name"], "status": status, "expected": rec["value"], "found": found, "detail": detail}
+
+
+def _expected_ips(spf_value: Optional[str]) -> List[str]:
+    return _IP4_RE.findall(spf_value or "")
+
+
+def evaluate(expected: Dict[str, Dict[str, Any]], answers: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Checks from dns_engine results (same order as lookups(expected))."""
+    checks = []
+    for (kind, rec), ans in zip(expected.items(), answers):
+        values = ans.get("values") or []
+        if ans.get("status") == "error":
+            checks.append(_check(kind, rec, ERROR, [], ans.get("error") or "lookup failed"))
+            continue
+
+        if kind == "a":
+            if not values:
+                checks.append(_check(kind, rec, MISSING, values))
+            elif rec["value"] and not set(rec["value"]) & set(values):
+                checks.append(_check(kind, rec, MISMATCH, values, f"expected {' or '.join(rec['value'])}"))
+            else:
+                checks.append(_check(kind, rec, OK, values))
+
+        elif kind == "spf":
+            spf = [v for v in values if v.lower().startswith("v=spf1")]
+            if not spf:
+                checks.append(_check(kind, rec, MISSING, spf))
+            elif len(spf) > 1:
+                checks.append(_check(kind, rec, MISMATCH, spf, "multiple SPF records (permerror)"))
+            else:
+                missing_ips = [ip for ip in _expected_ips(rec["value"]) if ip not in _expected_ips(spf[0])]
+                if missing_ips and not _INDIRECT_RE.search(spf[0]):
+                    checks.append(_check(kind, rec, MISMATCH, spf, f"does not authorize {', '.join(missing_ips)}"))
+                elif missing_ips:
+                    checks.append(_check(kind, rec, OK, spf, f"{', '.join(missing_ips)} not listed directly (include/redirect not followed)"))
+                else:
+                    checks.append(_check(kind, rec, OK, spf))
+
+        elif kind == "dkim":
+            dkim = [v for v in values if "v=dkim1" in v.lower() or _dkim_key(v)]
+            want = _dkim_key(rec["value"])
+            if not dkim:
+                checks.append(_check(kind, rec, MISSING, dkim))
+            elif want and want not in (_dkim_key(v) for v in dkim):
+                checks.append(_check(kind, rec, MISMATCH, [v[:60] + "..." for v in dkim], "public key differs from the server's key"))
+            else:
+                checks.append(_check(kind, rec, OK, [v[:60] + "..." for v in dkim]))
+
+        elif kind == "dmarc":
+            dmarc = [v for v in values if v.lower().startswith("v=dmarc1")]
+            checks.append(_check(kind, rec, OK if dmarc else MISSING, dmarc))
+
+        elif kind == "mx":
+            checks.append(_check(kind, rec, OK if values else MISSING, values))
+    return checks
+
+
+def overall_status(checks: List[Dict[str, Any]]) -> str:
+    if any(c["status"] == ERROR for c in checks):
+        return "error"
+    if any(c["status"] != OK for c in checks if c["check"] in REQUIRED_CHECKS):
+        return "fail"
+    if any(c["status"] != OK for c in checks):
+        return "warn"
+    return "ok"
+
+
+def fingerprint(checks: List[Dict[str, Any]]) -> Dict[str, str]:
+    return {c["check"]: c["status"] for c in checks}
+
+
+def changes(old: Optional[Dict[str, str]], new: Dict[str, str]) -> List[Dict[str, Any]]:
+    """[{check, from, to}] between two fingerprints (old None = first scan, no changes)."""
+    if old is None:
+        return []
+    return [{"check": k, "from": old.get(k), "to": new.get(k)} for k in sorted(set(old) | set(new)) if old.get(k) != new.get(k)]
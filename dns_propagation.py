@@ -0,0 +1,234 @@
+"""
+DNS propagation watcher for freshly provisioned records.
+
+For every record we expect (name, type, values) and every resolver we watch,
+a check is polled until the resolver returns the expected data. Checks back
+off exponentially while a record is not visible yet (initial_delay, doubling
+up to max_delay) and give up at the deadline. Queries from every watch share
+one thread pool, so `max_concurrency` caps in-flight queries process-wide no
+matter how many domains are being watched.
+
+Resolvers are the zone's authoritative nameservers (from the public NS
+delegation, falling back to the PowerDNS host the records were written to)
+plus a set of public recursive resolvers. Time-to-visibility is measured from
+the start of the watch, per record and resolver.
+
+Recursive resolvers cache negative answers for the zone's SOA minimum, so a
+record queried just before it was published can stay invisible there for
+that long; the backoff keeps those polls cheap.
+"""
+import heapq
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import dns.exception
+import dns.rdatatype
+import dns.resolver
+
+DEFAULT_PUBLIC_RESOLVERS = {
+    "google": "8.8.8.8",
+    "cloudflare": "1.1.1.1",
+    "quad9": "9.9.9.9",
+    "opendns": "208.67.222.222",
+}
+WATCH_TYPES = ("A", "MX", "TXT")
+INITIAL_DELAY = 5.0
+MAX_DELAY = 300.0
+DEADLINE = 2 * 3600
+MAX_CONCURRENCY = 8
+QUERY_TIMEOUT = 3.0
+MAX_AUTHORITATIVE = 2
+
+VISIBLE = "visible"
+TIMEOUT = "timeout"
+PENDING = "pending"
+
+
+def _strip_txt(value: str) -> str:
+    # '"part one" "part two"' -> 'part onepart two'; unquoted values are kept as is
+    parts = re.findall(r'"((?:[^"\\]|\\.)*)"', value)
+    return "".join(parts) if parts else value
+
+
+def normalize(rtype: str, value: str) -> str:
+    if rtype in ("TXT", "SPF"):
+        return " ".join(_strip_txt(value).split())
+    return value.strip().rstrip(".").lower()
+
+
+def matches(rtype: str, expected: Iterable[str], values: Iterable[str]) -> bool:
+    """True when every expected value is among the answer's values."""
+    got = {normalize(rtype, v) for v in values}
+    return all(normalize(rtype, v) in got for v in expected)
+
+
+def targets(rrsets: Iterable[Dict[str, Any]], types: Iterable[str] = WATCH_TYPES) -> List[Dict[str, Any]]:
+    """Records to watch from PowerDNS-style rrsets ({name, type, records: [{content}]})."""
+    wanted = {t.upper() for t in types}
+    result = []
+    for rr in rrsets:
+        rtype = rr["type"].upper()
+        if rtype in wanted:
+            result.append({
+                "name": rr["name"].rstrip(".").lower(),
+                "type": rtype,
+                "expected": [r["content"] for r in rr.get("records", []) if not r.get("disabled")],
+            })
+    return result
+
+
+def _resolver(nameserver: str, timeout: float) -> dns.resolver.Resolver:
+    resolver = dns.resolver.Resolver(configure=False)
+    resolver.nameservers = [nameserver]
+    resolver.timeout = resolver.lifetime = timeout
+    return resolver
+
+
+def _answer_values(answer: Any) -> List[str]:
+    values = []
+    for rdata in answer:
+        if rdata.rdtype in (dns.rdatatype.TXT, dns.rdatatype.SPF):
+            values.append(b"".join(rdata.strings).decode("utf-8", errors="replace"))
+        else:
+            values.append(rdata.to_text())
+    return values
+
+
+def query(nameserver: str, name: str, rtype: str, timeout: float = QUERY_TIMEOUT) -> Tuple[List[str], Optional[str]]:
+    """(values, error) for one query against one nameserver; NXDOMAIN / no data are empty values."""
+    try:
+        return _answer_values(_resolver(nameserver, timeout).resolve(name, rtype, search=False)), None
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+        return [], None
+    except dns.exception.DNSException as e:
+        return [], str(e) or e.__class__.__name__
+
+
+def authoritative_servers(domain: str, via: str, fallback: Optional[str] = None,
+                          limit: int = MAX_AUTHORITATIVE, timeout: float = QUERY_TIMEOUT) -> Dict[str, str]:
+    """{"ns:<host>": ip} for the domain's delegated nameservers, else {"pdns": fallback}."""
+    servers: Dict[str, str] = {}
+    hosts, _ = query(via, domain, "NS", timeout)
+    for host in sorted(hosts)[:limit]:
+        ips, _ = query(via, host, "A", timeout)
+        if ips:
+            servers[f"ns:{host.rstrip('.')}"] = ips[0]
+    if not servers and fallback:
+        servers["pdns"] = fallback
+    return servers
+
+
+class PropagationWatcher:
+    def __init__(
+        self,
+        public_resolvers: Optional[Dict[str, str]] = None,
+        initial_delay: float = INITIAL_DELAY,
+        max_delay: float = MAX_DELAY,
+        deadline: float = DEADLINE,
+        max_concurrency: int = MAX_CONCURRENCY,
+        query_timeout: float = QUERY_TIMEOUT,
+    ):
+        self.public_resolvers = dict(public_resolvers or DEFAULT_PUBLIC_RESOLVERS)
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.query_timeout = query_timeout
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="dns-propagation")
+        self.query = query
+
+    def resolvers_for(self, domain: str, authoritative_fallback: Optional[str] = None) -> Dict[str, str]:
+        via = next(iter(self.public_resolvers.values()), None)
+        if via:
+            servers = authoritative_servers(domain, via, authoritative_fallback, timeout=self.query_timeout)
+        else:
+            servers = {"pdns": authoritative_fallback} if authoritative_fallback else {}
+        return {**servers, **self.public_resolvers}
+
+    def watch(
+        self,
+        records: List[Dict[str, Any]],
+        resolvers: Dict[str, str],
+        on_visible: Optional[Callable[[Dict[str, Any]], None]] = None,
+        stop: Optional[threading.Event] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Polls every (record, resolver) pair until visible or the deadline; blocks.
+        Returns one result per pair: {name, type, resolver, status, seconds, attempts, last_values, error}.
+        on_visible(result) is called as each pair becomes visible.
+        """
+        started = time.time()
+        results: List[Dict[str, Any]] = []
+        due: List[Tuple[float, int]] = []
+        for rec in records:
+            for label in resolvers:
+                results.append({
+                    "name": rec["name"], "type": rec["type"], "resolver": label,
+                    "status": PENDING, "seconds": None, "attempts": 0,
+                    "last_values": [], "error": None,
+                    "_expected": rec["expected"], "_delay": self.initial_delay,
+                })
+                heapq.heappush(due, (started, len(results) - 1))
+
+        while due and not (stop and stop.is_set()):
+            now = time.time()
+            if now - started >= self.deadline:
+                break
+            batch = []
+            while due and due[0][0] <= now:
+                batch.append(heapq.heappop(due)[1])
+            if not batch:
+                wait = min(due[0][0], started + self.deadline) - now
+                if stop:
+                    stop.wait(max(0.0, wait))
+                else:
+                    time.sleep(max(0.0, wait))
+                continue
+
+            futures = [(i, self._pool.submit(self.query, resolvers[results[i]["resolver"]],
+                                             results[i]["name"], results[i]["type"], self.query_timeout))
+                       for i in batch]
+            for i, future in futures:
+                res = results[i]
+                values, error = future.result()
+                res["attempts"] += 1
+                res["last_values"], res["error"] = values, error
+                if values and matches(res["type"], res["_expected"], values):
+                    res["status"] = VISIBLE
+                    res["seconds"] = round(time.time() - started, 1)
+                    if on_visible:
+                        on_visible(_public(res))
+                else:
+                    heapq.heappush(due, (time.time() + res["_delay"], i))
+                    res["_delay"] = min(self.max_delay, res["_delay"] * 2)
+
+        for res in results:
+            if res["status"] == PENDING:
+                res["status"] = TIMEOUT
+        return [_public(r) for r in results]
+
+
+def _public(result: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in result.items() if not k.startswith("_")}
+
+
+def summarize(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Per-record time to visibility everywhere (None if some resolver never saw it)."""
+    by_record: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+    for r in results:
+        by_record.setdefault((r["name"], r["type"]), []).append(r)
+    records = []
+    for (name, rtype), rows in by_record.items():
+        visible = [r for r in rows if r["status"] == VISIBLE]
+        records.append({
+            "name": name,
+            "type": rtype,
+            "visible_on": len(visible),
+            "resolvers": len(rows),
+            "seconds": max(r["seconds"] for r in visible) if len(visible) == len(rows) else None,
+            "first_seconds": min((r["seconds"] for r in visible), default=None),
+        })
+    complete = all(r["seconds"] is not None for r in records)
+    return {"status": VISIBLE if complete else TIMEOUT, "records": records}
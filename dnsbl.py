@@ -0,0 +1,195 @@
+"""
+DNSBL (blacklist) checks for sending IPs.
+
+An IP is looked up in a zone as <reversed ip>.<zone> (A record): NXDOMAIN
+means not listed, a 127.0.0.x answer means listed (the code says why, the
+TXT record carries a human readable reason). Some lists answer 127.255.255.x
+when they refuse the query, typically because it came through a large public
+resolver; that is reported as an error, not a listing. Scans therefore use
+the system resolver (/etc/resolv.conf) by default, and well-known public
+resolvers are only used when explicitly allowed (select_nameservers).
+
+Lookups go through a dns_engine.DnsEngine, so answers are cached for their
+TTL and run concurrently. Each zone has its own token bucket (queries per
+second); answers served from the cache do not consume tokens, so rescans and
+IPs shared between servers cost nothing.
+"""
+import ipaddress
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import dns.resolver
+
+import dns_engine
+
+LISTED = "listed"
+CLEAN = "clean"
+ERROR = "error"
+
+DEFAULT_RATE = 5.0   # queries per second per zone
+MAX_WORKERS = 16
+
+# The lists the advanced template's backoff patterns react to
+DEFAULT_ZONES: List[Dict[str, Any]] = [
+    {"zone": "zen.spamhaus.org", "name": "Spamhaus ZEN", "rate": DEFAULT_RATE},
+    {"zone": "b.barracudacentral.org", "name": "Barracuda", "rate": DEFAULT_RATE},
+    {"zone": "bl.spamcop.net", "name": "SpamCop", "rate": DEFAULT_RATE},
+    {"zone": "dnsbl-1.uceprotect.net", "name": "UCEProtect L1", "rate": DEFAULT_RATE},
+    {"zone": "dnsbl-2.uceprotect.net", "name": "UCEProtect L2", "rate": DEFAULT_RATE},
+    {"zone": "psbl.surriel.com", "name": "PSBL", "rate": DEFAULT_RATE},
+]
+
+# Open resolvers Spamhaus and others answer with 127.255.255.x (refused) instead of data
+PUBLIC_RESOLVERS = frozenset({
+    "8.8.8.8", "8.8.4.4", "2001:4860:4860::8888", "2001:4860:4860::8844",
+    "1.1.1.1", "1.0.0.1", "2606:4700:4700::1111", "2606:4700:4700::1001",
+    "9.9.9.9", "149.112.112.112", "2620:fe::fe", "2620:fe::9",
+    "208.67.222.222", "208.67.220.220",
+})
+
+# Return codes with a documented meaning
+CODE_MEANINGS: Dict[str, Dict[str, str]] = {
+    "zen.spamhaus.org": {
+        "127.0.0.2": "SBL (spam source)",
+        "127.0.0.3": "SBL CSS (snowshoe)",
+        "127.0.0.4": "XBL (exploited host)",
+        "127.0.0.9": "SBL DROP",
+        "127.0.0.10": "PBL (ISP policy)",
+        "127.0.0.11": "PBL (Spamhaus policy)",
+    },
+}
+
+
+def parse_zones(spec: Optional[str]) -> List[Dict[str, Any]]:
+    """'zone[:qps],zone[:qps]' -> zone list; empty/None -> DEFAULT_ZONES."""
+    zones = []
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        zone, _, rate = item.partition(":")
+        try:
+            rate_value = float(rate) if rate else DEFAULT_RATE
+        except ValueError:
+            rate_value = DEFAULT_RATE
+        zones.append({"zone": zone.strip().lower().rstrip("."), "name": zone.strip(), "rate": rate_value})
+    return zones or [dict(z) for z in DEFAULT_ZONES]
+
+
+def system_nameservers() -> List[str]:
+    """Nameservers from /etc/resolv.conf (empty when there is none)."""
+    try:
+        return list(dns.resolver.Resolver().nameservers)
+    except dns.resolver.NoResolverConfiguration:
+        return []
+
+
+def select_nameservers(spec: Optional[str], allow_public: bool = False) -> Tuple[List[str], List[str]]:
+    """
+    (nameservers, refused) for scans: the comma-separated `spec`, else the system
+    resolver. Public resolvers are refused unless `allow_public` is set.
+    """
+    configured = [ns.strip() for ns in (spec or "").split(",") if ns.strip()] or system_nameservers()
+    if allow_public:
+        return configured, []
+    return ([ns for ns in configured if ns not in PUBLIC_RESOLVERS],
+            [ns for ns in configured if ns in PUBLIC_RESOLVERS])
+
+
+def reverse_name(ip: str, zone: str) -> str:
+    """'1.2.3.4', 'zen.spamhaus.org' -> '4.3.2.1.zen.spamhaus.org' (IPv6: reversed nibbles)."""
+    pointer = ipaddress.ip_address(ip).reverse_pointer
+    return pointer.rsplit(".", 2)[0] + "." + zone
+
+
+def is_checkable(ip: str) -> bool:
+    try:
+        addr = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return addr.is_global
+
+
+class RateLimiter:
+    """Token bucket; acquire() blocks until a token is available."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = max(rate, 0.01)
+        self.capacity = burst if burst is not None else max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def interpret(zone: str, answer: Dict[str, Any]) -> Dict[str, Any]:
+    """{status, codes, detail} for a dns_engine A lookup result."""
+    status = answer.get("status")
+    if status in (dns_engine.NXDOMAIN, dns_engine.NODATA):
+        return {"status": CLEAN, "codes": [], "detail": None}
+    if status == dns_engine.ERROR:
+        return {"status": ERROR, "codes": [], "detail": answer.get("error") or "lookup failed"}
+    codes = sorted(answer.get("values") or [])
+    if any(not c.startswith("127.") for c in codes):
+        return {"status": ERROR, "codes": codes, "detail": "unexpected answer (zone may no longer be a DNSBL)"}
+    if any(c.startswith("127.255.255.") for c in codes):
+        return {"status": ERROR, "codes": codes, "detail": "query refused by the list (use a non-public resolver)"}
+    meanings = CODE_MEANINGS.get(zone, {})
+    return {"status": LISTED, "codes": codes, "detail": ", ".join(meanings[c] for c in codes if c in meanings) or None}
+
+
+class Scanner:
+    def __init__(self, engine: "dns_engine.DnsEngine", zones: Iterable[Dict[str, Any]], max_workers: int = MAX_WORKERS):
+        self.engine = engine
+        self.zones = list(zones)
+        self._limiters = {z["zone"]: RateLimiter(z.get("rate") or DEFAULT_RATE) for z in self.zones}
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dnsbl")
+
+    def _lookup(self, zone: str, name: str, rtype: str, refresh: bool) -> Dict[str, Any]:
+        if not refresh:
+            cached = self.engine.peek(name, rtype)
+            if cached is not None:
+                return cached
+        self._limiters[zone].acquire()
+        return self.engine.lookup(name, rtype, refresh=refresh)
+
+    def scan(self, ips: Iterable[str], refresh: bool = False) -> List[Dict[str, Any]]:
+        """
+        One result per (ip, zone): {ip, zone, status, codes, detail, reason, cached}.
+        The TXT reason is fetched for listed pairs only.
+        """
+        pairs = [(ip, z["zone"]) for ip in ips for z in self.zones]
+        futures = [self._pool.submit(self._lookup, zone, reverse_name(ip, zone), "A", refresh) for ip, zone in pairs]
+        results = []
+        for (ip, zone), future in zip(pairs, futures):
+            answer = future.result()
+            results.append({"ip": ip, "zone": zone, **interpret(zone, answer), "reason": None, "cached": bool(answer.get("cached"))})
+
+        listed = [r for r in results if r["status"] == LISTED]
+        txt = [self._pool.submit(self._lookup, r["zone"], reverse_name(r["ip"], r["zone"]), "TXT", refresh) for r in listed]
+        for r, future in zip(listed, txt):
+            values = future.result().get("values") or []
+            r["reason"] = " ".join(values)[:500] or None
+        return results
+
+
+def summarize(results: List[Dict[str, Any]]) -> Dict[str, int]:
+    return {
+        "queries": len(results),
+        "cached": sum(1 for r in results if r["cached"]),
+        "listed": sum(1 for r in results if r["status"] == LISTED),
+        "errors": sum(1 for r in results if r["status"] == ERROR),
+    }
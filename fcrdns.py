@@ -0,0 +1,106 @@
+"""
+Forward-confirmed reverse DNS (FCrDNS) checks for sending IPs.
+
+For each IP the PTR record is resolved, then every PTR hostname is resolved
+forward (A for IPv4, AAAA for IPv6); the IP is confirmed when one of them
+points back to it. Receivers treat a missing or unconfirmed PTR as a strong
+spam signal, and PMTA's identity convention additionally expects the PTR to
+be the mail.<root domain> host the IP sends as.
+
+Both phases go through a dns_engine.DnsEngine: every lookup of a phase is
+issued at once, and answers are cached for their TTL, so re-checking a large
+IP range after a PTR change costs two round trips (pass refresh to bypass
+the cache).
+
+Result status, worst first:
+  error        a lookup failed (timeout, SERVFAIL)
+  missing      no PTR record
+  unconfirmed  PTR hostname does not resolve back to the IP
+  mismatch     FCrDNS passes but the PTR is not the expected hostname
+  ok
+"""
+import ipaddress
+from typing import Any, Dict, Iterable, List, Optional
+
+import dns_engine
+
+OK = "ok"
+MISMATCH = "mismatch"
+UNCONFIRMED = "unconfirmed"
+MISSING = "missing"
+ERROR = "error"
+
+STATUSES = (ERROR, MISSING, UNCONFIRMED, MISMATCH, OK)
+
+
+def _host(name: str) -> str:
+    return name.strip().rstrip(".").lower()
+
+
+def check(
+    engine: "dns_engine.DnsEngine",
+    ips: Iterable[str],
+    expected: Optional[Dict[str, str]] = None,
+    refresh: bool = False,
+) -> List[Dict[str, Any]]:
+    """
+    One result per IP (input order): {ip, status, ptr: [...], forward: {host: [ips]},
+    confirmed, expected, detail, cached}. `expected` maps IP -> required PTR hostname.
+    """
+    expected = {ip: _host(h) for ip, h in (expected or {}).items() if h}
+    addrs = [ipaddress.ip_address(ip) for ip in ips]
+    ptr_answers = engine.lookup_many([(a.reverse_pointer, "PTR") for a in addrs], refresh=refresh)
+
+    forward_queries = []
+    for addr, ans in zip(addrs, ptr_answers):
+        rtype = "AAAA" if addr.version == 6 else "A"
+        forward_queries.extend((_host(v), rtype) for v in ans.get("values") or [])
+    forward = {}
+    if forward_queries:
+        unique = list(dict.fromkeys(forward_queries))
+        for query, ans in zip(unique, engine.lookup_many(unique, refresh=refresh)):
+            forward[query] = ans
+
+    results = []
+    for addr, ans in zip(addrs, ptr_answers):
+        ip = str(addr)
+        rtype = "AAAA" if addr.version == 6 else "A"
+        hosts = [_host(v) for v in ans.get("values") or []]
+        result: Dict[str, Any] = {
+            "ip": ip, "status": OK, "ptr": hosts, "forward": {}, "confirmed": False,
+            "expected": expected.get(ip), "detail": None, "cached": bool(ans.get("cached")),
+        }
+        if ans.get("status") == dns_engine.ERROR:
+            result.update(status=ERROR, detail=ans.get("error") or "PTR lookup failed")
+            results.append(result)
+            continue
+        if not hosts:
+            result.update(status=MISSING, detail="no PTR record")
+            results.append(result)
+            continue
+
+        confirmed_hosts = []
+        for host in hosts:
+            fwd = forward.get((host, rtype)) or {}
+            values = [str(ipaddress.ip_address(v)) for v in fwd.get("values") or []]
+            result["forward"][host] = values
+            result["cached"] = result["cached"] and bool(fwd.get("cached"))
+            if ip in values:
+                confirmed_hosts.append(host)
+        result["confirmed"] = bool(confirmed_hosts)
+
+        want = result["expected"]
+        if not confirmed_hosts:
+            failed = [h for h in hosts if (forward.get((h, rtype)) or {}).get("status") == dns_engine.ERROR]
+            if failed:
+                result.update(status=ERROR, detail=f"forward lookup failed for {', '.join(failed)}")
+            else:
+                result.update(status=UNCONFIRMED, detail=f"{', '.join(hosts)} does not resolve to {ip}")
+        elif want and want not in confirmed_hosts:
+            result.update(status=MISMATCH, detail=f"PTR is {confirmed_hosts[0]}, expected {want}")
+        results.append(result)
+    return results
+
+
+def counts(results: List[Dict[str, Any]]) -> Dict[str, int]:
+    return {status: sum(1 for r in results if r["status"] == status) for status in STATUSES}
@@ -0,0 +1,135 @@
+"""
+In-process event streams for background jobs.
+
+Producers (the install thread, the DNS propagation watcher, ...) publish events
+for a job id; any number of subscribers (SSE connections) receive them. Every
+event gets a per-job sequence id, and the stream keeps its history, so a
+client that connects late or reconnects with Last-Event-ID gets everything it
+missed.
+
+A stream stays open while at least one producer holds it (hold / release).
+When the last producer releases it, subscribers receive END_OF_STREAM and the
+history is kept for `retention` seconds for late readers. Subscribing before
+any producer has held the stream waits for it.
+"""
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+# Sentinel pushed to subscriber queues when a stream finishes
+END_OF_STREAM = None
+
+
+class Subscription:
+    def __init__(self, job_id: str, backlog: List[Dict[str, Any]], finished: bool, maxsize: int):
+        self.job_id = job_id
+        self.backlog = backlog
+        self.finished = finished
+        self.queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=maxsize)
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        return self.queue.get(timeout=timeout)
+
+    def _push(self, event: Optional[Dict[str, Any]]) -> None:
+        # Slow consumers lose their oldest events instead of blocking producers
+        while True:
+            try:
+                self.queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+
+class _Stream:
+    def __init__(self, history: int):
+        self.events: deque = deque(maxlen=history)
+        self.subs: List[Subscription] = []
+        self.seq = 0
+        self.holders = 0
+        self.finished_at: Optional[float] = None
+
+
+class JobEventBus:
+    def __init__(self, history: int = 1000, retention: float = 3600, queue_size: int = 1000):
+        self.history = history
+        self.retention = retention
+        self.queue_size = queue_size
+        self._streams: Dict[str, _Stream] = {}
+        self._lock = threading.Lock()
+
+    def _stream(self, job_id: str) -> _Stream:
+        stream = self._streams.get(job_id)
+        if stream is None:
+            stream = self._streams[job_id] = _Stream(self.history)
+        return stream
+
+    def _expire(self) -> None:
+        cutoff = time.time() - self.retention
+        for job_id in [j for j, s in self._streams.items() if s.finished_at and s.finished_at < cutoff and not s.subs]:
+            del self._streams[job_id]
+
+    def hold(self, job_id: str) -> None:
+        """Marks a producer as active on the stream (re-opens a finished one)."""
+        with self._lock:
+            self._expire()
+            stream = self._stream(job_id)
+            stream.holders += 1
+            stream.finished_at = None
+
+    def release(self, job_id: str) -> None:
+        """Drops a producer; the stream ends when none are left."""
+        with self._lock:
+            stream = self._streams.get(job_id)
+            if stream is None or stream.holders == 0:
+                return
+            stream.holders -= 1
+            if stream.holders:
+                return
+            stream.finished_at = time.time()
+            for sub in stream.subs:
+                sub._push(END_OF_STREAM)
+
+    def publish(self, job_id: str, event: str, data: Any = None) -> Dict[str, Any]:
+        with self._lock:
+            stream = self._stream(job_id)
+            stream.seq += 1
+            item = {"id": stream.seq, "event": event, "data": data, "ts": time.time()}
+            stream.events.append(item)
+            for sub in stream.subs:
+                sub._push(item)
+            return item
+
+    def subscribe(self, job_id: str, after_id: int = 0) -> Subscription:
+        """Subscription whose backlog holds the events after `after_id` (0 = all kept)."""
+        with self._lock:
+            self._expire()
+            stream = self._stream(job_id)
+            # A stream nobody has held yet is still pending: its producer may not have started
+            finished = stream.finished_at is not None
+            sub = Subscription(job_id, [e for e in stream.events if e["id"] > after_id], finished, self.queue_size)
+            if not finished:
+                stream.subs.append(sub)
+            return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            stream = self._streams.get(sub.job_id)
+            if stream and sub in stream.subs:
+                stream.subs.remove(sub)
+            if stream and not (stream.subs or stream.holders or stream.events):
+                del self._streams[sub.job_id]
+
+    def events(self, job_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            stream = self._streams.get(job_id)
+            return list(stream.events) if stream else []
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [{"job_id": j, "events": s.seq, "holders": s.holders, "subscribers": len(s.subs)}
+                    for j, s in self._streams.items()]
@@ -0,0 +1,194 @@
+"""
+Block-compressed, seekable archives for finished job logs.
+
+Each archive is a pair of files in the archive directory:
+  <name>.logz  concatenated zlib blocks (each block ends on a line boundary)
+  <name>.idx   JSON seek index: [raw_offset, raw_len, comp_offset, comp_len] per block
+
+Raw byte offsets are preserved, so readers that page through a live log by
+offset keep working unchanged once the log has been archived.
+"""
+import bisect
+import json
+import os
+import re
+import time
+import zlib
+from typing import Any, Dict, List, Optional
+
+ARCHIVE_SUFFIX = ".logz"
+INDEX_SUFFIX = ".idx"
+DEFAULT_BLOCK_SIZE = 64 * 1024
+
+_NAME_RE = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+
+def _paths(archive_dir: str, name: str):
+    if not _NAME_RE.match(name or ""):
+        raise ValueError(f"Invalid archive name: {name!r}")
+    base = os.path.join(archive_dir, name)
+    return base + ARCHIVE_SUFFIX, base + INDEX_SUFFIX
+
+
+def _load_index(archive_dir: str, name: str) -> Optional[Dict[str, Any]]:
+    _, idx_path = _paths(archive_dir, name)
+    try:
+        with open(idx_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def archive_exists(archive_dir: str, name: str) -> bool:
+    data_path, idx_path = _paths(archive_dir, name)
+    return os.path.exists(data_path) and os.path.exists(idx_path)
+
+
+def archive_log(
+    src_path: str,
+    archive_dir: str,
+    name: str,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    meta: Optional[Dict[str, Any]] = None,
+    remove_source: bool = True,
+) -> Optional[Dict[str, Any]]:
+    """Compresses src_path into a seekable archive. Returns the index, or None if there was nothing to archive."""
+    if not os.path.exists(src_path) or os.path.getsize(src_path) == 0:
+        return None
+
+    os.makedirs(archive_dir, exist_ok=True)
+    data_path, idx_path = _paths(archive_dir, name)
+
+    blocks: List[List[int]] = []
+    raw_offset = 0
+    comp_offset = 0
+    with open(src_path, "rb") as src, open(data_path + ".tmp", "wb") as out:
+        while True:
+            chunk = src.read(block_size)
+            if not chunk:
+                break
+            # Keep blocks line-aligned so a block never splits a log line
+            if not chunk.endswith(b"\n"):
+                chunk += src.readline()
+            comp = zlib.compress(chunk, 6)
+            out.write(comp)
+            blocks.append([raw_offset, len(chunk), comp_offset, len(comp)])
+            raw_offset += len(chunk)
+            comp_offset += len(comp)
+
+    index = {
+        "version": 1,
+        "name": name,
+        "raw_size": raw_offset,
+        "compressed_size": comp_offset,
+        "block_size": block_size,
+        "created_at": time.time(),
+        "source_mtime": os.path.getmtime(src_path),
+        "meta": meta or {},
+        "blocks": blocks,
+    }
+
+    # Data first, index last: an archive only counts as complete once its index exists
+    os.replace(data_path + ".tmp", data_path)
+    with open(idx_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(idx_path + ".tmp", idx_path)
+
+    if remove_source:
+        try:
+            os.remove(src_path)
+        except OSError:
+            pass
+    return index
+
+
+def read_archive(archive_dir: str, name: str, offset: int = 0, max_bytes: Optional[int] = None) -> Optional[bytes]:
+    """Returns raw bytes [offset, offset + max_bytes) of an archived log, decompressing only the blocks touched."""
+    index = _load_index(archive_dir, name)
+    if index is None:
+        return None
+
+    raw_size = index["raw_size"]
+    offset = max(0, int(offset or 0))
+    if offset >= raw_size:
+        return b""
+    end = raw_size if max_bytes is None else min(raw_size, offset + int(max_bytes))
+
+    blocks = index["blocks"]
+    starts = [b[0] for b in blocks]
+    first = bisect.bisect_right(starts, offset) - 1
+    data_path, _ = _paths(archive_dir, name)
+
+    parts = []
+    with open(data_path, "rb") as f:
+        for raw_start, raw_len, comp_start, comp_len in blocks[first:]:
+            if raw_start >= end:
+                break
+            f.seek(comp_start)
+            raw = zlib.decompress(f.read(comp_len))
+            lo = max(offset - raw_start, 0)
+            hi = min(end - raw_start, raw_len)
+            parts.append(raw[lo:hi])
+    return b"".join(parts)
+
+
+def list_archives(archive_dir: str, prefix: str = "") -> List[Dict[str, Any]]:
+    """Lists archives (newest first) without their block tables."""
+    if not os.path.isdir(archive_dir):
+        return []
+    result = []
+    for fname in os.listdir(archive_dir):
+        if not fname.endswith(INDEX_SUFFIX) or not fname.startswith(prefix):
+            continue
+        name = fname[: -len(INDEX_SUFFIX)]
+        index = _load_index(archive_dir, name)
+        if index is None:
+            continue
+        result.append({
+            "name": name,
+            "raw_size": index.get("raw_size", 0),
+            "compressed_size": index.get("compressed_size", 0),
+            "created_at": index.get("created_at", 0),
+            "source_mtime": index.get("source_mtime"),
+            "meta": index.get("meta", {}),
+        })
+    result.sort(key=lambda a: a["created_at"], reverse=True)
+    return result
+
+
+def delete_archive(archive_dir: str, name: str) -> None:
+    for path in _paths(archive_dir, name):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def enforce_retention(
+    archive_dir: str,
+    max_age_seconds: Optional[float] = None,
+    max_total_bytes: Optional[int] = None,
+) -> List[str]:
+    """Deletes archives older than max_age_seconds, then the oldest ones until the store fits max_total_bytes."""
+    removed = []
+    archives = list_archives(archive_dir)
+    now = time.time()
+
+    kept = []
+    for a in archives:
+        if max_age_seconds and now - a["created_at"] > max_age_seconds:
+            delete_archive(archive_dir, a["name"])
+            removed.append(a["name"])
+        else:
+            kept.append(a)
+
+    if max_total_bytes:
+        total = sum(a["compressed_size"] for a in kept)
+        # kept is newest first; evict from the tail
+        while kept and total > max_total_bytes:
+            a = kept.pop()
+            delete_archive(archive_dir, a["name"])
+            removed.append(a["name"])
+            total -= a["compressed_size"]
+
+    return removed
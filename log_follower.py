@@ -0,0 +1,258 @@
+"""
+Shared `tail -F` followers for remote log files.
+
+One SSH channel per followed key (usually one per server) is fanned out to any
+number of subscribers. Each follower keeps a bounded ring buffer so late
+joiners get recent history, and closes itself once it has had no subscribers
+for `idle_timeout` seconds.
+"""
+import queue
+import socket
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+# Sentinel pushed to subscriber queues when a follower shuts down
+END_OF_STREAM = None
+
+
+class Subscription:
+    def __init__(self, key: str, backlog: List[str], maxsize: int):
+        self.key = key
+        self.backlog = backlog
+        self.queue: "queue.Queue[Optional[str]]" = queue.Queue(maxsize=maxsize)
+
+    def get(self, timeout: Optional[float] = None) -> Optional[str]:
+        return self.queue.get(timeout=timeout)
+
+    def _push(self, line: Optional[str]) -> None:
+        # Slow consumers lose their oldest lines instead of stalling the follower
+        while True:
+            try:
+                self.queue.put_nowait(line)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+
+class _ReplayFilter:
+    """
+    Drops the lines a restarted `tail -n N -F` repeats after a reconnect. The
+    replay begins with a suffix of the lines already seen, so the longest such
+    suffix the new stream starts with is skipped; everything after it is new.
+    """
+
+    def __init__(self, seen: List[str]):
+        self._seen = seen
+        self._held: List[str] = []
+        self._live = list(range(len(seen)))  # overlap starts still matching
+        self._overlap = 0                    # longest complete overlap so far
+
+    def feed(self, line: str) -> List[str]:
+        """New lines to publish, in order ([] while the overlap is undecided)."""
+        if not self._live:
+            return [line]
+        self._held.append(line)
+        n = len(self._held)
+        live = []
+        for start in self._live:
+            if self._seen[start + n - 1] != line:
+                continue
+            if start + n == len(self._seen):
+                self._overlap = max(self._overlap, n)
+            else:
+                live.append(start)
+        self._live = live
+        return self.flush() if not live else []
+
+    def flush(self) -> List[str]:
+        """Ends matching (replay done or stalled) and returns the held lines that are new."""
+        self._live = []
+        held, self._held = self._held[self._overlap:], []
+        return held
+
+
+class _Follower:
+    def __init__(
+        self,
+        key: str,
+        connect: Callable[[], Any],
+        start: Callable[[Any], Any],
+        buffer_lines: int,
+        idle_timeout: float,
+        on_close: Callable[["_Follower"], None],
+    ):
+        self.key = key
+        self._connect = connect
+        self._start = start
+        self._idle_timeout = idle_timeout
+        self._on_close = on_close
+        self._lock = threading.Lock()
+        self._buffer: deque = deque(maxlen=buffer_lines)
+        self._subs: List[Subscription] = []
+        self._idle_since = time.time()
+        self._stopped = threading.Event()
+        self.started_at = time.time()
+        self.lines_seen = 0
+        self.last_error: Optional[str] = None
+        self._thread = threading.Thread(target=self._run, name=f"log-follow-{key}", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    @property
+    def alive(self) -> bool:
+        return not self._stopped.is_set()
+
+    def subscribe(self, queue_size: int) -> Subscription:
+        with self._lock:
+            sub = Subscription(self.key, list(self._buffer), queue_size)
+            self._subs.append(sub)
+            return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            if sub in self._subs:
+                self._subs.remove(sub)
+            if not self._subs:
+                self._idle_since = time.time()
+
+    def snapshot(self, limit: Optional[int] = None) -> List[str]:
+        with self._lock:
+            lines = list(self._buffer)
+        return lines[-limit:] if limit else lines
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subs)
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def _publish(self, line: str, keep: bool = True) -> None:
+        with self._lock:
+            if keep:
+                self._buffer.append(line)
+                self.lines_seen += 1
+            subs = list(self._subs)
+        for sub in subs:
+            sub._push(line)
+
+    def _idle_expired(self) -> bool:
+        with self._lock:
+            return not self._subs and time.time() - self._idle_since > self._idle_timeout
+
+    def _run(self) -> None:
+        backoff = 2
+        try:
+            while not self._stopped.is_set() and not self._idle_expired():
+                ssh = None
+                try:
+                    ssh = self._connect()
+                    channel = self._start(ssh)
+                    channel.settimeout(1.0)
+                    backoff = 2
+                    self._pump(channel, _ReplayFilter(self.snapshot()))
+                except Exception as e:
+                    self.last_error = str(e)
+                    self._publish(f"!!! Log follower error: {e}", keep=False)
+                finally:
+                    if ssh is not None:
+                        try:
+                            ssh.close()
+                        except Exception:
+                            pass
+                # Channel ended (log rotated away, server restart, network) — retry while still wanted
+                deadline = time.time() + backoff
+                while time.time() < deadline and not self._stopped.is_set():
+                    time.sleep(0.5)
+                backoff = min(backoff * 2, 30)
+        finally:
+            self._stopped.set()
+            self._on_close(self)
+            with self._lock:
+                subs = list(self._subs)
+            for sub in subs:
+                sub._push(END_OF_STREAM)
+
+    def _pump(self, channel: Any, replay: _ReplayFilter) -> None:
+        pending = b""
+        try:
+            while not self._stopped.is_set():
+                if self._idle_expired():
+                    self._stopped.set()
+                    break
+                try:
+                    data = channel.recv(32768)
+                except socket.timeout:
+                    # The replay arrives in one burst; a quiet channel means it is over
+                    for line in replay.flush():
+                        self._publish(line)
+                    continue
+                if not data:
+                    break
+                pending += data
+                *lines, pending = pending.split(b"\n")
+                for raw in lines:
+                    for line in replay.feed(raw.rstrip(b"\r").decode("utf-8", errors="replace")):
+                        self._publish(line)
+        finally:
+            for line in replay.flush():
+                self._publish(line)
+
+
+class LogFollowerHub:
+    def __init__(self, buffer_lines: int = 1000, idle_timeout: float = 60, queue_size: int = 2000):
+        self.buffer_lines = buffer_lines
+        self.idle_timeout = idle_timeout
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._followers: Dict[str, _Follower] = {}
+
+    def subscribe(self, key: str, connect: Callable[[], Any], start: Callable[[Any], Any]) -> Subscription:
+        """
+        Joins (or starts) the follower for `key`. `connect()` returns an SSH client,
+        `start(ssh)` runs the tail command and returns its channel.
+        """
+        with self._lock:
+            follower = self._followers.get(key)
+            if follower is None or not follower.alive:
+                follower = _Follower(key, connect, start, self.buffer_lines, self.idle_timeout, self._forget)
+                self._followers[key] = follower
+                follower.start()
+            return follower.subscribe(self.queue_size)
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            follower = self._followers.get(sub.key)
+        if follower is not None:
+            follower.unsubscribe(sub)
+
+    def snapshot(self, key: str, limit: Optional[int] = None) -> Optional[List[str]]:
+        """Recent lines for `key` if a follower is running, else None."""
+        with self._lock:
+            follower = self._followers.get(key)
+        if follower is None or not follower.alive:
+            return None
+        return follower.snapshot(limit)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            followers = list(self._followers.values())
+        return [{
+            "key": f.key,
+            "subscribers": f.subscriber_count(),
+            "lines_seen": f.lines_seen,
+            "buffered": len(f.snapshot()),
+            "started_at": f.started_at,
+            "last_error": f.last_error,
+        } for f in followers]
+
+    def _forget(self, follower: _Follower) -> None:
+        with self._lock:
+            if self._followers.get(follower.key) is follower:
+                del self._followers[follower.key]
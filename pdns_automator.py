@@ -2,13 +2,14 @@
 import os
 import sys
 import argparse
-import requests
+import json
 import re
 
+import pdns_client
+
 # ================= CONFIGURATION =================
 PDNS_HOST = os.environ.get("PDNS_HOST", "192.119.169.12")
 PDNS_PORT = os.environ.get("PDNS_PORT", "8081")
-BASE_URL = f"http://{PDNS_HOST}:{PDNS_PORT}/api/v1/servers/localhost"
 DEFAULT_TTL = 300
 
 def get_api_key():
@@ -16,11 +17,9 @@ def get_api_key():
     if api_key: return api_key.strip()
     return "MyDNSApiKey2026"
 
-def get_headers(api_key):
-    return {
-        "X-API-Key": api_key,
-        "Content-Type": "application/json"
-    }
+def get_client(api_key):
+    # One keep-alive session for every zone this process touches
+    return pdns_client.PdnsClient(PDNS_HOST, api_key, port=PDNS_PORT, timeout=10)
 
 def validate_domain(domain):
     if not domain: return None
@@ -28,24 +27,48 @@ def validate_domain(domain):
     if "example" in domain.lower(): return None
     return domain + "."
 
-def ensure_zone(domain, headers):
-    zone_url = f"{BASE_URL}/zones/{domain}"
-    try:
-        if requests.get(zone_url, headers=headers).status_code == 200:
-            return
-        
-        # Create Native Zone
-        payload = {
-            "name": domain,
-            "kind": "Native",
-            "nameservers": [f"ns1.{domain}", f"ns2.{domain}"]
-        }
-        requests.post(f"{BASE_URL}/zones", headers=headers, json=payload)
-    except Exception as e:
-        print(f"Failed to ensure zone: {e}")
-        sys.exit(1)
+def ensure_zone(domain, client):
+    """True when the zone had to be created."""
+    if client.zone_exists(domain):
+        return False
+    # Create Native Zone
+    client.create_zone(domain, [f"ns1.{domain}", f"ns2.{domain}"])
+    return True
+
+def _txt_value(content):
+    # PDNS splits long TXT data into several quoted strings; compare the joined text
+    parts = re.findall(r'"((?:[^"\\]|\\.)*)"', content)
+    return "".join(parts) if parts else content
 
-def create_records(domain, ips, hostname, selector, dkim_key, dmarc_email, headers, client_only=False, inbound_ip=None):
+def _rrset_key(name, type_):
+    return name.lower().rstrip('.'), type_.upper()
+
+def _rrset_state(type_, ttl, contents):
+    values = [(_txt_value(c) if type_.upper() in ("TXT", "SPF") else c.lower().rstrip('.'), bool(d)) for c, d in contents]
+    return ttl, sorted(values)
+
+def current_rrsets(domain, client):
+    """{(name, type): (ttl, normalized contents)} of the live zone, from one full fetch."""
+    records, _ = client.records(domain, refresh=True)
+    grouped = {}
+    for rec in records:
+        entry = grouped.setdefault(_rrset_key(rec["name"], rec["type"]), {"ttl": rec["ttl"], "contents": []})
+        entry["contents"].append((rec["content"], rec["disabled"]))
+    return {key: _rrset_state(key[1], e["ttl"], e["contents"]) for key, e in grouped.items()}
+
+def diff_rrsets(current, desired):
+    """REPLACE changes for the desired rrsets that differ from the live zone (last definition of a name/type wins)."""
+    wanted = {}
+    for rr in desired:
+        wanted[_rrset_key(rr["name"], rr["type"])] = rr
+    changes = []
+    for key, rr in wanted.items():
+        state = _rrset_state(rr["type"], rr["ttl"], [(r["content"], r["disabled"]) for r in rr["records"]])
+        if current.get(key) != state:
+            changes.append({**rr, "changetype": "REPLACE"})
+    return changes
+
+def build_rrsets(domain, ips, selector, dkim_key, dmarc_email, client_only=False, inbound_ip=None):
     rrsets = []
     
     def make_rrset(name, type_, content_list):
@@ -53,7 +76,6 @@ def create_records(domain, ips, hostname, selector, dkim_key, dmarc_email, heade
             "name": name,
             "type": type_,
             "ttl": DEFAULT_TTL,
-            "changetype": "REPLACE",
             "records": [{"content": c, "disabled": False} for c in content_list]
         }
 
@@ -112,40 +134,112 @@ def create_records(domain, ips, hostname, selector, dkim_key, dmarc_email, heade
     dmarc_val = f"\"v=DMARC1; p=none; rua=mailto:{dmarc_email}; ruf=mailto:{dmarc_email}; fo=1\""
     rrsets.append(make_rrset(f"_dmarc.{domain}", "TXT", [dmarc_val]))
 
-    # Batch Update
-    zone_url = f"{BASE_URL}/zones/{domain}"
+    return rrsets
+
+def provision_domain(client, domain, ips, selector, dkim_key, dmarc_email, client_only=False, inbound_ip=None, dry_run=False):
+    """Creates the zone if needed and PATCHes only the rrsets that differ. Returns the changes."""
+    created = False if dry_run else ensure_zone(domain, client)
+    desired = build_rrsets(domain, ips, selector, dkim_key, dmarc_email, client_only=client_only, inbound_ip=inbound_ip)
     try:
-        requests.patch(zone_url, headers=headers, json={"rrsets": rrsets})
-        print(f"DNS Provisioned for {domain}")
-        if inbound_ip:
-            print(f" > Inbound (MX): {inbound_ip}")
-        print(f" > Outbound (SPF): {', '.join(ips)}")
-        
-    except Exception as e:
-        print(f"DNS Error: {e}")
-        sys.exit(1)
+        current = current_rrsets(domain, client)
+    except pdns_client.PdnsError as e:
+        if not (dry_run and e.status == 404):
+            raise
+        current = {}
+    changes = diff_rrsets(current, desired)
+
+    label = domain.rstrip('.')
+    if not changes:
+        print(f"DNS already up to date for {label} ({len(desired)} rrsets checked)")
+        return changes
+    for rr in changes:
+        print(f" ~ {rr['name'].rstrip('.')} {rr['type']}")
+    if dry_run:
+        print(f"DNS dry run for {label}: {len(changes)} of {len(desired)} rrsets would change")
+        return changes
+
+    client.patch_rrsets(domain, changes)
+    print(f"DNS Provisioned for {label}{' (new zone)' if created else ''}: {len(changes)} of {len(desired)} rrsets changed")
+    if inbound_ip:
+        print(f" > Inbound (MX): {inbound_ip}")
+    print(f" > Outbound (SPF): {', '.join(ips)}")
+    return changes
+
+def load_batch(path):
+    """
+    Domain list for --batch: a JSON array (file path or '-' for stdin) of
+    {"domain", "ip": [...], "selector", "dkim_key", "dmarc_email", "inbound_ip"?, "client_only"?}.
+    """
+    with (sys.stdin if path == "-" else open(path)) as f:
+        entries = json.load(f)
+    if not isinstance(entries, list):
+        raise ValueError("batch file must contain a JSON array")
+    return entries
+
+def run_batch(client, entries, dry_run=False):
+    """Provisions every entry in order with the shared client; returns the number of failed domains."""
+    failed = 0
+    for entry in entries:
+        domain = validate_domain(entry.get("domain"))
+        ips = entry.get("ip") or []
+        if isinstance(ips, str):
+            ips = [ips]
+        if not domain or not ips:
+            print(f"DNS Error: invalid batch entry for {entry.get('domain')!r} (domain and ip are required)")
+            failed += 1
+            continue
+        try:
+            provision_domain(
+                client, domain, ips,
+                entry.get("selector") or "default",
+                entry.get("dkim_key") or "none",
+                entry.get("dmarc_email") or f"postmaster@{domain.rstrip('.')}",
+                client_only=bool(entry.get("client_only")),
+                inbound_ip=entry.get("inbound_ip"),
+                dry_run=dry_run,
+            )
+        except pdns_client.PdnsError as e:
+            print(f"DNS Error for {domain.rstrip('.')}: HTTP {e.status} {e.message}" if e.status else f"DNS Error for {domain.rstrip('.')}: {e.message}")
+            failed += 1
+    print(f"DNS batch finished: {len(entries) - failed} of {len(entries)} domains OK")
+    return failed
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("--domain", required=True)
-    parser.add_argument("--ip", action='append', required=True, help="Outbound (PMTA) IPs")
+    parser.add_argument("--domain")
+    parser.add_argument("--ip", action='append', help="Outbound (PMTA) IPs")
     parser.add_argument("--inbound-ip", required=False, help="Inbound (Mailbox) IP for MX/mail.subdomain")
     parser.add_argument("--hostname", required=False, help="PTR-derived Hostname (Unused in new logic but kept for compat)")
-    parser.add_argument("--selector", required=True)
-    parser.add_argument("--dkim-key", required=True)
-    parser.add_argument("--dmarc-email", required=True)
+    parser.add_argument("--selector")
+    parser.add_argument("--dkim-key")
+    parser.add_argument("--dmarc-email")
     parser.add_argument("--client-only", action="store_true", help="Skip A/MX records, only provision SPF/DKIM/DMARC")
+    parser.add_argument("--batch", help="JSON domain list (file path or '-' for stdin); replaces the single-domain options")
+    parser.add_argument("--dry-run", action="store_true", help="Print the rrsets that would change without patching")
     
     args = parser.parse_args()
+    if not args.batch:
+        missing = [opt for opt in ("domain", "ip", "selector", "dkim_key", "dmarc_email") if not getattr(args, opt)]
+        if missing:
+            parser.error("the following arguments are required: " + ", ".join("--" + m.replace("_", "-") for m in missing))
     
-    api_key = get_api_key()
-    headers = get_headers(api_key)
+    client = get_client(get_api_key())
+
+    if args.batch:
+        try:
+            entries = load_batch(args.batch)
+        except (OSError, ValueError) as e:
+            print(f"Invalid batch: {e}")
+            sys.exit(1)
+        sys.exit(1 if run_batch(client, entries, dry_run=args.dry_run) else 0)
     
     domain = validate_domain(args.domain)
     if not domain:
         print("Invalid Domain")
         sys.exit(1)
         
-    ensure_zone(domain, headers) 
-    create_records(domain, args.ip, args.hostname, args.selector, args.dkim_key, args.dmarc_email, headers, client_only=args.client_only, inbound_ip=args.inbound_ip)
-
+    try:
+        provision_domain(client, domain, args.ip, args.selector, args.dkim_key, args.dmarc_email, client_only=args.client_only, inbound_ip=args.inbound_ip, dry_run=args.dry_run)
+    except pdns_client.PdnsError as e:
+        print(f"DNS Error: {e.message}")
+        sys.exit(1)
@@ -0,0 +1,248 @@
+"""
+PowerDNS HTTP API client shared by the dashboard's DNS views.
+
+One requests.Session per client keeps connections to the API alive instead of
+opening a new one per view. Zone reads are cached per zone: the flattened
+record list is kept together with the zone's serial (and the ETag, when the
+API sends one), and a later read first asks for the zone metadata only
+(?rrsets=false, a few hundred bytes). The full zone is downloaded and
+flattened again only when the serial moved, so large zones are transferred
+once per change instead of once per page view.
+
+Two safeguards keep the cache honest:
+  - a zone validated less than `revalidate_after` seconds ago is served
+    without asking PowerDNS at all (bursts of views cost one request);
+  - every cached zone is re-fetched after `max_age` seconds regardless of
+    the serial, since Native zones without SOA-EDIT-API keep their serial
+    when edited through the API.
+
+Writes made through this client (patch_rrsets, create_zone) drop the zone's
+cache entry immediately.
+
+Flattened records are {"name" (no trailing dot), "type", "ttl", "content",
+"disabled"}; records() filters them by type and/or name on our side of the
+API so callers never walk the whole zone.
+"""
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_PORT = 8081
+DEFAULT_TIMEOUT = 5          # seconds per request
+REVALIDATE_AFTER = 2.0       # seconds a validated zone is trusted without asking
+MAX_AGE = 300                # seconds before a full re-fetch regardless of serial
+POOL_SIZE = 10
+
+
+class PdnsError(Exception):
+    """API failure; `status` is the HTTP status (0 when PowerDNS could not be reached)."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def canonical(zone: str) -> str:
+    """Zone / record name in PowerDNS form: lowercase with a trailing dot."""
+    zone = zone.strip().lower()
+    return zone if zone.endswith(".") else f"{zone}."
+
+
+def flatten(rrsets: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    records = []
+    for rr in rrsets:
+        name = rr.get("name", "").rstrip(".")
+        rtype = rr.get("type", "")
+        ttl = rr.get("ttl", 0)
+        for res in rr.get("records", []):
+            records.append({
+                "name": name,
+                "type": rtype,
+                "ttl": ttl,
+                "content": res.get("content", ""),
+                "disabled": res.get("disabled", False),
+            })
+    return records
+
+
+class _Zone:
+    __slots__ = ("name", "serial", "etag", "records", "by_type", "fetched_at", "validated_at")
+
+    def __init__(self, name: str, serial: Tuple[Any, Any], etag: Optional[str], records: List[Dict[str, Any]]):
+        self.name = name
+        self.serial = serial
+        self.etag = etag
+        self.records = records
+        self.by_type: Dict[str, List[Dict[str, Any]]] = {}
+        for rec in records:
+            self.by_type.setdefault(rec["type"], []).append(rec)
+        self.fetched_at = self.validated_at = time.time()
+
+
+def _serial(data: Dict[str, Any]) -> Tuple[Any, Any]:
+    # edited_serial moves on API edits even when the SOA serial itself does not
+    return data.get("serial"), data.get("edited_serial")
+
+
+class PdnsClient:
+    def __init__(
+        self,
+        host: str,
+        api_key: str,
+        port: int = DEFAULT_PORT,
+        server: str = "localhost",
+        timeout: float = DEFAULT_TIMEOUT,
+        revalidate_after: float = REVALIDATE_AFTER,
+        max_age: float = MAX_AGE,
+        pool_size: int = POOL_SIZE,
+    ):
+        self.host = host
+        self.port = int(port)
+        self.base_url = f"http://{host}:{self.port}/api/v1/servers/{server}"
+        self.timeout = timeout
+        self.revalidate_after = revalidate_after
+        self.max_age = max_age
+        self.session = requests.Session()
+        self.session.headers.update({"X-API-Key": api_key, "Accept": "application/json"})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._zones: Dict[str, _Zone] = {}
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "revalidated": 0, "fetches": 0}
+
+    # --- HTTP ---
+
+    def _request(self, method: str, path: str, ok: Tuple[int, ...] = (200,), **kwargs: Any) -> requests.Response:
+        try:
+            resp = self.session.request(method, f"{self.base_url}{path}", timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            raise PdnsError(0, f"Failed to contact PowerDNS: {e}")
+        if resp.status_code not in ok:
+            try:
+                message = resp.json().get("error") or resp.text
+            except ValueError:
+                message = resp.text
+            raise PdnsError(resp.status_code, message)
+        return resp
+
+    def server_info(self) -> Dict[str, Any]:
+        return self._request("GET", "").json()
+
+    def zone_meta(self, zone: str) -> Dict[str, Any]:
+        """Zone metadata without records (serial, kind, ...)."""
+        return self._request("GET", f"/zones/{canonical(zone)}", params={"rrsets": "false"}).json()
+
+    def zone_names(self) -> List[str]:
+        """Names of every zone on the server, without the trailing dot."""
+        return sorted(z["name"].rstrip(".").lower() for z in self._request("GET", "/zones").json())
+
+    def zone_exists(self, zone: str) -> bool:
+        try:
+            self.zone_meta(zone)
+            return True
+        except PdnsError as e:
+            if e.status == 404:
+                return False
+            raise
+
+    def create_zone(self, zone: str, nameservers: List[str], kind: str = "Native") -> Dict[str, Any]:
+        zone = canonical(zone)
+        payload = {"name": zone, "kind": kind, "nameservers": nameservers}
+        resp = self._request("POST", "/zones", ok=(201,), json=payload)
+        self.invalidate(zone)
+        return resp.json()
+
+    def patch_rrsets(self, zone: str, rrsets: List[Dict[str, Any]]) -> None:
+        zone = canonical(zone)
+        try:
+            self._request("PATCH", f"/zones/{zone}", ok=(200, 204), json={"rrsets": rrsets})
+        finally:
+            self.invalidate(zone)
+
+    # --- cached zone reads ---
+
+    def _fetch(self, zone: str, cached: Optional[_Zone]) -> _Zone:
+        headers = {"If-None-Match": cached.etag} if cached and cached.etag else {}
+        resp = self._request("GET", f"/zones/{zone}", ok=(200, 304), headers=headers)
+        if resp.status_code == 304 and cached:
+            cached.fetched_at = cached.validated_at = time.time()
+            return cached
+        data = resp.json()
+        self._counters["fetches"] += 1
+        return _Zone(zone, _serial(data), resp.headers.get("ETag"), flatten(data.get("rrsets", [])))
+
+    def zone(self, zone: str, refresh: bool = False) -> Tuple[_Zone, bool]:
+        """(zone entry, served_from_cache)."""
+        zone = canonical(zone)
+        with self._lock:
+            cached = self._zones.get(zone)
+        now = time.time()
+
+        if cached and not refresh and now - cached.fetched_at < self.max_age:
+            if now - cached.validated_at < self.revalidate_after:
+                self._counters["hits"] += 1
+                return cached, True
+            meta = self.zone_meta(zone)
+            if _serial(meta) == cached.serial:
+                cached.validated_at = now
+                self._counters["revalidated"] += 1
+                return cached, True
+            if meta.get("rrsets"):
+                # Servers older than 4.5 ignore rrsets=false; the metadata call already has the zone
+                entry = _Zone(zone, _serial(meta), None, flatten(meta["rrsets"]))
+                self._counters["fetches"] += 1
+                with self._lock:
+                    self._zones[zone] = entry
+                return entry, False
+
+        entry = self._fetch(zone, None if refresh else cached)
+        with self._lock:
+            self._zones[zone] = entry
+        return entry, entry is cached
+
+    def records(
+        self,
+        zone: str,
+        rtype: Optional[str] = None,
+        name: Optional[str] = None,
+        refresh: bool = False,
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        (records, info) for a zone, optionally filtered by type and name.
+        `name` is a full record name or one relative to the zone ("_dmarc", "@").
+        info: {"zone", "serial", "cached", "age", "total"}.
+        """
+        entry, cached = self.zone(zone, refresh=refresh)
+        records = entry.by_type.get(rtype.upper(), []) if rtype else entry.records
+        if name:
+            origin = entry.name.rstrip(".")
+            wanted = name.strip().lower().rstrip(".")
+            if wanted == "@":
+                wanted = origin
+            elif wanted != origin and not wanted.endswith(f".{origin}"):
+                wanted = f"{wanted}.{origin}"
+            records = [r for r in records if r["name"].lower() == wanted]
+        info = {
+            "zone": entry.name.rstrip("."),
+            "serial": entry.serial[0],
+            "cached": cached,
+            "age": int(time.time() - entry.fetched_at),
+            "total": len(entry.records),
+        }
+        return records, info
+
+    def invalidate(self, zone: Optional[str] = None) -> None:
+        with self._lock:
+            if zone is None:
+                self._zones.clear()
+            else:
+                self._zones.pop(canonical(zone), None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"zones": len(self._zones), **self._counters}
@@ -0,0 +1,220 @@
+"""
+Transactional PMTA config apply in one remote round trip.
+
+The new file(s) and a small apply script are uploaded in a single SFTP session,
+then the script runs once on the server:
+
+  1. install   for every target in the manifest: keep the live file as
+               <file>.apply-prev, then rename the new file over it (copied next to
+               the target first, so the rename is atomic) or delete it
+  2. check     run the PMTA config check (skipped if the command is unavailable)
+  3. reload    `pmta reload` / `systemctl restart pmta` / nothing
+  4. cleanup   drop the previous copies
+
+If any step fails, every file touched so far is restored (and PMTA reloaded
+when a reload was requested), so the server is never left on a bad config.
+Every step reports its exit code and duration; the script prints them as
+`STEP <name> <ok|fail|skip> <ms>` lines which are parsed into a dict.
+"""
+import shlex
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+PMTA_CONFIG_PATH = "/etc/pmta/config"
+DEFAULT_CHECK_CMD = "pmta check"
+
+RELOAD_COMMANDS = {
+    "reload": "pmta reload",
+    "restart": "systemctl restart pmta",
+    "none": "",
+}
+
+# Manifest lines: "<uploaded file or -><TAB><target>"; "-" deletes the target
+_APPLY_SCRIPT = r"""#!/bin/sh
+manifest="$1"; check_cmd="$2"; reload_cmd="$3"; self="$0"
+done_list="$manifest.done"
+TAB=$(printf '\t')
+now_ms() { echo $(( $(date +%s%N) / 1000000 )); }
+out=$(mktemp)
+: > "$done_list"
+step() {
+    name="$1"; shift
+    t0=$(now_ms)
+    "$@" >"$out" 2>&1; rc=$?
+    ms=$(( $(now_ms) - t0 ))
+    return $rc
+}
+report() { echo "STEP $1 $2 $ms"; }
+dump() { sed 's/^/OUT /' "$out"; }
+finish() {
+    while IFS="$TAB" read -r src dst; do [ "$src" != "-" ] && rm -f "$src"; done < "$manifest"
+    rm -f "$manifest" "$done_list" "$out" "$self"; echo "RESULT $1"; exit 0
+}
+
+install_all() {
+    while IFS="$TAB" read -r src dst; do
+        [ -n "$dst" ] || continue
+        mkdir -p "$(dirname "$dst")" || return 1
+        if [ -e "$dst" ]; then
+            cp -p "$dst" "$dst.apply-prev" || { rm -f "$dst.apply-prev"; return 1; }
+        else
+            rm -f "$dst.apply-prev"
+        fi
+        # Recorded only once the live file is backed up: restore puts .apply-prev back or,
+        # without one, deletes the target, which must only happen for files we created
+        echo "$dst" >> "$done_list"
+        if [ "$src" = "-" ]; then
+            rm -f "$dst" || return 1
+        else
+            cp "$src" "$dst.apply-new" && chmod 644 "$dst.apply-new" && mv -f "$dst.apply-new" "$dst" || return 1
+        fi
+    done < "$manifest"
+}
+
+restore() {
+    while read -r dst; do
+        if [ -f "$dst.apply-prev" ]; then mv -f "$dst.apply-prev" "$dst"; else rm -f "$dst" "$dst.apply-new"; fi
+    done < "$done_list"
+    if [ -n "$reload_cmd" ]; then
+        step rollback-reload sh -c "$reload_cmd"
+        [ $rc -eq 0 ] && report rollback-reload ok || { report rollback-reload fail; dump; }
+    fi
+}
+
+cleanup() { while read -r dst; do rm -f "$dst.apply-prev"; done < "$done_list"; }
+
+step install install_all
+if [ $rc -ne 0 ]; then report install fail; dump; reload_cmd=""; restore; finish failed; fi
+report install ok
+
+if [ -n "$check_cmd" ]; then
+    step check sh -c "$check_cmd"
+    if [ $rc -eq 127 ]; then
+        report check skip
+    elif [ $rc -ne 0 ]; then
+        report check fail; dump; restore; finish rolled_back
+    else
+        report check ok
+    fi
+fi
+
+if [ -n "$reload_cmd" ]; then
+    step reload sh -c "$reload_cmd"
+    if [ $rc -ne 0 ]; then report reload fail; dump; restore; finish rolled_back; fi
+    report reload ok
+fi
+
+cleanup
+finish ok
+"""
+
+
+def parse_apply_output(text: str) -> Dict[str, Any]:
+    steps: List[Dict[str, Any]] = []
+    output: List[str] = []
+    result = "unknown"
+    for line in text.splitlines():
+        if line.startswith("STEP "):
+            parts = line.split()
+            if len(parts) == 4:
+                steps.append({"name": parts[1], "status": parts[2], "ms": int(parts[3]) if parts[3].isdigit() else None})
+        elif line.startswith("OUT "):
+            output.append(line[4:])
+        elif line.startswith("RESULT "):
+            result = line.split(None, 1)[1].strip()
+    return {"result": result, "steps": steps, "output": "\n".join(output)}
+
+
+def apply_files(
+    ssh: Any,
+    files: Dict[str, Any],
+    run: Callable[[Any, str], Any],
+    mode: str = "reload",
+    check_cmd: Optional[str] = DEFAULT_CHECK_CMD,
+) -> Dict[str, Any]:
+    """
+    Applies several files as one transaction: {target path: content}, where content
+    is a string, a callable writing to a file object, or None to delete the target.
+
+    run(ssh, command) executes a command with the needed privileges and returns
+    (stdin, stdout, stderr) like paramiko's exec_command (e.g. exec_sudo_command).
+
+    Returns {"ok", "result": ok|rolled_back|failed|unknown, "steps", "output", "timings", "files"}.
+    """
+    if mode not in RELOAD_COMMANDS:
+        raise ValueError(f"Unknown apply mode: {mode}")
+
+    token = uuid.uuid4().hex[:12]
+    manifest_path = f"/tmp/pmta-apply-{token}.manifest"
+    script_path = f"/tmp/pmta-apply-{token}.sh"
+    t_start = time.time()
+
+    manifest = []
+    sftp = ssh.open_sftp()
+    try:
+        for i, (target, content) in enumerate(files.items()):
+            if content is None:
+                manifest.append(f"-\t{target}")
+                continue
+            new_path = f"/tmp/pmta-apply-{token}.{i}.config"
+            with sftp.file(new_path, "w") as f:
+                if callable(content):
+                    content(f)
+                else:
+                    f.write(content)
+            manifest.append(f"{new_path}\t{target}")
+        with sftp.file(manifest_path, "w") as f:
+            f.write("\n".join(manifest) + "\n")
+        with sftp.file(script_path, "w") as f:
+            f.write(_APPLY_SCRIPT)
+    finally:
+        sftp.close()
+    t_uploaded = time.time()
+
+    cmd = "sh " + " ".join(shlex.quote(a) for a in (
+        script_path, manifest_path, check_cmd or "", RELOAD_COMMANDS[mode]))
+    stdin, stdout, stderr = run(ssh, cmd)
+    raw = stdout.read().decode("utf-8", errors="replace")
+    err = stderr.read().decode("utf-8", errors="replace")
+    t_done = time.time()
+
+    parsed = parse_apply_output(raw)
+    if parsed["result"] == "unknown" and err.strip():
+        parsed["output"] = (parsed["output"] + "\n" + err).strip()
+    parsed["ok"] = parsed["result"] == "ok"
+    parsed["files"] = list(files)
+    parsed["timings"] = {
+        "upload_ms": round((t_uploaded - t_start) * 1000, 1),
+        "remote_ms": round((t_done - t_uploaded) * 1000, 1),
+        "total_ms": round((t_done - t_start) * 1000, 1),
+        "steps": {s["name"]: s["ms"] for s in parsed["steps"]},
+    }
+    return parsed
+
+
+def apply_config(
+    ssh: Any,
+    config: Any,
+    run: Callable[[Any, str], Any],
+    mode: str = "reload",
+    check_cmd: Optional[str] = DEFAULT_CHECK_CMD,
+    target: str = PMTA_CONFIG_PATH,
+) -> Dict[str, Any]:
+    """Applies `config` (a string, or a callable writing to a file object) as `target`."""
+    return apply_files(ssh, {target: config}, run, mode=mode, check_cmd=check_cmd)
+
+
+def unchanged_result() -> Dict[str, Any]:
+    """Result for an apply that had nothing to upload."""
+    return {"ok": True, "result": "ok", "steps": [], "output": "", "files": [],
+            "timings": {"upload_ms": 0, "remote_ms": 0, "total_ms": 0, "steps": {}}}
+
+
+def describe_failure(result: Dict[str, Any]) -> str:
+    failed = [s["name"] for s in result.get("steps", []) if s["status"] == "fail"]
+    what = f"{failed[0]} failed" if failed else f"apply {result.get('result')}"
+    if result.get("result") == "rolled_back":
+        what += " (previous config restored)"
+    output = (result.get("output") or "").strip()
+    return f"{what}: {output}" if output else what
@@ -0,0 +1,213 @@
+"""
+Split PMTA config layout: a stable root file plus one include file per sender domain.
+
+  /etc/pmta/config                      globals, sources, users, domain rules and
+                                        the two include lines below
+  /etc/pmta/conf.d/<domain>.conf        the <virtual-mta> blocks of one sender domain
+  /etc/pmta/conf.d/_unassigned.conf     VMTAs whose domain can't be determined
+  /etc/pmta/conf.d/pools/<pool>.conf    one <virtual-mta-pool> block
+
+Pools live in their own directory, included after the domain files, so every
+VMTA is defined before a pool references it regardless of glob ordering.
+
+The dashboard keeps working on one text ("merged" config: the root followed by
+every include file behind a `# >>> <path>` marker line), so parsing,
+validation, history and diffs are unchanged. Before upload the edited text is
+split back into files and only files whose content changed are written, so
+onboarding, removing or re-keying a domain touches that domain's fragment (and
+the pools it belongs to) instead of the whole config.
+"""
+import re
+import shlex
+from typing import Any, Dict, List, Optional
+
+import pmta_config_ast
+from pmta_vmta_ops import VmtaIndex
+
+ROOT_PATH = "/etc/pmta/config"
+CONF_DIR = "/etc/pmta/conf.d"
+POOL_DIR = f"{CONF_DIR}/pools"
+INCLUDE_VALUES = (f"{CONF_DIR}/*.conf", f"{POOL_DIR}/*.conf")
+
+UNASSIGNED = "_unassigned"
+
+_MARKER = "# >>> "
+_MARKER_RE = re.compile(r"^# >>> (" + re.escape(CONF_DIR) + r"/\S+)[ \t]*$", re.MULTILINE)
+_INCLUDE_RE = re.compile(r"^[ \t]*include[ \t]+" + re.escape(CONF_DIR) + r"/", re.MULTILINE)
+_UNSAFE_RE = re.compile(r"[^a-z0-9._-]")
+
+_FILE_HEADER = "@@PMTA-FILE "
+
+
+def uses_confd(config_text: Optional[str]) -> bool:
+    """True when the root config includes the conf.d directory."""
+    return bool(config_text) and bool(_INCLUDE_RE.search(config_text))
+
+
+def domain_fragment_path(domain: Optional[str]) -> str:
+    safe = _UNSAFE_RE.sub("_", (domain or "").lower().rstrip(".")).lstrip("._")
+    return f"{CONF_DIR}/{safe or UNASSIGNED}.conf"
+
+
+def pool_fragment_path(pool: str) -> str:
+    return f"{POOL_DIR}/{_UNSAFE_RE.sub('_', pool.lower())}.conf"
+
+
+# --- reading -------------------------------------------------------------
+
+def read_command() -> str:
+    """One shell command printing the root config and every include file, length-prefixed."""
+    return "sh -c " + shlex.quote(
+        f"for f in {ROOT_PATH} {CONF_DIR}/*.conf {POOL_DIR}/*.conf; do "
+        f"[ -f \"$f\" ] && {{ echo \"{_FILE_HEADER}$f $(wc -c < \"$f\")\"; cat \"$f\"; echo; }}; "
+        "done; true"
+    )
+
+
+def parse_read_output(raw: bytes) -> Dict[str, str]:
+    """{path: text} from read_command() output."""
+    files: Dict[str, str] = {}
+    header = _FILE_HEADER.encode()
+    pos = 0
+    while True:
+        start = raw.find(header, pos)
+        if start < 0:
+            break
+        eol = raw.find(b"\n", start)
+        if eol < 0:
+            break
+        parts = raw[start + len(header):eol].decode("utf-8", errors="replace").rsplit(" ", 1)
+        if len(parts) != 2 or not parts[1].strip().isdigit():
+            pos = eol + 1
+            continue
+        path, size = parts[0], int(parts[1])
+        body = raw[eol + 1:eol + 1 + size]
+        files[path] = body.decode("utf-8", errors="replace")
+        pos = eol + 1 + size + 1
+    return files
+
+
+# --- merged view ---------------------------------------------------------
+
+def _fragment_order(path: str):
+    return (path.startswith(POOL_DIR + "/"), path)
+
+
+def merge(layout: Dict[str, str]) -> str:
+    """Root config followed by each include file behind its marker line."""
+    root = layout.get(ROOT_PATH, "")
+    fragments = sorted((p for p in layout if p != ROOT_PATH), key=_fragment_order)
+    if not fragments:
+        return root
+    out = [root]
+    if root and not root.endswith("\n"):
+        out.append("\n")
+    for path in fragments:
+        text = layout[path]
+        out.append(f"{_MARKER}{path}\n")
+        out.append(text if not text or text.endswith("\n") else text + "\n")
+    return "".join(out)
+
+
+def unmerge(merged: str) -> Dict[str, str]:
+    """Exact inverse of merge() for text that hasn't been edited."""
+    markers = list(_MARKER_RE.finditer(merged))
+    if not markers:
+        return {ROOT_PATH: merged}
+    layout = {ROOT_PATH: merged[:markers[0].start()]}
+    for i, m in enumerate(markers):
+        end = markers[i + 1].start() if i + 1 < len(markers) else len(merged)
+        layout[m.group(1)] = merged[m.end() + 1:end]
+    return layout
+
+
+# --- splitting -----------------------------------------------------------
+
+def _render_fragment(title: str, blocks: List["pmta_config_ast.Block"]) -> str:
+    return f"# {title} (generated; edit through the dashboard)\n\n" + "\n".join(b.render(0) for b in blocks)
+
+
+def split(config: Any) -> Dict[str, str]:
+    """
+    Distributes a (merged or monolithic) config into the conf.d layout.
+
+    <virtual-mta> blocks go to their domain's file (domain taken from domain-key,
+    else from the smtp-source-host name), pools to one file each, everything else
+    stays in the root, which gets the include lines where the first VMTA or pool
+    used to be. Nodes found after the first marker that aren't VMTAs or pools
+    (e.g. a user appended at the end of the text) are moved to the root.
+    """
+    tree = pmta_config_ast.parse(config) if isinstance(config, str) else config
+    root = pmta_config_ast.Config()
+    root.ends_with_newline = tree.ends_with_newline
+    domains: Dict[str, List[pmta_config_ast.Block]] = {}
+    pools: Dict[str, List[pmta_config_ast.Block]] = {}
+    tail: List[Any] = []
+    include_at: Optional[int] = None
+    includes: Dict[str, int] = {}
+    in_fragments = False
+
+    for child in tree.children:
+        if isinstance(child, pmta_config_ast.Comment) and _MARKER_RE.match((child.raw or "").rstrip("\r\n")):
+            in_fragments = True
+            continue
+        if isinstance(child, pmta_config_ast.Block) and child.tag in ("virtual-mta", "virtual-mta-pool"):
+            if child.tag == "virtual-mta":
+                domains.setdefault(domain_fragment_path(VmtaIndex.domain_of(child)), []).append(child)
+            else:
+                pools.setdefault(pool_fragment_path(child.arg.strip()), []).append(child)
+            if not in_fragments:
+                if root.children and isinstance(root.children[-1], pmta_config_ast.Blank):
+                    root.children.pop()
+                if include_at is None:
+                    include_at = len(root.children)
+            continue
+        if in_fragments:
+            if not isinstance(child, (pmta_config_ast.Blank, pmta_config_ast.Comment)):
+                tail.append(child)
+            continue
+        if isinstance(child, pmta_config_ast.Directive) and child.key == "include" and child.value.strip() in INCLUDE_VALUES:
+            includes[child.value.strip()] = len(root.children)
+        root.children.append(child)
+
+    missing = [pmta_config_ast.Directive("include", v) for v in INCLUDE_VALUES if v not in includes]
+    if includes and missing:
+        at = max(includes.values()) + 1
+        root.children[at:at] = missing
+    elif missing:
+        if include_at is None:
+            root.append(missing[0])
+            for include in missing[1:]:
+                root.append(include, separate=False)
+        else:
+            include_at = min(include_at, len(root.children))
+            nodes: List[Any] = list(missing)
+            if include_at > 0:
+                nodes.insert(0, pmta_config_ast.Blank())
+            if include_at < len(root.children) and not isinstance(root.children[include_at], pmta_config_ast.Blank):
+                nodes.append(pmta_config_ast.Blank())
+            root.children[include_at:include_at] = nodes
+    for node in tail:
+        root.append(node)
+
+    root_text = root.render()
+    layout = {ROOT_PATH: root_text if not root_text or root_text.endswith("\n") else root_text + "\n"}
+    for path, blocks in domains.items():
+        name = path.rsplit("/", 1)[-1][:-len(".conf")]
+        layout[path] = _render_fragment(
+            "VMTAs without a sender domain" if name == UNASSIGNED else f"Sender domain {name}", blocks)
+    for path, blocks in pools.items():
+        layout[path] = _render_fragment(f"VMTA pool {blocks[0].arg.strip()}", blocks)
+    return layout
+
+
+def plan(new_layout: Dict[str, str], current_layout: Dict[str, str]) -> Dict[str, Optional[str]]:
+    """Files to write ({path: text}) or delete ({path: None}) to go from current to new."""
+    changes: Dict[str, Optional[str]] = {}
+    for path, text in new_layout.items():
+        if current_layout.get(path) != text:
+            changes[path] = text
+    for path in current_layout:
+        if path not in new_layout:
+            changes[path] = None
+    return changes
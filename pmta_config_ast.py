@@ -0,0 +1,220 @@
+"""
+Single-pass parser for PowerMTA configuration files.
+
+The config is tokenized line by line into a tree of nodes:
+  Block      <tag arg> ... </tag>   (virtual-mta, virtual-mta-pool, source, domain,
+                                     smtp-user, pattern-list, smtp-pattern-list,
+                                     bounce-category-patterns, acct-file, spool, ...)
+  Directive  key value
+  Comment    # ...
+  Blank      empty line
+
+Every node keeps its 1-based source line and the raw text it came from, so
+render(parse(text)) == text for any input, including malformed configs.
+Structural problems (unclosed or stray closing tags) are collected in
+Config.errors instead of raising, so callers can report all of them at once.
+"""
+import re
+from typing import Dict, Iterator, List, Optional, Union
+
+_OPEN_RE = re.compile(r"^<\s*([A-Za-z][\w-]*)\s*([^>]*?)\s*>\s*$")
+_CLOSE_RE = re.compile(r"^<\s*/\s*([A-Za-z][\w-]*)\s*>\s*$")
+
+INDENT = "    "
+
+
+class Comment:
+    __slots__ = ("text", "line", "raw")
+    kind = "comment"
+
+    def __init__(self, text: str, line: int = 0, raw: Optional[str] = None):
+        self.text = text
+        self.line = line
+        self.raw = raw
+
+    def render(self, depth: int = 0) -> str:
+        return self.raw if self.raw is not None else f"{INDENT * depth}# {self.text}\n"
+
+
+class Blank:
+    __slots__ = ("line", "raw")
+    kind = "blank"
+
+    def __init__(self, line: int = 0, raw: Optional[str] = None):
+        self.line = line
+        self.raw = raw
+
+    def render(self, depth: int = 0) -> str:
+        return self.raw if self.raw is not None else "\n"
+
+
+class Directive:
+    __slots__ = ("key", "value", "line", "raw")
+    kind = "directive"
+
+    def __init__(self, key: str, value: str = "", line: int = 0, raw: Optional[str] = None):
+        self.key = key
+        self.value = value
+        self.line = line
+        self.raw = raw
+
+    def set(self, value: str) -> None:
+        if value != self.value:
+            self.value = value
+            self.raw = None
+
+    def render(self, depth: int = 0) -> str:
+        if self.raw is not None:
+            return self.raw
+        return f"{INDENT * depth}{self.key} {self.value}".rstrip() + "\n"
+
+
+class Block:
+    __slots__ = ("tag", "arg", "children", "line", "end_line", "raw_open", "raw_close")
+    kind = "block"
+
+    def __init__(self, tag: str, arg: str = "", line: int = 0, raw_open: Optional[str] = None):
+        self.tag = tag
+        self.arg = arg
+        self.children: List["Node"] = []
+        self.line = line
+        self.end_line: Optional[int] = None
+        self.raw_open = raw_open
+        self.raw_close: Optional[str] = None
+
+    # --- lookups ---
+    def directives(self, key: Optional[str] = None) -> Iterator[Directive]:
+        for child in self.children:
+            if isinstance(child, Directive) and (key is None or child.key == key):
+                yield child
+
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        for d in self.directives(key):
+            return d.value
+        return default
+
+    def get_all(self, key: str) -> List[str]:
+        return [d.value for d in self.directives(key)]
+
+    def blocks(self, tag: Optional[str] = None) -> Iterator["Block"]:
+        for child in self.children:
+            if isinstance(child, Block) and (tag is None or child.tag == tag):
+                yield child
+
+    # --- edits ---
+    def set(self, key: str, value: str) -> Directive:
+        """Updates the first `key` directive, appending one if missing."""
+        for d in self.directives(key):
+            d.set(value)
+            return d
+        d = Directive(key, value)
+        self.children.append(d)
+        return d
+
+    def remove(self, key: str) -> int:
+        before = len(self.children)
+        self.children = [c for c in self.children if not (isinstance(c, Directive) and c.key == key)]
+        return before - len(self.children)
+
+    def render(self, depth: int = 0) -> str:
+        out = [self.raw_open if self.raw_open is not None else
+               f"{INDENT * depth}<{self.tag}{' ' + self.arg if self.arg else ''}>\n"]
+        for child in self.children:
+            out.append(child.render(depth + 1))
+        if self.end_line is not None or self.raw_close is not None or self.raw_open is None:
+            out.append(self.raw_close if self.raw_close is not None else f"{INDENT * depth}</{self.tag}>\n")
+        return "".join(out)
+
+
+Node = Union[Comment, Blank, Directive, Block]
+
+
+class Config(Block):
+    """Root of a parsed config: top-level nodes plus any structural errors."""
+    __slots__ = ("errors", "ends_with_newline")
+
+    def __init__(self):
+        super().__init__("", "")
+        self.errors: List[Dict[str, object]] = []
+        self.ends_with_newline = True
+
+    def append(self, node: Node, separate: bool = True) -> None:
+        """Adds a node at the end of the file, after a blank line when `separate` is set."""
+        if not self.ends_with_newline:
+            self.children.append(Blank(raw="\n"))
+        if separate and self.children and not isinstance(self.children[-1], Blank):
+            self.children.append(Blank())
+        self.children.append(node)
+        self.ends_with_newline = True
+
+    def render(self, depth: int = 0) -> str:
+        return "".join(child.render(0) for child in self.children)
+
+    def walk(self, tag: Optional[str] = None) -> Iterator[Block]:
+        """All blocks at any depth (document order), optionally filtered by tag."""
+        stack = [iter(self.children)]
+        while stack:
+            for child in stack[-1]:
+                if isinstance(child, Block):
+                    if tag is None or child.tag == tag:
+                        yield child
+                    stack.append(iter(child.children))
+                    break
+            else:
+                stack.pop()
+
+    def index(self, tag: str) -> Dict[str, Block]:
+        """Blocks of `tag` by argument (first occurrence wins)."""
+        result: Dict[str, Block] = {}
+        for block in self.walk(tag):
+            result.setdefault(block.arg, block)
+        return result
+
+
+def parse(text: str) -> Config:
+    """Tokenizes `text` in a single pass and returns its Config tree."""
+    root = Config()
+    stack: List[Block] = [root]
+
+    for lineno, raw in enumerate(text.splitlines(keepends=True), 1):
+        stripped = raw.strip()
+        parent = stack[-1]
+
+        if not stripped:
+            parent.children.append(Blank(lineno, raw))
+            continue
+        if stripped.startswith("#"):
+            parent.children.append(Comment(stripped[1:].strip(), lineno, raw))
+            continue
+
+        if stripped.startswith("<"):
+            m = _CLOSE_RE.match(stripped)
+            if m:
+                tag = m.group(1).lower()
+                if len(stack) > 1 and stack[-1].tag == tag:
+                    block = stack.pop()
+                    block.end_line = lineno
+                    block.raw_close = raw
+                else:
+                    root.errors.append({"line": lineno, "message": f"Unexpected closing tag </{tag}>"})
+                    # Keep the text so the file still round-trips
+                    parent.children.append(Directive(stripped, "", lineno, raw))
+                continue
+            m = _OPEN_RE.match(stripped)
+            if m:
+                block = Block(m.group(1).lower(), m.group(2), lineno, raw)
+                parent.children.append(block)
+                stack.append(block)
+                continue
+
+        parts = stripped.split(None, 1)
+        parent.children.append(Directive(parts[0], parts[1] if len(parts) > 1 else "", lineno, raw))
+
+    root.ends_with_newline = not text or text.endswith(("\n", "\r"))
+    for block in stack[1:]:
+        root.errors.append({"line": block.line, "message": f"Block <{block.tag} {block.arg}> is never closed"})
+    return root
+
+
+def render(config: Config) -> str:
+    return config.render()
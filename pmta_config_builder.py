@@ -0,0 +1,163 @@
+"""
+Streaming builder for PMTA config files from the JSON structure used by the UI
+(see parse_pmta_config in backend.py).
+
+VMTA and pool IDs are resolved through dict indexes built once per call, so
+output time is linear in the number of VMTAs and pool members. Lines are
+produced by a generator and can be written in chunks to any object with a
+write() method (local file, paramiko SFTP file, io.StringIO).
+"""
+from typing import Any, Dict, Iterator, Optional
+
+DEFAULT_CHUNK_CHARS = 64 * 1024
+
+# UI bounce rule type -> PMTA bounce category (used when the rule has no explicit category)
+_BOUNCE_TYPE_CATEGORY = {
+    "hard": "hard-bounce",
+    "defer": "transient-failure",
+}
+
+
+def _strip_prefix(ref: str, prefix: str) -> str:
+    return ref[len(prefix):] if ref.startswith(prefix) else ref
+
+
+def build_name_index(config_json: Dict[str, Any]) -> Dict[str, str]:
+    """ID -> name for every VMTA and pool (IDs are 'vmta-<ts>' for new items, 'vmta-<name>' for parsed ones)."""
+    index: Dict[str, str] = {}
+    for vmta in config_json.get("vmtas", []):
+        if vmta.get("id") and vmta.get("name"):
+            index[vmta["id"]] = vmta["name"]
+    for pool in config_json.get("pools", []):
+        if pool.get("id") and pool.get("name"):
+            index[pool["id"]] = pool["name"]
+    return index
+
+
+def resolve_vmta_ref(ref: Optional[str], index: Dict[str, str]) -> Optional[str]:
+    """Name for a VMTA/pool reference that may be an ID or already a name."""
+    if not ref:
+        return ref
+    name = index.get(ref)
+    if name is not None:
+        return name
+    return ref
+
+
+def iter_config_lines(config_json: Dict[str, Any]) -> Iterator[str]:
+    """Yields the config lines (without newlines) in file order."""
+    index = build_name_index(config_json)
+
+    # 1. Global Settings
+    g = config_json.get("global", {})
+    yield "# Global Settings"
+    if g.get("runAsUser"): yield f"run-as-user {g['runAsUser']}"
+    if g.get("runAsGroup"): yield f"run-as-group {g['runAsGroup']}"
+    if g.get("logFile"): yield f"log-file {g['logFile']}"
+    if g.get("httpPort"): yield f"http-mgmt-port {g['httpPort']}"
+    if g.get("httpAdminPort"): yield f"http-access {g.get('hostname', '*') or '*'} admin {g['httpAdminPort']}"
+    if g.get("smtpPort"): yield f"smtp-port {g['smtpPort']}"
+    if g.get("maxConnections"): yield f"max-smtp-out {g['maxConnections']}"
+    if g.get("maxMessagesPerConnection"): yield f"max-msg-per-connection {g['maxMessagesPerConnection']}"
+    if g.get("maxMessagesPerHour"): yield f"max-msg-rate {g['maxMessagesPerHour']}/hour"
+    if g.get("addDateHeader"): yield "add-date-header yes"
+    if g.get("addMessageIdHeader"): yield "add-message-id-header yes"
+    if g.get("retryAfter"): yield f"retry-after {g['retryAfter']}"
+    if g.get("bounceAfter"): yield f"bounce-after {g['bounceAfter']}"
+
+    # Enable accounting
+    yield "acct-file /var/log/pmta/acct.csv"
+    yield ""
+
+    # 2. VMTAs
+    yield "# Virtual MTAs"
+    for vmta in config_json.get("vmtas", []):
+        if not vmta.get("enabled", True): continue
+        yield f"<virtual-mta {vmta['name']}>"
+        yield f"    smtp-source-host {vmta['smtpSourceHost']}"
+        if vmta.get("dkimEnabled") and vmta.get("domainKey"):
+            dk = vmta["domainKey"]
+            yield f"    domain-key {dk['selector']},{dk['domain']},{dk['keyPath']}"
+        if vmta.get("maxConnections"):
+            yield f"    max-smtp-out {vmta['maxConnections']}"
+        yield "</virtual-mta>"
+        yield ""
+
+    # 3. Pools. Members are VMTA IDs; unknown IDs of the form "vmta-NAME" fall back to NAME.
+    yield "# VMTA Pools"
+    for pool in config_json.get("pools", []):
+        if not pool.get("enabled", True): continue
+        yield f"<virtual-mta-pool {pool['name']}>"
+        for member in pool.get("vmtas", []):
+            name = index.get(member)
+            if name is None:
+                name = _strip_prefix(member, "vmta-")
+            yield f"    virtual-mta {name}"
+        yield "</virtual-mta-pool>"
+        yield ""
+
+    # 4. Sources
+    yield "# Sources"
+    for source in config_json.get("sources", []):
+        if not source.get("enabled", True): continue
+        yield f"<source {source['name']}>"
+        if source.get("alwaysAllowRelaying"): yield "    always-allow-relaying yes"
+        if source.get("smtpService"): yield "    smtp-service yes"
+        if source.get("requireAuth"): yield "    require-auth true"
+        if source.get("addDateHeader"): yield "    add-date-header yes"
+        if source.get("defaultVMTA"):
+            yield f"    default-virtual-mta {resolve_vmta_ref(source['defaultVMTA'], index)}"
+        if source.get("maxConnections"):
+            yield f"    max-connect-rate {source['maxConnections']}/min" # specific rate limit
+        yield "</source>"
+        yield ""
+
+    # 5. Users
+    yield "# SMTP Users"
+    for user in config_json.get("users", []):
+        if not user.get("enabled", True): continue
+        yield f"<smtp-user {user['username']}>"
+        if user.get("password"): yield f"    password {user['password']}"
+        if user.get("source"): yield f"    source {user['source']}"
+        if user.get("maxMessagesPerHour"): yield f"    max-msg-rate {user['maxMessagesPerHour']}/hour"
+        yield "</smtp-user>"
+        yield ""
+
+    # 6. Bounce Rules. Format: /pattern/  category
+    if config_json.get("bounceRules"):
+        yield "# Bounce Rules"
+        yield "<bounce-category-patterns>"
+        for rule in config_json.get("bounceRules", []):
+            if not rule.get("enabled", True): continue
+            cat = rule.get("category") or _BOUNCE_TYPE_CATEGORY.get(rule.get("type"), "soft-bounce")
+            yield f"    /{rule['pattern']}/    {cat}"
+        yield "</bounce-category-patterns>"
+        yield ""
+
+
+def build_config(config_json: Dict[str, Any]) -> str:
+    return "\n".join(iter_config_lines(config_json))
+
+
+def write_config(config_json: Dict[str, Any], writer: Any, chunk_chars: int = DEFAULT_CHUNK_CHARS) -> int:
+    """
+    Streams the config to writer.write() in ~chunk_chars pieces (same bytes as build_config).
+    Returns the number of characters written.
+    """
+    buf = []
+    size = 0
+    total = 0
+    first = True
+    for line in iter_config_lines(config_json):
+        piece = line if first else "\n" + line
+        first = False
+        buf.append(piece)
+        size += len(piece)
+        if size >= chunk_chars:
+            writer.write("".join(buf))
+            total += size
+            buf, size = [], 0
+    if buf:
+        writer.write("".join(buf))
+        total += size
+    return total
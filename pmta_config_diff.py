@@ -0,0 +1,161 @@
+"""
+Structural diff of two PMTA configs and what it takes to make PMTA pick it up.
+
+Configs are compared as trees (see pmta_config_ast), not as text: blocks are
+matched by tag and argument (<virtual-mta vmta1>, <domain gmail.com>, ...),
+directives by key, and comments, blank lines, indentation and the order of
+blocks are ignored. Pattern lists are the exception: PMTA applies their rules
+first match wins, so their directives are also compared in order. The result
+lists blocks added, removed and modified (with the directive-level changes
+inside them) plus changed top-level directives.
+
+Most settings take effect on `pmta reload`. Listeners, the management port, the
+spool and the process user are only read at startup, so changing them needs a
+restart, which drops every open connection; classify() tells the two apart.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+import pmta_config_ast
+
+NONE = "none"
+RELOAD = "reload"
+RESTART = "restart"
+
+# Top-level directives PMTA reads only at startup
+RESTART_DIRECTIVES = frozenset({
+    "smtp-listener",
+    "http-mgmt-port",
+    "run-as-root",
+    "spool",
+})
+
+# Blocks whose addition, removal or change needs a restart
+RESTART_BLOCKS = frozenset({"spool"})
+
+# Blocks whose rules are evaluated in order: reordering them changes behaviour
+ORDERED_BLOCKS = frozenset({"pattern-list", "smtp-pattern-list", "bounce-category-patterns"})
+
+BlockKey = Tuple[str, str]
+
+
+def _norm(value: str) -> str:
+    return " ".join(value.split())
+
+
+def _label(key: BlockKey) -> str:
+    tag, arg = key
+    return f"<{tag} {arg}>" if arg else f"<{tag}>"
+
+
+def _children(block: "pmta_config_ast.Block") -> Tuple[Dict[str, List[str]], Dict[BlockKey, "pmta_config_ast.Block"]]:
+    """Directive values by key (in order) and nested blocks by (tag, arg); first duplicate block wins."""
+    directives: Dict[str, List[str]] = {}
+    blocks: Dict[BlockKey, pmta_config_ast.Block] = {}
+    for child in block.children:
+        if isinstance(child, pmta_config_ast.Block):
+            blocks.setdefault((child.tag, _norm(child.arg)), child)
+        elif isinstance(child, pmta_config_ast.Directive):
+            directives.setdefault(child.key.lower(), []).append(_norm(child.value))
+    return directives, blocks
+
+
+def _ordered_rules(block: "pmta_config_ast.Block") -> List[str]:
+    return [f"{child.key.lower()} {_norm(child.value)}" for child in block.children
+            if isinstance(child, pmta_config_ast.Directive)]
+
+
+def _directive_changes(old: Dict[str, List[str]], new: Dict[str, List[str]], prefix: str = "") -> List[Dict[str, Any]]:
+    changes = []
+    for key in sorted(set(old) | set(new)):
+        before, after = old.get(key, []), new.get(key, [])
+        if before == after:
+            continue
+        changes.append({
+            "key": prefix + key,
+            # Single values are shown as strings, repeated directives as lists
+            "old": (before[0] if len(before) == 1 else before) if before else None,
+            "new": (after[0] if len(after) == 1 else after) if after else None,
+        })
+    return changes
+
+
+def _block_changes(old: "pmta_config_ast.Block", new: "pmta_config_ast.Block", prefix: str = "") -> List[Dict[str, Any]]:
+    """Directive changes inside a block, recursing into nested blocks (keys prefixed with their path)."""
+    old_dirs, old_blocks = _children(old)
+    new_dirs, new_blocks = _children(new)
+    changes = _directive_changes(old_dirs, new_dirs, prefix)
+    if not changes and new.tag.lower() in ORDERED_BLOCKS:
+        old_rules, new_rules = _ordered_rules(old), _ordered_rules(new)
+        if old_rules != new_rules:
+            changes.append({"key": prefix + "(rule order)", "old": old_rules, "new": new_rules})
+    for key in sorted(set(old_blocks) | set(new_blocks)):
+        path = f"{prefix}{_label(key)}/"
+        if key not in new_blocks:
+            changes.append({"key": path.rstrip("/"), "old": "present", "new": None})
+        elif key not in old_blocks:
+            changes.append({"key": path.rstrip("/"), "old": None, "new": "present"})
+        else:
+            changes.extend(_block_changes(old_blocks[key], new_blocks[key], path))
+    return changes
+
+
+def structural_diff(old: Any, new: Any) -> Dict[str, Any]:
+    """
+    Diff of two configs (text or parsed Config):
+      {"added": [{tag, name}], "removed": [{tag, name}],
+       "modified": [{tag, name, changes: [{key, old, new}]}],
+       "globals": [{key, old, new}], "identical": bool}
+    """
+    old_tree = pmta_config_ast.parse(old) if isinstance(old, str) else old
+    new_tree = pmta_config_ast.parse(new) if isinstance(new, str) else new
+    old_dirs, old_blocks = _children(old_tree)
+    new_dirs, new_blocks = _children(new_tree)
+
+    added, removed, modified = [], [], []
+    for key in old_blocks:
+        if key not in new_blocks:
+            removed.append({"tag": key[0], "name": key[1]})
+    for key, block in new_blocks.items():
+        if key not in old_blocks:
+            added.append({"tag": key[0], "name": key[1]})
+            continue
+        changes = _block_changes(old_blocks[key], block)
+        if changes:
+            modified.append({"tag": key[0], "name": key[1], "changes": changes})
+
+    globals_ = _directive_changes(old_dirs, new_dirs)
+    return {
+        "added": added,
+        "removed": removed,
+        "modified": modified,
+        "globals": globals_,
+        "identical": not (added or removed or modified or globals_),
+    }
+
+
+def classify(diff: Dict[str, Any]) -> Dict[str, Any]:
+    """{"action": none|reload|restart, "reasons": [...]} for a structural_diff() result."""
+    if diff["identical"]:
+        return {"action": NONE, "reasons": []}
+    reasons = [f"{c['key']} changed" for c in diff["globals"] if c["key"] in RESTART_DIRECTIVES]
+    for kind in ("added", "removed", "modified"):
+        for block in diff[kind]:
+            if block["tag"] in RESTART_BLOCKS:
+                reasons.append(f"{_label((block['tag'], block['name']))} {kind}")
+    return {"action": RESTART if reasons else RELOAD, "reasons": reasons}
+
+
+def summary(diff: Dict[str, Any]) -> Dict[str, int]:
+    return {
+        "added": len(diff["added"]),
+        "removed": len(diff["removed"]),
+        "modified": len(diff["modified"]),
+        "globals": len(diff["globals"]),
+    }
+
+
+def apply_mode(classification: Dict[str, Any], force_restart: Optional[bool] = False) -> str:
+    """pmta_apply mode for a classification: restart only when required (or forced)."""
+    if force_restart or classification["action"] == RESTART:
+        return "restart"
+    return "reload" if classification["action"] == RELOAD else "none"
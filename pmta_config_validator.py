@@ -0,0 +1,190 @@
+"""
+Local semantic validation of PMTA configs, run before anything is uploaded.
+
+Works on a pmta_config_ast tree and reports every problem with its source
+line, so the UI can point at the offending directive:
+
+  - structural errors (unclosed / stray closing tags)
+  - duplicate VMTA, pool, source, smtp-user and pattern-list names
+  - dangling references (pool members, default-virtual-mta, smtp-user source,
+    pattern-list virtual-mta=)
+  - smtp-source-host IPs that are malformed or not bound on the server
+  - malformed rates (max-msg-rate 100/10m) and durations (retry-after 30m)
+  - domain-key entries that are malformed or point to keys not provisioned
+  - routing directives inside <domain> blocks (routing belongs to sources/patterns)
+
+Checks that need server facts (IPs, DKIM key files) only run when those facts
+are passed in; nothing here touches the network.
+"""
+import ipaddress
+import re
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import pmta_config_ast
+
+ERROR = "error"
+WARNING = "warning"
+
+# Block tags whose argument must be unique across the config
+_UNIQUE_TAGS = ("virtual-mta", "virtual-mta-pool", "source", "smtp-user", "pattern-list", "smtp-pattern-list")
+
+_RATE_RE = re.compile(r"^(unlimited|\d+|\d+/(\d+)?(s|sec|m|min|h|hr|hour|d|day))$", re.IGNORECASE)
+# A bare number of seconds, or one or more N<unit> groups (PMTA's own default is "4d12h")
+_DURATION_RE = re.compile(r"^(\d+|(\d+[smhdw])+)$", re.IGNORECASE)
+_DURATION_KEYS = ("retry-after", "bounce-after", "smtp-data-termination-timeout", "idle-timeout")
+
+_FORBIDDEN_DOMAIN_DIRECTIVES = ("use-virtual-mta", "use-virtual-mta-pool", "source-ip")
+
+_VMTA_SELECTOR_RE = re.compile(r"\bvirtual-mta=([^\s,]+)")
+
+PLACEHOLDER_DOMAINS = ("myplatform.com",)
+
+
+def _issue(issues: List[Dict[str, Any]], severity: str, code: str, line: Optional[int], message: str) -> None:
+    issues.append({"severity": severity, "code": code, "line": line, "message": message})
+
+
+def validate_config(
+    config: Any,
+    server_ips: Optional[Iterable[str]] = None,
+    dkim_paths: Optional[Iterable[str]] = None,
+    external_names: Optional[Iterable[str]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Validates a config (text or pmta_config_ast.Config).
+
+    server_ips      IPs bound on the target server; enables the IP ownership check.
+    dkim_paths      DKIM private key paths present on the server; enables the key check.
+    external_names  VMTA/pool names defined outside this text (e.g. when validating a
+                    fragment that will be appended to an existing config).
+    """
+    tree = pmta_config_ast.parse(config) if isinstance(config, str) else config
+    issues: List[Dict[str, Any]] = []
+
+    for err in tree.errors:
+        _issue(issues, ERROR, "syntax", err["line"], err["message"])
+
+    seen: Dict[str, Dict[str, int]] = {tag: {} for tag in _UNIQUE_TAGS}
+    vmta_names: Set[str] = set(external_names or ())
+    source_names: Set[str] = set()
+    ip_owner: Dict[str, str] = {}
+    owned_ips = set(server_ips) if server_ips is not None else None
+    known_keys = set(dkim_paths) if dkim_paths is not None else None
+    references = []  # (name, line, what)
+
+    for block in tree.walk():
+        name = block.arg.strip()
+
+        if block.tag in seen:
+            first = seen[block.tag].get(name)
+            if first is not None:
+                _issue(issues, ERROR, "duplicate", block.line,
+                       f"Duplicate <{block.tag} {name}> (first defined on line {first})")
+            else:
+                seen[block.tag][name] = block.line
+
+        for placeholder in PLACEHOLDER_DOMAINS:
+            if placeholder in name:
+                _issue(issues, ERROR, "placeholder", block.line, f"<{block.tag} {name}>: placeholder domain '{placeholder}' found")
+
+        if block.tag in ("virtual-mta", "virtual-mta-pool"):
+            vmta_names.add(name)
+        elif block.tag == "source":
+            source_names.add(name)
+
+        if block.tag == "virtual-mta":
+            host = block.get("smtp-source-host")
+            if host is None:
+                _issue(issues, WARNING, "missing-source-host", block.line,
+                       f"VMTA '{name}' has no smtp-source-host")
+            else:
+                ip = host.split()[0] if host.split() else ""
+                try:
+                    ipaddress.ip_address(ip)
+                except ValueError:
+                    _issue(issues, ERROR, "bad-ip", block.line, f"VMTA '{name}': invalid smtp-source-host IP '{ip}'")
+                else:
+                    if owned_ips is not None and ip not in owned_ips:
+                        _issue(issues, ERROR, "ip-not-owned", block.line,
+                               f"VMTA '{name}': IP {ip} is not bound on this server")
+                    if ip in ip_owner:
+                        _issue(issues, WARNING, "shared-ip", block.line,
+                               f"VMTA '{name}' uses IP {ip} already used by VMTA '{ip_owner[ip]}'")
+                    else:
+                        ip_owner[ip] = name
+
+        elif block.tag == "virtual-mta-pool":
+            for d in block.directives("virtual-mta"):
+                if d.value.split():
+                    references.append((d.value.split()[0], d.line, f"pool '{name}'"))
+
+        elif block.tag == "source":
+            ref = block.get("default-virtual-mta")
+            if ref:
+                references.append((ref.split()[0], _line_of(block, "default-virtual-mta"), f"source '{name}'"))
+
+        elif block.tag == "domain":
+            for d in block.directives():
+                if d.key in _FORBIDDEN_DOMAIN_DIRECTIVES:
+                    _issue(issues, ERROR, "domain-routing", d.line,
+                           f"Routing directive '{d.key}' is not allowed in <domain {name}>")
+
+        elif block.tag == "pattern-list":
+            for d in block.directives():
+                for ref in _VMTA_SELECTOR_RE.findall(d.value):
+                    references.append((ref, d.line, f"pattern-list '{name}'"))
+
+        for d in block.directives():
+            _check_value(issues, block, d, known_keys)
+
+    for d in tree.directives():
+        _check_value(issues, tree, d, known_keys)
+
+    for ref, line, owner in references:
+        if ref not in vmta_names:
+            _issue(issues, ERROR, "dangling-ref", line, f"{owner} references unknown VMTA or pool '{ref}'")
+
+    for block in tree.walk("smtp-user"):
+        ref = block.get("source")
+        if ref and ref not in source_names:
+            _issue(issues, ERROR, "dangling-ref", _line_of(block, "source"),
+                   f"smtp-user '{block.arg.strip()}' references unknown source '{ref}'")
+
+    issues.sort(key=lambda i: (i["line"] or 0))
+    return issues
+
+
+def _line_of(block: "pmta_config_ast.Block", key: str) -> int:
+    for d in block.directives(key):
+        return d.line
+    return block.line
+
+
+def _check_value(issues: List[Dict[str, Any]], block: Any, d: Any, known_keys: Optional[Set[str]]) -> None:
+    where = f"<{block.tag} {block.arg.strip()}>" if block.tag else "global settings"
+
+    if d.key.endswith("-rate"):
+        if not _RATE_RE.match(d.value.strip()):
+            _issue(issues, ERROR, "bad-rate", d.line, f"{where}: malformed rate '{d.key} {d.value}' (expected N/unit, e.g. 100/10m)")
+    elif d.key in _DURATION_KEYS:
+        if not _DURATION_RE.match(d.value.strip()):
+            _issue(issues, ERROR, "bad-duration", d.line, f"{where}: malformed duration '{d.key} {d.value}'")
+    elif d.key == "domain-key":
+        parts = [p.strip() for p in d.value.split(",")]
+        if len(parts) != 3 or not all(parts):
+            _issue(issues, ERROR, "bad-domain-key", d.line, f"{where}: domain-key must be 'selector,domain,/path/to/key'")
+        elif known_keys is not None and parts[2] not in known_keys:
+            _issue(issues, ERROR, "dkim-missing", d.line, f"{where}: DKIM key {parts[2]} is not provisioned on the server")
+
+    for placeholder in PLACEHOLDER_DOMAINS:
+        if placeholder in d.value:
+            _issue(issues, ERROR, "placeholder", d.line, f"{where}: placeholder domain '{placeholder}' found")
+
+
+def has_errors(issues: List[Dict[str, Any]]) -> bool:
+    return any(i["severity"] == ERROR for i in issues)
+
+
+def format_issue(issue: Dict[str, Any]) -> str:
+    line = f"line {issue['line']}: " if issue.get("line") else ""
+    return f"{line}{issue['message']}"
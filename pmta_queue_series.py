@@ -0,0 +1,127 @@
+"""
+Queue depth time series sampled from PMTA's management port.
+
+Every sample is stored as a handful of rows per server:
+
+  scope "server"  totals: queued recipients / KB, outbound connections, spool files
+  scope "domain"  one row per receiving domain (summed over its VMTA queues)
+  scope "vmta"    one row per VMTA (summed over its domain queues)
+
+Rows live in a fixed ring of slots: a sample taken at `ts` goes to slot
+(ts // resolution) % slots and replaces whatever the slot held one lap ago, so
+the table never grows past servers x slots x rows-per-sample and needs no
+separate pruning pass. Only the busiest domains are kept per sample to bound
+that last factor.
+
+Threshold checks run on the rows of the newest sample and return alert dicts;
+sending them (and rate-limiting repeats) is up to the caller.
+"""
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+
+DEFAULT_RESOLUTION = 60            # seconds per slot
+DEFAULT_RETENTION = 48 * 3600      # seconds of history kept
+MAX_DOMAINS_PER_SAMPLE = 200
+
+SCOPES = ("server", "domain", "vmta")
+
+# Server-wide paths in the flattened /status page (see pmta_stats.parse_status)
+_STATUS_FIELDS = {
+    "recipients": ("status.queue.smtp.rcp", "queue.smtp.rcp"),
+    "kb": ("status.queue.smtp.kb", "queue.smtp.kb"),
+    "connections": ("status.conn.smtpout.cur", "status.conn.smtpout", "conn.smtpout.cur", "conn.smtpout"),
+    "spool_files": ("status.spool.files.total", "status.spool.files", "spool.files.total", "spool.files"),
+}
+
+
+def ring_slots(resolution: int = DEFAULT_RESOLUTION, retention: int = DEFAULT_RETENTION) -> int:
+    return max(1, -(-retention // resolution))
+
+
+def bucket_of(ts: float, resolution: int = DEFAULT_RESOLUTION) -> int:
+    ts = int(ts)
+    return ts - ts % resolution
+
+
+def slot_of(ts: float, resolution: int = DEFAULT_RESOLUTION, slots: int = ring_slots()) -> int:
+    return (int(ts) // resolution) % slots
+
+
+def _status_value(status: Dict[str, Any], field: str) -> Optional[float]:
+    for path in _STATUS_FIELDS[field]:
+        value = status.get(path)
+        if isinstance(value, (int, float)):
+            return value
+    return None
+
+
+def build_rows(stats: Dict[str, Any], max_domains: int = MAX_DOMAINS_PER_SAMPLE) -> List[Dict[str, Any]]:
+    """
+    Sample rows ({scope, name, recipients, kb, connections, backoff, spool_files})
+    from pmta_stats.fetch_live_stats() output.
+    """
+    queues = stats.get("queues") or []
+    domains: Dict[str, Dict[str, Any]] = defaultdict(lambda: {"recipients": 0, "kb": 0, "connections": 0, "backoff": False})
+    vmtas: Dict[str, Dict[str, Any]] = defaultdict(lambda: {"recipients": 0, "kb": 0, "connections": 0, "backoff": False})
+    for q in queues:
+        for table, key in ((domains, q["domain"]), (vmtas, q["vmta"])):
+            agg = table[key]
+            agg["recipients"] += q["recipients"]
+            agg["kb"] += q["kb"]
+            agg["connections"] += q["connections"]
+            agg["backoff"] = agg["backoff"] or q["backoff"]
+
+    status = stats.get("status") or {}
+    server = {
+        "recipients": _status_value(status, "recipients"),
+        "kb": _status_value(status, "kb"),
+        "connections": _status_value(status, "connections"),
+        "backoff": any(d["backoff"] for d in domains.values()),
+        "spool_files": _status_value(status, "spool_files"),
+    }
+    # Older PMTA versions leave the totals out of /status; sum the queues instead
+    for field in ("recipients", "kb", "connections"):
+        if server[field] is None:
+            server[field] = sum(d[field] for d in domains.values())
+
+    rows = [{"scope": "server", "name": "", **server}]
+    busiest = sorted(domains.items(), key=lambda kv: (-kv[1]["recipients"], kv[0]))[:max_domains]
+    rows.extend({"scope": "domain", "name": name, "spool_files": None, **agg} for name, agg in busiest)
+    rows.extend({"scope": "vmta", "name": name, "spool_files": None, **agg} for name, agg in sorted(vmtas.items()) if name)
+    return rows
+
+
+def check_thresholds(rows: Iterable[Dict[str, Any]], thresholds: Dict[str, int]) -> List[Dict[str, Any]]:
+    """
+    Alerts for one sample. thresholds (0 or missing disables a check):
+      total_recipients   server-wide queued recipients
+      domain_recipients  queued recipients for a single receiving domain
+      backoff_recipients queued recipients for a domain that is in backoff mode
+    Each alert is {key, scope, name, metric, value, threshold}; `key` identifies
+    the condition for de-duplication across samples.
+    """
+    alerts: List[Dict[str, Any]] = []
+
+    def add(row: Dict[str, Any], metric: str, limit: int) -> None:
+        alerts.append({
+            "key": f"{metric}:{row['name']}",
+            "scope": row["scope"],
+            "name": row["name"],
+            "metric": metric,
+            "value": row["recipients"],
+            "threshold": limit,
+        })
+
+    total_limit = thresholds.get("total_recipients") or 0
+    domain_limit = thresholds.get("domain_recipients") or 0
+    backoff_limit = thresholds.get("backoff_recipients") or 0
+    for row in rows:
+        value = row.get("recipients") or 0
+        if row["scope"] == "server" and total_limit and value >= total_limit:
+            add(row, "total_recipients", total_limit)
+        elif row["scope"] == "domain":
+            if domain_limit and value >= domain_limit:
+                add(row, "domain_recipients", domain_limit)
+            if backoff_limit and row.get("backoff") and value >= backoff_limit:
+                add(row, "backoff_recipients", backoff_limit)
+    return alerts
@@ -0,0 +1,224 @@
+"""
+Live PMTA status from the HTTP management port (http-mgmt-port), read over SSH.
+
+Requests go through a direct-tcpip channel of the existing SSH connection to
+127.0.0.1:<port> on the server, so the management port never has to be exposed
+and no remote command is run. Responses are PMTA's XML pages:
+
+  /status?format=xml   server-wide totals (connections, queue, traffic)
+  /vmtas?format=xml    one <vmta> element per virtual MTA
+  /queues?format=xml   one <queue> element per receiving domain/VMTA queue
+
+Element layouts differ slightly between PMTA versions, so each <vmta> is
+flattened into dotted paths (conn.smtp.out, queue.smtp.rcp, ...) and fields
+are picked by the first known path present.
+
+StatsCache keeps results for a short TTL and lets only one caller per key
+refresh at a time, so a dashboard polling many VMTAs costs one fetch per TTL.
+"""
+import threading
+import time
+import xml.etree.ElementTree as ET
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+DEFAULT_HTTP_PORT = 8080
+DEFAULT_TIMEOUT = 5.0
+MAX_RESPONSE_BYTES = 32 * 1024 * 1024
+
+STATUS_PATH = "/status?format=xml"
+VMTAS_PATH = "/vmtas?format=xml"
+QUEUES_PATH = "/queues?format=xml"
+
+# Output field -> candidate flattened paths (lower-case), first match wins
+_VMTA_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "connections": ("conn.smtp.out", "conn.smtpout", "connections.smtp.out", "conn.out", "conn"),
+    "queued_recipients": ("queue.smtp.rcp", "queue.rcp", "queue.smtp.recipients", "rcp"),
+    "queued_domains": ("queue.smtp.dom", "queue.dom", "dom"),
+    "queued_kb": ("queue.smtp.kb", "queue.kb", "kb"),
+    "paused": ("paused", "status.paused"),
+}
+
+_QUEUE_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "recipients": ("rcp", "queue.rcp", "queue.smtp.rcp"),
+    "kb": ("kb", "queue.kb", "queue.smtp.kb"),
+    "connections": ("conn", "conn.cur", "connections"),
+    "mode": ("mode", "status.mode"),
+    "paused": ("paused", "status.paused"),
+}
+
+
+class StatsError(Exception):
+    pass
+
+
+def http_get(ssh: Any, path: str, port: int = DEFAULT_HTTP_PORT, timeout: float = DEFAULT_TIMEOUT) -> bytes:
+    """GET http://127.0.0.1:<port><path> on the server through the SSH transport; returns the body."""
+    transport = ssh.get_transport()
+    if transport is None or not transport.is_active():
+        raise StatsError("SSH transport is not active")
+    try:
+        channel = transport.open_channel("direct-tcpip", ("127.0.0.1", port), ("127.0.0.1", 0), timeout=timeout)
+    except Exception as e:
+        raise StatsError(f"PMTA management port {port} unreachable: {e}")
+    try:
+        channel.settimeout(timeout)
+        channel.sendall(f"GET {path} HTTP/1.0\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n".encode("ascii"))
+        chunks, size = [], 0
+        while True:
+            data = channel.recv(65536)
+            if not data:
+                break
+            chunks.append(data)
+            size += len(data)
+            if size > MAX_RESPONSE_BYTES:
+                raise StatsError("PMTA response too large")
+    except StatsError:
+        raise
+    except Exception as e:
+        raise StatsError(f"PMTA management request failed: {e}")
+    finally:
+        channel.close()
+
+    raw = b"".join(chunks)
+    head, sep, body = raw.partition(b"\r\n\r\n")
+    if not sep:
+        raise StatsError("Malformed HTTP response from PMTA")
+    status_line = head.split(b"\r\n", 1)[0].decode("latin-1")
+    parts = status_line.split()
+    if len(parts) < 2 or parts[1] != "200":
+        raise StatsError(f"PMTA returned '{status_line}' for {path}")
+    return body
+
+
+def flatten(elem: "ET.Element", prefix: str = "") -> Dict[str, str]:
+    """Leaf text of elem's descendants keyed by lower-case dotted path."""
+    out: Dict[str, str] = {}
+    for child in elem:
+        key = f"{prefix}{child.tag.lower()}"
+        if len(child):
+            out.update(flatten(child, key + "."))
+        else:
+            out.setdefault(key, (child.text or "").strip())
+    return out
+
+
+def _number(value: Optional[str]) -> Optional[float]:
+    if value is None or value == "":
+        return None
+    try:
+        n = float(value)
+    except ValueError:
+        return None
+    return int(n) if n.is_integer() else n
+
+
+def parse_vmtas(xml_bytes: bytes) -> Dict[str, Dict[str, Any]]:
+    """{vmta name: {connections, queued_recipients, queued_domains, queued_kb, paused}} from /vmtas XML."""
+    try:
+        root = ET.fromstring(xml_bytes)
+    except ET.ParseError as e:
+        raise StatsError(f"Invalid XML from PMTA: {e}")
+    result: Dict[str, Dict[str, Any]] = {}
+    for elem in root.iter():
+        if elem.tag.lower() not in ("vmta", "virtualmta"):
+            continue
+        flat = flatten(elem)
+        name = flat.get("name") or elem.get("name")
+        if not name:
+            continue
+        stats: Dict[str, Any] = {}
+        for field, paths in _VMTA_FIELDS.items():
+            raw = next((flat[p] for p in paths if p in flat), None)
+            if field == "paused":
+                stats[field] = (raw or "").lower() in ("yes", "true", "1")
+            else:
+                stats[field] = _number(raw)
+        result[name] = stats
+    return result
+
+
+def parse_queues(xml_bytes: bytes) -> List[Dict[str, Any]]:
+    """[{domain, vmta, recipients, kb, connections, backoff, paused}] from /queues XML ("domain/vmta" names)."""
+    try:
+        root = ET.fromstring(xml_bytes)
+    except ET.ParseError as e:
+        raise StatsError(f"Invalid XML from PMTA: {e}")
+    result: List[Dict[str, Any]] = []
+    for elem in root.iter():
+        if elem.tag.lower() != "queue":
+            continue
+        flat = flatten(elem)
+        name = flat.get("name") or elem.get("name")
+        if not name:
+            continue
+        domain, _, vmta = name.partition("/")
+        raw = {field: next((flat[p] for p in paths if p in flat), None) for field, paths in _QUEUE_FIELDS.items()}
+        result.append({
+            "domain": domain.lower(),
+            "vmta": vmta,
+            "recipients": _number(raw["recipients"]) or 0,
+            "kb": _number(raw["kb"]) or 0,
+            "connections": _number(raw["connections"]) or 0,
+            "backoff": (raw["mode"] or "").lower() == "backoff",
+            "paused": (raw["paused"] or "").lower() in ("yes", "true", "1"),
+        })
+    return result
+
+
+def parse_status(xml_bytes: bytes) -> Dict[str, Any]:
+    """Flattened /status page (numeric values converted), e.g. {"queue.smtp.rcp": 120, "version": "..."}."""
+    try:
+        root = ET.fromstring(xml_bytes)
+    except ET.ParseError as e:
+        raise StatsError(f"Invalid XML from PMTA: {e}")
+    data = root.find("data")
+    flat = flatten(data if data is not None else root)
+    return {k: (_number(v) if _number(v) is not None else v) for k, v in flat.items()}
+
+
+def fetch_live_stats(ssh: Any, port: int = DEFAULT_HTTP_PORT, timeout: float = DEFAULT_TIMEOUT) -> Dict[str, Any]:
+    """Status, per-VMTA and per-queue stats in three requests over one SSH connection."""
+    t0 = time.time()
+    status = parse_status(http_get(ssh, STATUS_PATH, port, timeout))
+    vmtas = parse_vmtas(http_get(ssh, VMTAS_PATH, port, timeout))
+    queues = parse_queues(http_get(ssh, QUEUES_PATH, port, timeout))
+    return {
+        "status": status,
+        "vmtas": vmtas,
+        "queues": queues,
+        "fetched_at": time.time(),
+        "fetch_ms": round((time.time() - t0) * 1000, 1),
+    }
+
+
+class StatsCache:
+    """TTL cache with one in-flight refresh per key (other callers wait for it)."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: Dict[Any, Tuple[float, Any]] = {}
+        self._locks: Dict[Any, threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    def get(self, key: Any, loader: Callable[[], Any], refresh: bool = False) -> Tuple[Any, float]:
+        """(value, age in seconds). Exceptions from loader propagate and are not cached."""
+        entry = self._entries.get(key)
+        if entry and not refresh and time.time() - entry[0] < self.ttl:
+            return entry[1], time.time() - entry[0]
+        with self._guard:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            # Another caller may have refreshed while we waited
+            entry = self._entries.get(key)
+            if entry and time.time() - entry[0] < (0.5 if refresh else self.ttl):
+                return entry[1], time.time() - entry[0]
+            value = loader()
+            self._entries[key] = (time.time(), value)
+            return value, 0.0
+
+    def peek(self, key: Any) -> Optional[Tuple[Any, float]]:
+        entry = self._entries.get(key)
+        return (entry[1], time.time() - entry[0]) if entry else None
+
+    def invalidate(self, key: Any) -> None:
+        self._entries.pop(key, None)
@@ -0,0 +1,213 @@
+"""
+PMTA tuning profile derived from the server's resources and VMTA count.
+
+The profile holds the handful of values that decide how hard PMTA pushes the
+box. The install template and the builder used to hardcode them:
+
+  total_max_smtp_in     global total-max-smtp-in (inbound injection connections)
+  domain_max_smtp_out   <domain *> max-smtp-out (connections per domain queue)
+  domain_max_msg_rate   <domain *> max-msg-rate (messages per domain queue)
+  isp_max_smtp_out      max-smtp-out of the $gmail / $yahoo domain blocks (optional)
+
+Capacity model: outbound connection capacity is bounded by cores
+(CONN_PER_CORE) and by memory left after PMTA's own footprint
+(RAM_MB_PER_CONN). It is shared by every VMTA, each of which is assumed to
+have ASSUMED_BUSY_DOMAINS queues active at once. Every value is clamped to
+LIMITS, so a tiny VPS still gets a working config and a big box never opens
+unbounded connections.
+
+domain_max_msg_rate is not derived: the template's 1/m is the warm-up
+throttle for fresh IPs, and the box's capacity says nothing about what
+receivers accept from them. It stays at FALLBACK unless the operator
+overrides it, and re-tuning leaves an existing rate alone unless overridden.
+
+isp_max_smtp_out is not derived either. The ISP blocks carry no max-smtp-out
+and inherit the <domain *> one, so a big box is not throttled on the
+receivers that matter most. An operator override adds the cap, bounded by
+domain_max_smtp_out.
+
+Without resource data FALLBACK is used: the values the install template
+hardcoded before profiles existed. Operator overrides always win over
+derived values.
+"""
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import pmta_config_ast
+
+CONN_PER_CORE = 1000
+RAM_MB_PER_CONN = 0.5
+PMTA_BASE_RAM_MB = 512
+ASSUMED_BUSY_DOMAINS = 4
+INJECT_CONN_PER_CORE = 250
+
+LIMITS: Dict[str, Tuple[int, int]] = {
+    "total_max_smtp_in": (100, 5000),
+    "domain_max_smtp_out": (5, 300),
+    "domain_max_msg_rate": (60, 20000),   # per hour
+}
+
+# Values shipped before profiles existed; also used when resources are unknown
+FALLBACK: Dict[str, Any] = {
+    "total_max_smtp_in": 3000,
+    "domain_max_smtp_out": 300,
+    "domain_max_msg_rate": 60,
+    "isp_max_smtp_out": None,   # no cap: inherit <domain *>
+}
+
+# Template placeholder -> profile key
+PLACEHOLDERS: Dict[str, str] = {
+    "{{TOTAL_MAX_SMTP_IN}}": "total_max_smtp_in",
+    "{{DEFAULT_MAX_SMTP_OUT}}": "domain_max_smtp_out",
+    "{{DEFAULT_MAX_MSG_RATE}}": "domain_max_msg_rate",
+}
+# Whole-line placeholder: "    max-smtp-out N" when capped, removed otherwise
+ISP_PLACEHOLDER = "{{ISP_MAX_SMTP_OUT}}"
+
+ISP_DOMAIN_BLOCKS = ("$gmail", "$yahoo")
+
+_SIZE_RE = re.compile(r"^\s*([\d.]+)\s*([KMGTP]?)i?B?\s*$", re.IGNORECASE)
+_SIZE_MB = {"": 1 / (1024 * 1024), "K": 1 / 1024, "M": 1, "G": 1024, "T": 1024 ** 2, "P": 1024 ** 3}
+
+
+def size_to_mb(value: Any) -> Optional[int]:
+    """'20G' / '512M' / 1024 (MB) -> MB; None when unparseable."""
+    if isinstance(value, (int, float)):
+        return int(value)
+    m = _SIZE_RE.match(str(value or ""))
+    if not m:
+        return None
+    return int(float(m.group(1)) * _SIZE_MB[m.group(2).upper()])
+
+
+def _clamp(key: str, value: float) -> int:
+    low, high = LIMITS[key]
+    return int(max(low, min(high, value)))
+
+
+def format_rate(per_hour: int) -> str:
+    """PMTA rate string for a per-hour rate: per minute when exact (7200 -> '120/m'), else per hour."""
+    if per_hour % 60 == 0:
+        return f"{per_hour // 60}/m"
+    return f"{per_hour}/h"
+
+
+def derive_profile(resources: Optional[Dict[str, Any]], vmta_count: int) -> Dict[str, Any]:
+    """
+    Profile for a server. resources: {"cpu_cores", "ram_mb", "disk_available_mb"} (any may be None).
+    Returns {values..., "source": "derived"|"fallback", "notes": [...]}.
+    The per-domain message rate is always the FALLBACK warm-up rate, and the ISP
+    blocks are never capped (see the module docstring).
+    """
+    resources = resources or {}
+    cores = resources.get("cpu_cores")
+    ram_mb = size_to_mb(resources.get("ram_mb"))
+    vmtas = max(1, int(vmta_count or 0))
+    notes: List[str] = []
+
+    if not cores or not ram_mb:
+        notes.append("CPU or RAM unknown; using the default profile")
+        return {**FALLBACK, "source": "fallback", "notes": notes}
+
+    conn_capacity = min(cores * CONN_PER_CORE, max(0, ram_mb - PMTA_BASE_RAM_MB) / RAM_MB_PER_CONN)
+    queues = vmtas * ASSUMED_BUSY_DOMAINS
+    domain_out = _clamp("domain_max_smtp_out", conn_capacity / queues)
+    profile = {
+        "total_max_smtp_in": _clamp("total_max_smtp_in", cores * INJECT_CONN_PER_CORE),
+        "domain_max_smtp_out": domain_out,
+        "domain_max_msg_rate": FALLBACK["domain_max_msg_rate"],
+        "isp_max_smtp_out": None,
+    }
+
+    if ram_mb < 2048:
+        notes.append(f"Only {ram_mb} MB RAM; connection caps are memory bound")
+    disk_mb = size_to_mb(resources.get("disk_available_mb"))
+    if disk_mb is not None and disk_mb < 10 * 1024:
+        notes.append(f"Only {disk_mb} MB free for the spool; large queues may fill the disk")
+    return {**profile, "source": "derived", "notes": notes}
+
+
+def apply_overrides(profile: Dict[str, Any], overrides: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    (profile with operator overrides, errors). Unknown keys and non-positive integers
+    are errors. An isp_max_smtp_out override is bounded by domain_max_smtp_out.
+    """
+    result = dict(profile)
+    errors: List[str] = []
+    applied: Dict[str, int] = {}
+    if overrides is not None and not isinstance(overrides, dict):
+        result["overrides"] = applied
+        return result, ["tuning overrides must be an object of {key: integer}"]
+    for key, value in (overrides or {}).items():
+        if key not in FALLBACK:
+            errors.append(f"Unknown tuning key '{key}'")
+            continue
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            errors.append(f"{key} must be an integer")
+            continue
+        if value <= 0:
+            errors.append(f"{key} must be positive")
+            continue
+        result[key] = applied[key] = value
+    if result.get("isp_max_smtp_out") is not None:
+        result["isp_max_smtp_out"] = min(result["isp_max_smtp_out"], result["domain_max_smtp_out"])
+    result["overrides"] = applied
+    return result, errors
+
+
+def directive_values(profile: Dict[str, Any]) -> Dict[str, str]:
+    """Profile values rendered as PMTA directive values, keyed by profile key (None: not set)."""
+    isp_out = profile.get("isp_max_smtp_out")
+    return {
+        "total_max_smtp_in": str(profile["total_max_smtp_in"]),
+        "domain_max_smtp_out": str(profile["domain_max_smtp_out"]),
+        "domain_max_msg_rate": format_rate(profile["domain_max_msg_rate"]),
+        "isp_max_smtp_out": str(isp_out) if isp_out is not None else None,
+    }
+
+
+def render_template(script: str, profile: Dict[str, Any]) -> str:
+    """Fills the tuning placeholders of the install template."""
+    values = directive_values(profile)
+    for placeholder, key in PLACEHOLDERS.items():
+        script = script.replace(placeholder, values[key])
+    isp_line = f"    max-smtp-out {values['isp_max_smtp_out']}\n" if values["isp_max_smtp_out"] else ""
+    return script.replace(ISP_PLACEHOLDER + "\n", isp_line)
+
+
+def apply_to_config(tree: "pmta_config_ast.Config", profile: Dict[str, Any],
+                    overrides: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Re-tunes a parsed config in place: total-max-smtp-in, <domain *> and the ISP
+    domain blocks. Missing blocks are left alone (nothing is invented). The
+    <domain *> max-msg-rate is only written when missing or overridden, so a rate
+    raised during warm-up is kept; the ISP max-smtp-out only when the profile has
+    one (an override). Returns the changes.
+    """
+    values = directive_values(profile)
+    changes: List[Dict[str, Any]] = []
+
+    def set_value(block: "pmta_config_ast.Block", key: str, value: str, where: str) -> None:
+        old = block.get(key)
+        if old is not None and old.strip() == value:
+            return
+        if isinstance(block, pmta_config_ast.Config) and old is None:
+            block.append(pmta_config_ast.Directive(key, value))
+        else:
+            block.set(key, value)
+        changes.append({"where": where, "key": key, "old": old, "new": value})
+
+    set_value(tree, "total-max-smtp-in", values["total_max_smtp_in"], "global")
+    domains: Dict[str, "pmta_config_ast.Block"] = {}
+    for block in tree.blocks("domain"):  # top level only; <domain> inside a VMTA is VMTA-specific
+        domains.setdefault(block.arg.strip(), block)
+    if "*" in domains:
+        set_value(domains["*"], "max-smtp-out", values["domain_max_smtp_out"], "<domain *>")
+        if domains["*"].get("max-msg-rate") is None or "domain_max_msg_rate" in (overrides or {}):
+            set_value(domains["*"], "max-msg-rate", values["domain_max_msg_rate"], "<domain *>")
+    for name in ISP_DOMAIN_BLOCKS:
+        if name in domains and values["isp_max_smtp_out"] is not None:
+            set_value(domains[name], "max-smtp-out", values["isp_max_smtp_out"], f"<domain {name}>")
+    return changes
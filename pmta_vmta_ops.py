@@ -0,0 +1,380 @@
+"""
+Bulk VMTA operations on a parsed PMTA config (pmta_config_ast.Config).
+
+A batch is a list of operations applied in order to one tree, so thousands of
+VMTAs can be created, removed, re-pooled or re-keyed with a single render,
+validation and upload:
+
+  {"op": "create", "ips": "10.0.0.0/24", "domain": "example.com", "pool": "pool1"}
+  {"op": "delete", "select": {"ips": "10.0.0.128/25"}}
+  {"op": "move", "select": {"pattern": "vmta1*"}, "to_pool": "warmup", "from_pool": "pool1"}
+  {"op": "rotate_dkim", "select": {"domain": "example.com"}, "selector": "s202610"}
+
+Selectors combine (AND) any of: names (list), pattern (glob), ips (range, CIDR,
+single IP or list of those), domain, pool; {"all": true} selects every VMTA.
+Lookups go through indexes built once per batch, so cost is linear in the size
+of the config plus the number of affected VMTAs.
+"""
+import fnmatch
+import ipaddress
+import re
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import pmta_config_ast
+
+MAX_IPS_PER_OP = 65536
+
+DEFAULT_NAME_TEMPLATE = "vmta{n}"
+DEFAULT_HOST_TEMPLATE = "mail.{domain}"
+DEFAULT_DKIM_SELECTOR = "default"
+DEFAULT_KEY_PATH_TEMPLATE = "/etc/pmta/dkim/{domain}/{selector}.private"
+
+_NUMBERED_RE = re.compile(r"^vmta(\d+)$")
+_NAME_RE = re.compile(r"^[A-Za-z0-9][\w.-]*$")
+
+
+def _spec_items(spec: Any) -> List[str]:
+    items = spec if isinstance(spec, (list, tuple)) else str(spec or "").replace(",", " ").split()
+    items = [str(i).strip() for i in items if str(i).strip()]
+    if not items:
+        raise ValueError("No IPs given")
+    return items
+
+
+def _parse_range(item: str) -> List[Any]:
+    """Networks covering one range ("a-b"), CIDR or single IP."""
+    try:
+        if "-" in item:
+            start, end = (ipaddress.ip_address(p.strip()) for p in item.split("-", 1))
+            if int(start) > int(end):
+                start, end = end, start
+            return list(ipaddress.summarize_address_range(start, end))
+        return [ipaddress.ip_network(item, strict=False)]
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid IP range '{item}': {e}")
+
+
+def parse_ip_spec(spec: Any) -> List[Any]:
+    """IP networks for a range ("a-b"), CIDR, single IP, or a list of those."""
+    return [net for item in _spec_items(spec) for net in _parse_range(item)]
+
+
+def expand_ip_spec(spec: Any, limit: int = MAX_IPS_PER_OP) -> List[str]:
+    """
+    Individual addresses of an IP spec, in order. Ranges and single IPs are taken
+    as-is; CIDR blocks skip their network and broadcast addresses.
+    """
+    items = _spec_items(spec)
+    parsed = [(item, _parse_range(item)) for item in items]
+    if sum(net.num_addresses for _, nets in parsed for net in nets) > limit:
+        raise ValueError(f"IP range too large (more than {limit} addresses)")
+    ips = []
+    for item, nets in parsed:
+        for net in nets:
+            hosts = net.hosts() if "/" in item else net
+            ips.extend(str(ip) for ip in hosts)
+    return ips
+
+
+class VmtaIndex:
+    """Name, IP and pool-membership indexes over one config tree."""
+
+    def __init__(self, tree: "pmta_config_ast.Config"):
+        self.tree = tree
+        self.vmtas: Dict[str, pmta_config_ast.Block] = {}
+        self.pools: Dict[str, pmta_config_ast.Block] = {}
+        self.by_ip: Dict[str, str] = {}
+        self.next_number = 0
+        for block in tree.walk():
+            name = block.arg.strip()
+            if block.tag == "virtual-mta":
+                self.vmtas.setdefault(name, block)
+                ip = self.ip_of(block)
+                if ip:
+                    self.by_ip.setdefault(ip, name)
+                m = _NUMBERED_RE.match(name)
+                if m:
+                    self.next_number = max(self.next_number, int(m.group(1)) + 1)
+            elif block.tag == "virtual-mta-pool":
+                self.pools.setdefault(name, block)
+
+    @staticmethod
+    def ip_of(block: "pmta_config_ast.Block") -> Optional[str]:
+        host = (block.get("smtp-source-host") or "").split()
+        return host[0] if host else None
+
+    @staticmethod
+    def domain_of(block: "pmta_config_ast.Block") -> Optional[str]:
+        key = (block.get("domain-key") or "").split(",")
+        if len(key) == 3 and key[1].strip():
+            return key[1].strip()
+        host = (block.get("smtp-source-host") or "").split()
+        if len(host) > 1:
+            return host[1][5:] if host[1].startswith("mail.") else host[1]
+        return None
+
+    def members(self, pool: str) -> Set[str]:
+        block = self.pools.get(pool)
+        if block is None:
+            return set()
+        return {d.value.split()[0] for d in block.directives("virtual-mta") if d.value.split()}
+
+    def select(self, selector: Optional[Dict[str, Any]]) -> List[str]:
+        """VMTA names matching every criterion in selector (config order)."""
+        selector = selector or {}
+        criteria = {k for k, v in selector.items() if v not in (None, "", [])}
+        if not criteria:
+            raise ValueError("Empty selector (use {\"all\": true} to select every VMTA)")
+        unknown = criteria - {"all", "names", "pattern", "ips", "domain", "pool"}
+        if unknown:
+            raise ValueError(f"Unknown selector keys: {', '.join(sorted(unknown))}")
+
+        names: Iterable[str] = self.vmtas.keys()
+        if selector.get("names"):
+            wanted = set(selector["names"])
+            names = [n for n in names if n in wanted]
+        if selector.get("pattern"):
+            names = [n for n in names if fnmatch.fnmatchcase(n, selector["pattern"])]
+        if selector.get("pool"):
+            if selector["pool"] not in self.pools:
+                raise ValueError(f"Unknown pool '{selector['pool']}'")
+            in_pool = self.members(selector["pool"])
+            names = [n for n in names if n in in_pool]
+        if selector.get("ips"):
+            networks = parse_ip_spec(selector["ips"])
+            names = [n for n in names if _ip_in(self.ip_of(self.vmtas[n]), networks)]
+        if selector.get("domain"):
+            domain = selector["domain"].lower().rstrip(".")
+            names = [n for n in names if (self.domain_of(self.vmtas[n]) or "").lower() == domain]
+        return list(names)
+
+    def ensure_pool(self, name: str) -> "pmta_config_ast.Block":
+        block = self.pools.get(name)
+        if block is None:
+            if not _NAME_RE.match(name):
+                raise ValueError(f"Invalid pool name '{name}'")
+            if name in self.vmtas:
+                raise ValueError(f"'{name}' is already a VMTA name")
+            block = pmta_config_ast.Block("virtual-mta-pool", name)
+            self.tree.append(block)
+            self.pools[name] = block
+        return block
+
+
+def _ip_in(ip: Optional[str], networks: List[Any]) -> bool:
+    if not ip:
+        return False
+    try:
+        addr = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return any(addr in net for net in networks)
+
+
+def _domain_key(domain: str, selector: str, key_path: Optional[str]) -> str:
+    path = (key_path or DEFAULT_KEY_PATH_TEMPLATE).format(domain=domain, selector=selector)
+    return f"{selector},{domain},{path}"
+
+
+def _remove_members(index: VmtaIndex, names: Set[str], pools: Optional[Iterable[str]] = None) -> int:
+    """Drops `virtual-mta <name>` lines from the given pools (all pools by default)."""
+    removed = 0
+    for pool in (pools if pools is not None else list(index.pools)):
+        block = index.pools[pool]
+        kept = [c for c in block.children
+                if not (isinstance(c, pmta_config_ast.Directive) and c.key == "virtual-mta"
+                        and c.value.split() and c.value.split()[0] in names)]
+        removed += len(block.children) - len(kept)
+        block.children = kept
+    return removed
+
+
+def _add_members(index: VmtaIndex, pool: str, names: List[str]) -> int:
+    block = index.ensure_pool(pool)
+    present = index.members(pool)
+    added = 0
+    for name in names:
+        if name not in present:
+            block.children.append(pmta_config_ast.Directive("virtual-mta", name))
+            present.add(name)
+            added += 1
+    return added
+
+
+def _insert_vmtas(tree: "pmta_config_ast.Config", blocks: List["pmta_config_ast.Block"]) -> None:
+    """Places new VMTA blocks right after the last top-level VMTA (end of file if there is none)."""
+    if not blocks:
+        return
+    last = None
+    for i, child in enumerate(tree.children):
+        if isinstance(child, pmta_config_ast.Block) and child.tag == "virtual-mta":
+            last = i
+    if last is None:
+        for block in blocks:
+            tree.append(block)
+        return
+    nodes: List[Any] = []
+    for block in blocks:
+        nodes += [pmta_config_ast.Blank(), block]
+    tree.children[last + 1:last + 1] = nodes
+
+
+def op_create(index: VmtaIndex, op: Dict[str, Any]) -> Dict[str, Any]:
+    domain = (op.get("domain") or "").strip().lower().rstrip(".")
+    if not domain:
+        raise ValueError("'domain' is required")
+    name_template = op.get("name") or DEFAULT_NAME_TEMPLATE
+    host = (op.get("host") or DEFAULT_HOST_TEMPLATE).format(domain=domain)
+    dkim = op.get("dkim", True)
+    domain_key = None
+    if dkim:
+        dkim = dkim if isinstance(dkim, dict) else {}
+        domain_key = _domain_key(domain, dkim.get("selector") or DEFAULT_DKIM_SELECTOR, dkim.get("key_path"))
+
+    created, skipped, blocks = [], [], []
+    for ip in expand_ip_spec(op.get("ips")):
+        if ip in index.by_ip:
+            skipped.append({"ip": ip, "reason": f"already used by VMTA '{index.by_ip[ip]}'"})
+            continue
+        name = name_template.format(n=index.next_number, ip=ip, ip_dashed=ip.replace(".", "-").replace(":", "-"), domain=domain)
+        if not _NAME_RE.match(name):
+            raise ValueError(f"invalid VMTA name '{name}'")
+        if name in index.vmtas or name in index.pools:
+            raise ValueError(f"name '{name}' already exists (use {{n}} or {{ip_dashed}} in the name template)")
+        block = pmta_config_ast.Block("virtual-mta", name)
+        block.set("smtp-source-host", f"{ip} {host}")
+        if domain_key:
+            block.set("domain-key", domain_key)
+        if op.get("max_smtp_out"):
+            block.set("max-smtp-out", str(int(op["max_smtp_out"])))
+        blocks.append(block)
+        index.vmtas[name] = block
+        index.by_ip[ip] = name
+        index.next_number += 1
+        created.append(name)
+
+    _insert_vmtas(index.tree, blocks)
+    if op.get("pool") and created:
+        _add_members(index, op["pool"], created)
+    return {"created": len(created), "names": created, "skipped": skipped}
+
+
+def op_delete(index: VmtaIndex, op: Dict[str, Any]) -> Dict[str, Any]:
+    names = set(index.select(op.get("select")))
+    if not names:
+        return {"deleted": 0, "pool_members_removed": 0, "names": []}
+    blocks = {id(index.vmtas[n]) for n in names}
+    for block in [index.tree] + list(index.tree.walk()):
+        if any(id(c) in blocks for c in block.children):
+            block.children = _drop_with_separator(block.children, blocks)
+    members_removed = _remove_members(index, names)
+    for name in names:
+        ip = index.ip_of(index.vmtas.pop(name))
+        if ip and index.by_ip.get(ip) == name:
+            del index.by_ip[ip]
+    return {"deleted": len(names), "pool_members_removed": members_removed, "names": sorted(names)}
+
+
+def _drop_with_separator(children: List[Any], drop_ids: Set[int]) -> List[Any]:
+    """Removes the given blocks together with the blank line that separated each from the previous node."""
+    kept: List[Any] = []
+    for child in children:
+        if id(child) in drop_ids:
+            if kept and isinstance(kept[-1], pmta_config_ast.Blank):
+                kept.pop()
+            continue
+        kept.append(child)
+    return kept
+
+
+def op_move(index: VmtaIndex, op: Dict[str, Any]) -> Dict[str, Any]:
+    to_pool = op.get("to_pool")
+    if not to_pool:
+        raise ValueError("'to_pool' is required")
+    names = index.select(op.get("select"))
+    from_pool = op.get("from_pool")
+    if from_pool and from_pool not in index.pools:
+        raise ValueError(f"unknown pool '{from_pool}'")
+    sources = [from_pool] if from_pool else [p for p in index.pools if p != to_pool]
+    removed = _remove_members(index, set(names), sources)
+    added = _add_members(index, to_pool, names)
+    return {"selected": len(names), "removed": removed, "added": added, "to_pool": to_pool}
+
+
+def op_rotate_dkim(index: VmtaIndex, op: Dict[str, Any]) -> Dict[str, Any]:
+    selector = (op.get("selector") or "").strip()
+    if not selector or "," in selector:
+        raise ValueError("a valid 'selector' is required")
+    rotated, skipped = 0, []
+    key_paths = set()
+    for name in index.select(op.get("select")):
+        block = index.vmtas[name]
+        domain = index.domain_of(block)
+        if not domain:
+            skipped.append({"name": name, "reason": "no domain-key or source host domain"})
+            continue
+        value = _domain_key(domain, selector, op.get("key_path"))
+        key_paths.add(value.split(",", 2)[2])
+        block.set("domain-key", value)
+        rotated += 1
+    return {"rotated": rotated, "skipped": skipped, "key_paths": sorted(key_paths)}
+
+
+OPERATIONS = {
+    "create": op_create,
+    "delete": op_delete,
+    "move": op_move,
+    "rotate_dkim": op_rotate_dkim,
+}
+
+
+def apply_operations(tree: "pmta_config_ast.Config", operations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Applies operations to tree in place and returns one summary per operation.
+    Raises ValueError on the first invalid operation; the caller should then
+    discard the tree (nothing has been uploaded at this point).
+    """
+    if not isinstance(operations, list) or not operations:
+        raise ValueError("'operations' must be a non-empty list")
+    index = VmtaIndex(tree)
+    results = []
+    for i, op in enumerate(operations):
+        handler = OPERATIONS.get((op or {}).get("op"))
+        if handler is None:
+            raise ValueError(f"Operation {i + 1}: unknown op '{(op or {}).get('op')}' (expected one of {', '.join(OPERATIONS)})")
+        try:
+            summary = handler(index, op)
+        except ValueError as e:
+            raise ValueError(f"Operation {i + 1} ({op['op']}): {e}")
+        results.append({"op": op["op"], **summary})
+    return results
+
+
+def merge_fragment(tree: "pmta_config_ast.Config", fragment: Any) -> Dict[str, int]:
+    """
+    Adds the top-level blocks of `fragment` (text or Config) to tree: new VMTAs are
+    appended, pool members are added to existing pools, pattern-lists replace
+    existing ones, and sources/users already defined in tree are kept as they are.
+    """
+    fragment = pmta_config_ast.parse(fragment) if isinstance(fragment, str) else fragment
+    counts = {"added": 0, "members": 0, "replaced": 0, "kept": 0}
+    index = VmtaIndex(tree)
+    for block in list(fragment.blocks()):
+        name = block.arg.strip()
+        if block.tag == "virtual-mta-pool" and name in index.pools:
+            counts["members"] += _add_members(index, name, [d.value.split()[0] for d in block.directives("virtual-mta") if d.value.split()])
+            continue
+        existing = tree.index(block.tag).get(block.arg) if block.tag != "virtual-mta" else index.vmtas.get(name)
+        if existing is None:
+            tree.append(block)
+            if block.tag == "virtual-mta":
+                index.vmtas[name] = block
+            elif block.tag == "virtual-mta-pool":
+                index.pools[name] = block
+            counts["added"] += 1
+        elif block.tag in ("pattern-list", "smtp-pattern-list"):
+            existing.children = block.children
+            counts["replaced"] += 1
+        else:
+            counts["kept"] += 1
+    return counts
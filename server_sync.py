@@ -1,14 +1,42 @@
 import paramiko
 import os
+import ast
 
 IP = "162.19.228.208"
 USER = "almalinux"
 KEY_FILE = "vlkey.pem"
+REMOTE_DIR = "/opt/pmta-dashboard"
 
-FILES_TO_SYNC = [
-    ("backend.py", "/opt/pmta-dashboard/backend.py"),
-    ("pdns_automator.py", "/opt/pmta-dashboard/pdns_automator.py")
-]
+# Run as subprocesses or read from disk by backend.py rather than imported
+EXTRA_FILES = ["pdns_automator.py", "pmta-advanced.sh.tmpl", "pmta-install.sh.tmpl"]
+
+def local_modules(entry="backend.py"):
+    """entry plus every module of this directory it imports, directly or through another local module."""
+    base = os.path.dirname(os.path.abspath(__file__))
+    found, pending = [], [entry]
+    while pending:
+        name = pending.pop()
+        if name in found:
+            continue
+        found.append(name)
+        with open(os.path.join(base, name)) as f:
+            tree = ast.parse(f.read(), name)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                modules = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                modules = [node.module]
+            else:
+                continue
+            for module in modules:
+                path = module.split(".")[0] + ".py"
+                if os.path.exists(os.path.join(base, path)):
+                    pending.append(path)
+    return found
+
+# Every module backend.py needs at import time: a missing one restarts the container into an ImportError
+_MODULES = local_modules()
+FILES_TO_SYNC = [(f, f"{REMOTE_DIR}/{f}") for f in _MODULES + [f for f in EXTRA_FILES if f not in _MODULES]]
 
 # Where these files live INSIDE the Docker container
 CONTAINER_APP_DIR = "/app"
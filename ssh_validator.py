@@ -1,7 +1,8 @@
 import re
+import shlex
 import socket
 import time
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional
 
 import paramiko
 
@@ -358,3 +359,138 @@ def validate_ssh_server(
             ssh.close()
         except Exception:
             pass
+
+
+def _parse_ip_addr(text: str) -> List[str]:
+    """IPs from `ip -o addr show` output (loopback excluded)."""
+    ips: List[str] = []
+    for raw in text.splitlines():
+        parts = raw.split()
+        if len(parts) < 4 or parts[1] == "lo" or parts[2] not in ("inet", "inet6"):
+            continue
+        ip = parts[3].split("/")[0]
+        if ip not in ips:
+            ips.append(ip)
+    return ips
+
+
+def collect_server_inventory(ssh: paramiko.SSHClient, timeout_seconds: int = 10) -> Dict[str, Any]:
+    """
+    Facts used to validate PMTA configs locally: IPs bound on the server and
+    DKIM private keys present under /etc/pmta/dkim.
+    """
+    inventory: Dict[str, Any] = {"ips": [], "dkim_paths": [], "errors": []}
+
+    try:
+        ip_r = _exec(ssh, "ip -o addr show", timeout=timeout_seconds)
+        if ip_r["exit_code"] == 0:
+            inventory["ips"] = _parse_ip_addr(ip_r["stdout"])
+        else:
+            host_r = _exec(ssh, "hostname -I", timeout=timeout_seconds)
+            inventory["ips"] = host_r["stdout"].split()
+    except Exception as e:
+        inventory["errors"].append(f"IP listing failed: {str(e)}")
+
+    try:
+        dkim_r = _exec(
+            ssh,
+            r"find /etc/pmta/dkim -type f \( -name '*.private' -o -name '*.pem' -o -name '*.key' \) 2>/dev/null",
+            timeout=timeout_seconds,
+        )
+        inventory["dkim_paths"] = [ln.strip() for ln in dkim_r["stdout"].splitlines() if ln.strip()]
+    except Exception as e:
+        inventory["errors"].append(f"DKIM listing failed: {str(e)}")
+
+    return inventory
+
+
+_PEM_PUBLIC_RE = re.compile(r"-----BEGIN PUBLIC KEY-----.*?-----END PUBLIC KEY-----", re.DOTALL)
+
+
+def _parse_public_key_dump(text: str) -> Dict[str, str]:
+    """'==> path' headers each followed by a PEM public key -> {path: pem}."""
+    keys: Dict[str, str] = {}
+    for chunk in text.split("==> ")[1:]:
+        path, _, body = chunk.partition("\n")
+        m = _PEM_PUBLIC_RE.search(body)
+        if path.strip() and m:
+            keys[path.strip()] = m.group(0)
+    return keys
+
+
+def collect_dkim_public_keys(ssh: paramiko.SSHClient, key_paths: Optional[List[str]] = None,
+                             timeout_seconds: int = 20, run: Optional[Callable[[Any, str], Any]] = None) -> Dict[str, str]:
+    """
+    PEM public keys derived from DKIM private keys on the server, {key_path: pem},
+    in one round trip. Without `key_paths` every key under /etc/pmta/dkim is read.
+
+    The private keys are 640 pmta:pmta, so non-root logins need `run(ssh, command)`
+    running the command with sudo and returning (stdin, stdout, stderr) like
+    exec_command (e.g. exec_sudo_command). Keys that cannot be read or parsed are
+    left out; RuntimeError is raised when keys were found but none could be read.
+    """
+    if key_paths is not None:
+        if not key_paths:
+            return {}
+        listing = "printf '%s\\n' " + " ".join("'" + p.replace("'", "'\\''") + "'" for p in key_paths)
+    else:
+        listing = r"find /etc/pmta/dkim -type f \( -name '*.private' -o -name '*.pem' -o -name '*.key' \) 2>/dev/null"
+    script = f'{listing} | while read -r f; do echo "==> $f"; openssl rsa -in "$f" -pubout 2>&1; done'
+    # One command for sudo to wrap, pipeline included
+    command = "sh -c " + shlex.quote(script)
+    if run is None:
+        result = _exec(ssh, command, timeout=timeout_seconds)
+        out, err = result["stdout"], result["stderr"]
+    else:
+        _, stdout, stderr = run(ssh, command)
+        out = stdout.read().decode("utf-8", errors="replace")
+        err = stderr.read().decode("utf-8", errors="replace")
+
+    keys = _parse_public_key_dump(out)
+    attempted = [chunk.partition("\n")[0].strip() for chunk in out.split("==> ")[1:]]
+    if attempted and not keys:
+        detail = " ".join((err or out).split())[:300]
+        raise RuntimeError(f"could not read any of {len(attempted)} DKIM private key(s): {detail}")
+    return keys
+
+
+def _parse_df_pm_available(text: str) -> Optional[int]:
+    lines = [ln for ln in text.splitlines() if ln.strip()]
+    if len(lines) < 2:
+        return None
+    parts = re.split(r"\s+", lines[-1].strip())
+    if len(parts) >= 4 and parts[3].isdigit():
+        return int(parts[3])
+    return None
+
+
+def collect_server_resources(ssh: paramiko.SSHClient, timeout_seconds: int = 10) -> Dict[str, Any]:
+    """
+    CPU cores, RAM (MB) and free space (MB) on the filesystem holding the PMTA
+    spool, used to derive the PMTA tuning profile (see pmta_tuning.py).
+    """
+    resources: Dict[str, Any] = {"cpu_cores": None, "ram_mb": None, "disk_available_mb": None, "errors": []}
+
+    try:
+        cpu_r = _exec(ssh, "nproc", timeout=timeout_seconds)
+        if cpu_r["exit_code"] == 0 and cpu_r["stdout"].strip().isdigit():
+            resources["cpu_cores"] = int(cpu_r["stdout"].strip())
+    except Exception as e:
+        resources["errors"].append(f"CPU check failed: {str(e)}")
+
+    try:
+        ram_r = _exec(ssh, "free -m", timeout=timeout_seconds)
+        if ram_r["exit_code"] == 0:
+            resources["ram_mb"] = _parse_free_m(ram_r["stdout"])
+    except Exception as e:
+        resources["errors"].append(f"RAM check failed: {str(e)}")
+
+    try:
+        # The spool directory may not exist before install; fall back to its parent, then /
+        disk_r = _exec(ssh, "df -Pm /var/spool/pmta 2>/dev/null || df -Pm /var/spool 2>/dev/null || df -Pm /", timeout=timeout_seconds)
+        if disk_r["exit_code"] == 0:
+            resources["disk_available_mb"] = _parse_df_pm_available(disk_r["stdout"])
+    except Exception as e:
+        resources["errors"].append(f"Disk check failed: {str(e)}")
+
+    return resources
@@ -0,0 +1,253 @@
+"""
+Bulk export / import of PowerDNS zones (migrations, audits, DR restores).
+
+Export reads every zone through a pdns_client.PdnsClient, so zones whose
+serial has not moved since the last read come from the client's cache, and
+renders them either as JSON ({zone, serial, rrsets}, the PowerDNS rrset
+shape) or as BIND zone text with one `$ORIGIN` section per zone, where
+disabled records are written as `;disabled <record>` comments. Both
+formats are accepted back by import, disabled records included.
+
+Import compares each zone with the live one (pdns_automator.diff_rrsets)
+and PATCHes only the rrsets that differ, `batch_size` rrsets per request;
+missing zones are created first with the apex NS set of the import. SOA
+records are never imported: PowerDNS maintains the serial itself
+(SOA-EDIT-API). With `prune`, live rrsets absent from the import are
+deleted, which makes the zone an exact copy of the export.
+
+Zones are processed concurrently on a pool of `max_workers` threads shared
+by every export and import, so bulk runs cannot exhaust the API's
+connection pool no matter how many are in flight.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import dns.exception
+import dns.rdatatype
+import dns.zone
+
+import pdns_automator
+import pdns_client
+
+MAX_WORKERS = 8
+BATCH_SIZE = 500   # rrsets per PATCH
+
+CREATED = "created"
+UPDATED = "updated"
+UNCHANGED = "unchanged"
+PLANNED = "planned"
+ERROR = "error"
+
+DISABLED_PREFIX = ";disabled "
+
+
+def _fqdn(name: str) -> str:
+    return pdns_client.canonical(name)
+
+
+def _error(e: Exception) -> str:
+    if isinstance(e, pdns_client.PdnsError):
+        return f"HTTP {e.status}: {e.message}" if e.status else e.message
+    return str(e) or e.__class__.__name__
+
+
+def group_rrsets(records: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Flattened pdns_client records -> PowerDNS rrsets (names with a trailing dot)."""
+    rrsets: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for rec in records:
+        key = (rec["name"].lower(), rec["type"])
+        rr = rrsets.get(key)
+        if rr is None:
+            rr = rrsets[key] = {"name": _fqdn(rec["name"]), "type": rec["type"], "ttl": rec["ttl"], "records": []}
+        rr["records"].append({"content": rec["content"], "disabled": bool(rec.get("disabled"))})
+    return list(rrsets.values())
+
+
+def owning_zone(domain: str, zones: Iterable[str]) -> Optional[str]:
+    """The longest of `zones` that is `domain` or one of its parents (never a bare TLD), else None."""
+    zones = set(zones)
+    labels = domain.lower().rstrip(".").split(".")
+    for i in range(len(labels) - 1):
+        candidate = ".".join(labels[i:])
+        if candidate in zones:
+            return candidate
+    return None
+
+
+def render_bind(export: Dict[str, Any]) -> str:
+    """One zone export as BIND text; disabled records are written as comments."""
+    lines = [f"$ORIGIN {_fqdn(export['zone'])}", f"; serial {export.get('serial')}"]
+    for rr in export["rrsets"]:
+        for rec in rr["records"]:
+            line = f"{rr['name']}\t{rr['ttl']}\tIN\t{rr['type']}\t{rec['content']}"
+            lines.append(DISABLED_PREFIX + line if rec.get("disabled") else line)
+    return "\n".join(lines) + "\n"
+
+
+def parse_bind(text: str) -> List[Dict[str, Any]]:
+    """
+    BIND text with one `$ORIGIN <zone>` section per zone -> [{zone, rrsets}]
+    (or {zone, error} for a section that does not parse). `;disabled` records
+    are read back as disabled.
+    """
+    sections: List[Tuple[str, List[str]]] = []
+    for line in text.splitlines():
+        if line.strip().upper().startswith("$ORIGIN"):
+            parts = line.split()
+            sections.append((parts[1] if len(parts) > 1 else "", [line]))
+        elif sections:
+            sections[-1][1].append(line)
+        elif line.strip() and not line.strip().startswith(";"):
+            raise ValueError("records found before the first $ORIGIN line")
+
+    zones = []
+    for origin, lines in sections:
+        zone = origin.rstrip(".").lower()
+        disabled_lines = [lines[0]] + [l[len(DISABLED_PREFIX):] for l in lines if l.startswith(DISABLED_PREFIX)]
+        try:
+            parsed = dns.zone.from_text("\n".join(lines + disabled_lines[1:]), origin=_fqdn(origin),
+                                        relativize=False, check_origin=False)
+            disabled = {(name.to_text().lower(), rdataset.rdtype, rdata.to_text())
+                        for name, rdataset in dns.zone.from_text(
+                            "\n".join(disabled_lines), origin=_fqdn(origin), relativize=False,
+                            check_origin=False).iterate_rdatasets()
+                        for rdata in rdataset} if len(disabled_lines) > 1 else set()
+        except (dns.exception.DNSException, ValueError) as e:
+            zones.append({"zone": zone, "error": f"invalid zone text: {e}"})
+            continue
+        rrsets = []
+        for name, rdataset in parsed.iterate_rdatasets():
+            owner = name.to_text().lower()
+            rrsets.append({
+                "name": owner,
+                "type": dns.rdatatype.to_text(rdataset.rdtype),
+                "ttl": rdataset.ttl,
+                "records": [{"content": rdata.to_text(),
+                             "disabled": (owner, rdataset.rdtype, rdata.to_text()) in disabled}
+                            for rdata in rdataset],
+            })
+        zones.append({"zone": zone, "rrsets": rrsets})
+    return zones
+
+
+def _desired(zone: str, rrsets: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    origin = _fqdn(zone)
+    desired = []
+    for rr in rrsets:
+        name, rtype = _fqdn(rr["name"]), rr["type"].upper()
+        if name != origin and not name.endswith("." + origin):
+            raise ValueError(f"{name} is outside zone {origin}")
+        if rtype == "SOA":
+            continue
+        desired.append({
+            "name": name,
+            "type": rtype,
+            "ttl": int(rr["ttl"]),
+            "records": [{"content": r["content"], "disabled": bool(r.get("disabled"))} for r in rr["records"]],
+        })
+    return desired
+
+
+def plan_import(client: pdns_client.PdnsClient, zone: str, rrsets: Iterable[Dict[str, Any]],
+                prune: bool = False) -> Tuple[bool, List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """(zone_exists, desired rrsets, changes) for one zone; changes are REPLACE / DELETE rrsets."""
+    desired = _desired(zone, rrsets)
+    try:
+        current = pdns_automator.current_rrsets(zone, client)
+        exists = True
+    except pdns_client.PdnsError as e:
+        if e.status not in (404, 422):
+            raise
+        current, exists = {}, False
+    changes = pdns_automator.diff_rrsets(current, desired)
+    if prune:
+        keep = {pdns_automator._rrset_key(rr["name"], rr["type"]) for rr in desired}
+        changes.extend(
+            {"name": _fqdn(name), "type": rtype, "changetype": "DELETE"}
+            for name, rtype in current if (name, rtype) not in keep and rtype != "SOA"
+        )
+    return exists, desired, changes
+
+
+def _record_changes(result: Dict[str, Any], changes: List[Dict[str, Any]]) -> None:
+    result["changes"] = [{"name": c["name"], "type": c["type"], "changetype": c["changetype"]} for c in changes]
+    result["replaced"] = sum(1 for c in changes if c["changetype"] == "REPLACE")
+    result["deleted"] = len(changes) - result["replaced"]
+
+
+class ZoneTransfer:
+    def __init__(self, max_workers: int = MAX_WORKERS, batch_size: int = BATCH_SIZE):
+        self.batch_size = max(1, batch_size)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="zone-transfer")
+
+    # --- export ---
+
+    def export_zone(self, client: pdns_client.PdnsClient, zone: str, refresh: bool = False) -> Dict[str, Any]:
+        """{zone, serial, cached, rrsets} or {zone, error}."""
+        try:
+            entry, cached = client.zone(zone, refresh=refresh)
+        except pdns_client.PdnsError as e:
+            return {"zone": zone, "error": _error(e)}
+        return {"zone": zone, "serial": entry.serial[0], "cached": cached, "rrsets": group_rrsets(entry.records)}
+
+    def export(self, client: pdns_client.PdnsClient, zones: Iterable[str], refresh: bool = False) -> Iterator[Dict[str, Any]]:
+        """Zone exports in input order, fetched concurrently; stops fetching when the consumer goes away."""
+        futures = [self._pool.submit(self.export_zone, client, zone, refresh) for zone in zones]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+    # --- import ---
+
+    def import_zone(self, client: pdns_client.PdnsClient, zone: str, rrsets: List[Dict[str, Any]],
+                    prune: bool = False, dry_run: bool = False) -> Dict[str, Any]:
+        """{zone, status, replaced, deleted, patches, changes: [{name, type, changetype}], error}."""
+        result: Dict[str, Any] = {"zone": zone, "status": UNCHANGED, "replaced": 0, "deleted": 0,
+                                  "patches": 0, "changes": [], "error": None}
+        try:
+            exists, desired, changes = plan_import(client, zone, rrsets, prune=prune)
+            _record_changes(result, changes)
+            if dry_run:
+                result["status"] = PLANNED if changes or not exists else UNCHANGED
+                return result
+            if not exists:
+                apex = _fqdn(zone)
+                nameservers = [r["content"] for rr in desired if rr["name"] == apex and rr["type"] == "NS"
+                               for r in rr["records"]]
+                client.create_zone(zone, nameservers)
+                result["status"] = CREATED
+                # The zone now holds the apex NS set it was created with
+                _, _, changes = plan_import(client, zone, rrsets, prune=prune)
+                _record_changes(result, changes)
+            for start in range(0, len(changes), self.batch_size):
+                client.patch_rrsets(zone, changes[start:start + self.batch_size])
+                result["patches"] += 1
+            if changes and exists:
+                result["status"] = UPDATED
+        except (pdns_client.PdnsError, ValueError, KeyError, TypeError) as e:
+            result.update(status=ERROR, error=_error(e))
+        return result
+
+    def import_zones(self, client: pdns_client.PdnsClient, zones: Iterable[Dict[str, Any]],
+                     prune: bool = False, dry_run: bool = False) -> List[Dict[str, Any]]:
+        """Imports [{zone, rrsets}] concurrently; entries carrying an "error" are reported as is."""
+        futures: List[Any] = []
+        for entry in zones:
+            if entry.get("error"):
+                futures.append({"zone": entry.get("zone"), "status": ERROR, "replaced": 0, "deleted": 0,
+                                "patches": 0, "changes": [], "error": entry["error"]})
+            else:
+                futures.append(self._pool.submit(self.import_zone, client, entry["zone"], entry.get("rrsets") or [],
+                                                 prune, dry_run))
+        return [f if isinstance(f, dict) else f.result() for f in futures]
+
+
+def summarize(results: List[Dict[str, Any]]) -> Dict[str, int]:
+    summary = {s: 0 for s in (CREATED, UPDATED, UNCHANGED, PLANNED, ERROR)}
+    for r in results:
+        summary[r["status"]] += 1
+    summary["patches"] = sum(r["patches"] for r in results)
+    return summary